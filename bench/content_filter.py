@@ -0,0 +1,110 @@
+# ──────────────────────────────────────────────
+# bench/content_filter.py
+# ──────────────────────────────────────────────
+"""
+Microbenchmark for the relay content filter.
+
+    python -m bench.content_filter [--sizes 100 1000 10000] [--messages 5000]
+                                   [--naive 1000] [--seed 1]
+
+For each blocklist size N, N random words (plus a few phrases and re:
+rules) are compiled and --messages chat lines of 3–40 words are screened
+with `ContentFilter.screen`, 1 in 20 containing a blocked word. Reports
+compile time and per‑message cost (mean, p50, p99) for clean and dirty
+messages. The cost should stay flat as N grows.
+
+For comparison, the same messages at --naive patterns are screened the
+obvious way: one regex per pattern, each searched in turn (0 to skip).
+"""
+from __future__ import annotations
+import argparse
+import random
+import re
+import string
+import time
+
+from utils.content_filter import ContentFilter, compile_rules
+
+WORDS = "hey hello lol what where are you from nice cool ok yes no maybe haha brb".split()
+
+
+def blocklist(rng: random.Random, size: int) -> list[str]:
+    words = {"".join(rng.choice(string.ascii_lowercase) for _ in range(rng.randint(4, 10)))
+             for _ in range(size)}
+    lines = sorted(words)[:size - 10]
+    lines += [f"{a} {b}" for a, b in zip(lines[:5], lines[5:10])]        # phrases
+    lines += [rf"re:\b{w[:3]}\d+\b" for w in lines[10:15]]               # regex rules
+    return lines
+
+
+def messages(rng: random.Random, lines: list[str], n: int) -> list[tuple[str, bool]]:
+    literals = [w for w in lines if not w.startswith("re:")]
+    out = []
+    for _ in range(n):
+        words = [rng.choice(WORDS) for _ in range(rng.randint(3, 40))]
+        dirty = rng.random() < .05
+        if dirty:
+            words.insert(rng.randrange(len(words)), rng.choice(literals).upper())
+        out.append((" ".join(words), dirty))
+    return out
+
+
+def pct(samples: list[float], q: float) -> float:
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def run(size: int, args) -> dict:
+    rng   = random.Random(args.seed)
+    lines = blocklist(rng, size)
+    cf    = ContentFilter()
+    start = time.perf_counter()
+    cf.pattern, cf.rules = compile_rules(lines)
+    compiled = time.perf_counter() - start
+
+    costs: dict[bool, list[float]] = {False: [], True: []}
+    missed = 0
+    for text, dirty in messages(rng, lines, args.messages):
+        t0  = time.perf_counter()
+        hit = cf.screen(text)
+        costs[dirty].append(time.perf_counter() - t0)
+        missed += dirty and hit is None
+    assert not missed, f"{missed} dirty message(s) got through"
+    return {"size": size, "rules": cf.rules, "compile_s": compiled,
+            **{f"{kind}_{stat}": fn(costs[dirty]) * 1e6
+               for kind, dirty in (("clean", False), ("dirty", True))
+               for stat, fn in (("mean", lambda s: sum(s) / len(s)), ("p50", lambda s: pct(s, .5)),
+                                ("p99", lambda s: pct(s, .99)))}}
+
+
+def naive(size: int, args) -> float:
+    """µs per message with one compiled regex per pattern, searched in turn."""
+    rng   = random.Random(args.seed)
+    lines = blocklist(rng, size)
+    pats  = [re.compile(l[3:] if l.startswith("re:") else rf"\b{re.escape(l)}\b", re.I) for l in lines]
+    sample = messages(rng, lines, min(args.messages, 500))
+    start = time.perf_counter()
+    for text, _ in sample:
+        any(p.search(text) for p in pats)
+    return (time.perf_counter() - start) / len(sample) * 1e6
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10_000])
+    ap.add_argument("--messages", type=int, default=5000)
+    ap.add_argument("--naive", type=int, default=1000, help="patterns for the per-pattern loop (0 = skip)")
+    ap.add_argument("--seed", type=int, default=1)
+    args = ap.parse_args()
+
+    print(f"{'patterns':>9} {'compile':>9} │ {'clean µs':>8} {'p50':>6} {'p99':>6} │ {'dirty µs':>8} {'p50':>6} {'p99':>6}")
+    for size in args.sizes:
+        r = run(size, args)
+        print(f"{r['rules']:>9} {r['compile_s'] * 1000:>7.0f}ms │ {r['clean_mean']:>8.1f} {r['clean_p50']:>6.1f} "
+              f"{r['clean_p99']:>6.1f} │ {r['dirty_mean']:>8.1f} {r['dirty_p50']:>6.1f} {r['dirty_p99']:>6.1f}")
+    if args.naive:
+        print(f"\none regex per pattern, {args.naive} patterns: {naive(args.naive, args):.0f} µs/message")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,314 @@
+# ──────────────────────────────────────────────
+# bench/fakes.py
+# ──────────────────────────────────────────────
+"""
+Stand‑ins for Discord used by the load benchmarks.
+
+`FakeDiscord` is a small HTTP server that answers the webhook REST routes
+and serves attachment bytes. discord.py's own webhook client is pointed at
+it, so relayed messages go through the real serialisation, upload and 429
+retry code. It runs on its own thread and event loop so its CPU time does
+not count against the bot's loop. Latency and 429s are drawn from an RNG
+keyed on (seed, webhook, request number), so the same seed gives the same
+responses whatever order requests arrive in.
+
+The gateway side is faked with plain objects: channels subclass
+`discord.TextChannel` (the cogs check for it) but never touch a
+ConnectionState.
+"""
+from __future__ import annotations
+import asyncio
+import itertools
+import json
+import random
+import threading
+from collections import defaultdict
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from typing import Dict, Optional
+
+import discord
+import discord.webhook.async_ as webhook_http
+from aiohttp import web
+
+from utils.webhooks import _H_WEBHOOKS
+from utils.state    import state
+
+_ids = itertools.count(1_000_000_000_000_000)
+
+
+def snowflake() -> int:
+    return next(_ids)
+
+
+# ───────── REST / CDN stub ─────────
+class FakeDiscord:
+    def __init__(self, seed: int = 0, latency: float = 0.03, jitter: float = 0.02,
+                 p429: float = 0.0, retry_after: float = 0.5):
+        self.seed, self.latency, self.jitter = seed, latency, jitter
+        self.p429, self.retry_after = p429, retry_after
+        self.posts       = 0      # webhook executions answered 200
+        self.edits       = 0
+        self.deletes     = 0
+        self.rate_limits = 0      # 429s sent
+        self.bytes_in    = 0      # request bodies (uploads)
+        self._seq: Dict[str, int] = defaultdict(int)
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._thread: threading.Thread | None = None
+        self._saved_base = webhook_http.Route.BASE
+        self.base = ""
+
+    # ───── lifecycle ─────
+    def start(self):
+        ready = threading.Event()
+        self._thread = threading.Thread(target=self._serve, args=(ready,), daemon=True)
+        self._thread.start()
+        ready.wait()
+        webhook_http.Route.BASE = f"{self.base}/api/v10"
+
+    def stop(self):
+        webhook_http.Route.BASE = self._saved_base
+        if self._loop:
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._thread.join()
+
+    def _serve(self, ready: threading.Event):
+        self._loop = asyncio.new_event_loop()
+        app = web.Application(client_max_size=64 * 1024 * 1024)
+        app.router.add_post("/api/v10/webhooks/{wid}/{token}", self._execute)
+        app.router.add_patch("/api/v10/webhooks/{wid}/{token}/messages/{mid}", self._edit)
+        app.router.add_delete("/api/v10/webhooks/{wid}/{token}/messages/{mid}", self._delete)
+        app.router.add_get("/attachments/{name}/{size}", self._attachment)
+        runner = web.AppRunner(app, access_log=None)
+        self._loop.run_until_complete(runner.setup())
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        self._loop.run_until_complete(site.start())
+        port = site._server.sockets[0].getsockname()[1]
+        self.base = f"http://127.0.0.1:{port}"
+        ready.set()
+        self._loop.run_forever()
+        self._loop.run_until_complete(runner.cleanup())
+        self._loop.close()
+
+    def attachment_url(self, name: str, size: int) -> str:
+        return f"{self.base}/attachments/{name}/{size}"
+
+    # ───── handlers ─────
+    async def _respond(self, key: str) -> Optional[web.Response]:
+        """Sleep the drawn latency; a 429 response if this request is unlucky."""
+        self._seq[key] += 1
+        rng = random.Random(f"{self.seed}:{key}:{self._seq[key]}")
+        await asyncio.sleep(max(0.0, self.latency + rng.uniform(-self.jitter, self.jitter)))
+        if rng.random() < self.p429:
+            self.rate_limits += 1
+            # Via marks it as Discord's (not Cloudflare's), so discord.py sleeps and retries
+            return _json({"message": "You are being rate limited.", "global": False,
+                          "retry_after": self.retry_after}, status=429, headers={"Via": "1.1 google"})
+        return None
+
+    async def _execute(self, req: web.Request) -> web.Response:
+        body = await req.read()
+        self.bytes_in += len(body)
+        limited = await self._respond(req.match_info["wid"])
+        if limited:
+            return limited
+        self.posts += 1
+        return _json(_message(int(req.match_info["wid"])))
+
+    async def _edit(self, req: web.Request) -> web.Response:
+        await req.read()
+        limited = await self._respond(req.match_info["wid"])
+        if limited:
+            return limited
+        self.edits += 1
+        return _json(_message(int(req.match_info["wid"]), int(req.match_info["mid"])))
+
+    async def _delete(self, req: web.Request) -> web.Response:
+        limited = await self._respond(req.match_info["wid"])
+        if limited:
+            return limited
+        self.deletes += 1
+        return web.Response(status=204)
+
+    async def _attachment(self, req: web.Request) -> web.StreamResponse:
+        size = int(req.match_info["size"])
+        resp = web.StreamResponse(headers={"Content-Length": str(size)})
+        await resp.prepare(req)
+        chunk = b"\0" * 65536
+        for start in range(0, size, len(chunk)):
+            await resp.write(chunk[:size - start])
+        await resp.write_eof()
+        return resp
+
+
+def _json(data: dict, status: int = 200, headers: dict | None = None) -> web.Response:
+    # discord.py only decodes bodies whose Content-Type is exactly application/json
+    return web.Response(body=json.dumps(data).encode(), status=status,
+                        headers={"Content-Type": "application/json", **(headers or {})})
+
+
+def _message(wid: int, mid: int | None = None) -> dict:
+    return {
+        "id": str(mid or snowflake()), "channel_id": str(wid), "type": 0, "content": "",
+        "author": {"id": str(wid), "username": "userphone", "discriminator": "0000", "avatar": None},
+        "attachments": [], "embeds": [], "mentions": [], "mention_roles": [],
+        "pinned": False, "mention_everyone": False, "tts": False, "flags": 0,
+        "timestamp": datetime.now(timezone.utc).isoformat(), "edited_timestamp": None,
+        "webhook_id": str(wid),
+    }
+
+
+# ───────── gateway objects ─────────
+class FakeUser(SimpleNamespace):
+    def __init__(self, uid: int):
+        super().__init__(id=uid, bot=False, display_name=f"user{uid}",
+                         display_avatar=SimpleNamespace(url=f"https://cdn.test/avatars/{uid}.png"))
+
+
+class FakeGuild(SimpleNamespace):
+    def __init__(self, gid: int):
+        super().__init__(id=gid, filesize_limit=25 * 1024 * 1024)
+
+
+class FakeMessage(SimpleNamespace):
+    def __init__(self, channel: "FakeChannel", content: str = "", author=None,
+                 attachments=(), mid: int | None = None):
+        super().__init__(id=mid or snowflake(), channel=channel, content=content, author=author,
+                         attachments=list(attachments), stickers=[], guild=channel.guild)
+
+    async def edit(self, content: str | None = None, **_):
+        await asyncio.sleep(self.channel.latency)
+        self.content = content
+        self.channel.edits += 1
+        return self
+
+    async def delete(self):
+        await asyncio.sleep(self.channel.latency)
+
+
+class FakeAttachment(SimpleNamespace):
+    def __init__(self, url: str, size: int, filename: str):
+        super().__init__(url=url, size=size, filename=filename, description=None)
+
+    def is_spoiler(self) -> bool:
+        return False
+
+
+class FakeChannel(discord.TextChannel):
+    """A text channel whose bot‑token REST calls are simulated in process."""
+
+    def __init__(self, cid: int, guild: FakeGuild, latency: float = 0.03):
+        self.id, self.guild, self.name = cid, guild, f"chan-{cid}"
+        self.latency = latency
+        self.sent    = 0        # plain bot messages (notices, webhook fallback)
+        self.edits   = 0
+
+    def __repr__(self) -> str:
+        return f"<FakeChannel id={self.id}>"
+
+    async def send(self, content: str | None = None, **_) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        self.sent += 1
+        return FakeMessage(self, content or "")
+
+    async def fetch_message(self, mid: int) -> FakeMessage:
+        await asyncio.sleep(self.latency)
+        return FakeMessage(self, mid=mid)
+
+    def get_partial_message(self, mid: int) -> FakeMessage:
+        return FakeMessage(self, mid=mid)
+
+    async def webhooks(self) -> list:
+        await asyncio.sleep(self.latency)
+        return []
+
+    async def create_webhook(self, *, name: str, **_) -> discord.Webhook:
+        from utils.http import get_session
+        await asyncio.sleep(self.latency)
+        return discord.Webhook.partial(snowflake(), f"token-{self.id}", session=get_session())
+
+
+class _Response:
+    def __init__(self, inter: "FakeInteraction"):
+        self._inter = inter
+        self._done  = False
+
+    def is_done(self) -> bool:
+        return self._done
+
+    async def defer(self, **_):
+        await asyncio.sleep(self._inter.channel.latency)
+        self._done = True
+
+    async def send_message(self, content: str | None = None, **_):
+        await asyncio.sleep(self._inter.channel.latency)
+        self._done = True
+        self._inter.replies.append(content)
+
+
+class FakeInteraction(discord.Interaction):
+    def __init__(self, channel: FakeChannel, user: FakeUser):
+        self.channel, self.user = channel, user
+        self._cs_response = _Response(self)
+        self.replies: list[str] = []
+        self._original: FakeMessage | None = None
+
+    @property
+    def guild(self) -> FakeGuild:
+        return self.channel.guild
+
+    async def edit_original_response(self, content: str | None = None, **_) -> FakeMessage:
+        await asyncio.sleep(self.channel.latency)
+        self.replies.append(content)
+        if self._original is None:
+            self._original = FakeMessage(self.channel, content or "")
+        self._original.content = content
+        return self._original
+
+
+class FakeBot:
+    """Just enough of commands.Bot for the cogs' lookups."""
+
+    def __init__(self):
+        self.user     = FakeUser(snowflake())
+        self.user.bot = True
+        self.channels: Dict[int, FakeChannel] = {}
+        self.guilds:   list[FakeGuild] = []
+        self.users:    Dict[int, FakeUser] = {}
+
+    def get_channel(self, cid: int) -> Optional[FakeChannel]:
+        return self.channels.get(cid)
+
+    def get_user(self, uid: int) -> Optional[FakeUser]:
+        return self.users.get(uid)
+
+    def get_guild(self, gid: int) -> Optional[FakeGuild]:
+        return next((g for g in self.guilds if g.id == gid), None)
+
+    def get_cog(self, name: str):
+        return None
+
+    async def wait_until_ready(self):
+        return
+
+    def add_guild(self, channels: int, latency: float) -> list[FakeChannel]:
+        guild = FakeGuild(snowflake())
+        self.guilds.append(guild)
+        made = [FakeChannel(snowflake(), guild, latency) for _ in range(channels)]
+        self.channels.update((ch.id, ch) for ch in made)
+        return made
+
+    def add_user(self) -> FakeUser:
+        user = FakeUser(snowflake())
+        self.users[user.id] = user
+        return user
+
+
+async def preload_webhooks(channels: list[FakeChannel]):
+    """Store a webhook per channel the way a warmed‑up cluster would have them."""
+    if state._r is None:
+        return
+    pipe = state._r.pipeline(transaction=False)
+    for ch in channels:
+        pipe.hset(_H_WEBHOOKS, str(ch.id), f"{snowflake()}:token-{ch.id}")
+    await pipe.execute()
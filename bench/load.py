@@ -0,0 +1,319 @@
+# ──────────────────────────────────────────────
+# bench/load.py
+# ──────────────────────────────────────────────
+"""
+Offline load simulation: Pairing and Relay against a fake Discord.
+
+    python -m bench.load [relay storm attachments] [--seed 1] [--redis fake|none|URL]
+                         [--json out.json] [--baseline old.json] [scenario knobs…]
+
+Scenarios
+  relay        --calls live calls (default 10k) exchanging --messages at
+               --rate msg/s through the real webhook client and Outbox
+  storm        --callers hitting /call at once across --guilds, then all
+               hanging up
+  attachments  a few hundred calls sending 1–3 files each (some above the
+               passthrough limit), downloaded from the stub CDN
+
+Each scenario runs in a fresh interpreter so RSS and caches don't leak
+between them; the table reports throughput, p50/p99 latency (from
+on_message / the slash command being invoked to it returning) and peak
+RSS. Message timing, sizes and the stub's latency / 429 draws all come
+from --seed, so two runs of the same tree are comparable; --baseline
+prints the change against a previous --json.
+
+`--redis fake` (default) uses fakeredis with its Lua engine, from
+`pip install -r requirements-dev.txt`; `none` the JSON fallback (state
+files go to a temp dir), and a redis:// URL a real server – its `up:*`
+keys are deleted first, so point it at a scratch instance. fakeredis
+runs in the bot's process and costs far more per command than a real
+server, so with it the absolute numbers are a floor; compare runs with
+each other, not with production.
+
+The load is open‑loop: message i is posted at i / --rate seconds whether
+or not earlier ones are done, so an offered rate above what the tree can
+carry shows up as growing latency rather than a lower send rate. A
+channel's author posts again every (2 × calls) / rate seconds; below the
+1 s relay cooldown those messages are dropped and counted as such.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import json
+import logging
+import pathlib
+import random
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+from utils.state       import state, _END_CALL_LUA
+from utils.history     import history
+from utils.http        import open_session, close_session
+from utils.webhooks    import outbox
+from bench.fakes       import FakeDiscord, FakeBot, FakeMessage, FakeAttachment, FakeInteraction, \
+                              preload_webhooks
+
+SCENARIOS = ("relay", "storm", "attachments")
+WORDS = "hey hello lol what where are you from nice cool ok yes no maybe haha brb".split()
+
+
+# ───────── environment ─────────
+async def use_redis(spec: str):
+    """Point the shared state at the backend named by --redis."""
+    if spec == "none":
+        client = None
+        tmp = pathlib.Path(tempfile.mkdtemp(prefix="userphone-bench-"))
+        state._settings_store.path = tmp / "user_settings.json"
+        state._calls_store.path    = tmp / "call_state.json"
+        history._store.path        = tmp / "call_stats.json"
+        history.log_path           = tmp / "call_events.jsonl"
+        history.load()
+    elif spec == "fake":
+        try:
+            import fakeredis, lupa      # noqa: F401 – lupa runs the Lua scripts
+        except ImportError:
+            raise SystemExit("--redis fake needs fakeredis[lua]: pip install -r requirements-dev.txt")
+        from redis.asyncio import BlockingConnectionPool
+        # a bounded pool: every fake connection is costly to create
+        client = fakeredis.aioredis.FakeRedis(decode_responses=True, max_connections=64,
+                                              connection_pool_class=BlockingConnectionPool)
+        client.connection_pool.timeout = None       # queue behind the pool, however long
+    else:
+        import redis.asyncio as aioredis
+        client = aioredis.from_url(spec, decode_responses=True)
+        async for key in client.scan_iter("up:*", count=1000):
+            await client.delete(key)
+    state._redis = client
+    state._end_call = client.register_script(_END_CALL_LUA) if client else None
+
+
+def pct(samples: list[float], q: float) -> float:
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024      # KiB on Linux
+
+
+async def timed(coro, out: list[float]):
+    start = time.perf_counter()
+    await coro
+    out.append(time.perf_counter() - start)
+
+
+async def open_calls(bot: FakeBot, calls: int, latency: float, per_guild: int = 10):
+    """`calls` live calls between channels of different guilds; returns the channels."""
+    per_guild = max(1, min(per_guild, calls))
+    left, right = [], []
+    for _ in range(-(-calls // per_guild)):
+        left  += bot.add_guild(per_guild, latency)
+        right += bot.add_guild(per_guild, latency)
+    left, right = left[:calls], right[:calls]
+    for i in range(0, calls, 500):
+        await asyncio.gather(*(state.start_call(a.id, b.id, False)
+                               for a, b in zip(left[i:i + 500], right[i:i + 500])))
+    channels = left + right
+    await preload_webhooks(channels)
+    return channels
+
+
+async def drive_messages(relay, channels, rng: random.Random, messages: int, rate: float,
+                         attachments=None) -> dict:
+    """Open‑loop: message i is posted at i / rate s whether or not earlier ones are done."""
+    authors = {ch.id: relay.bot.add_user() for ch in channels}
+    order   = rng.sample(channels, len(channels))
+    latencies: list[float] = []
+    tasks = []
+    start = time.perf_counter()
+    for i in range(messages):
+        due = start + i / rate
+        delay = due - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        ch   = order[i % len(order)]
+        text = " ".join(rng.choices(WORDS, k=rng.randint(1, 12)))
+        msg  = FakeMessage(ch, text, authors[ch.id], attachments(rng) if attachments else ())
+        tasks.append(asyncio.create_task(timed(relay.on_message(msg), latencies)))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - start
+    stats = outbox.stats()
+    return {
+        "messages":   messages,
+        "delivered":  stats["delivered"],
+        "dropped":    messages - stats["delivered"],     # per‑user cooldown
+        "coalesced":  stats["coalesced"],
+        "msgs_per_s": stats["delivered"] / elapsed,
+        "p50_ms":     pct(latencies, .50) * 1000,
+        "p99_ms":     pct(latencies, .99) * 1000,
+        "max_ms":     max(latencies, default=0) * 1000,
+        "elapsed_s":  elapsed,
+    }
+
+
+# ───────── scenarios ─────────
+async def relay_scenario(args, stub: FakeDiscord, rng: random.Random) -> dict:
+    from cogs.relay import Relay
+    bot = FakeBot()
+    channels = await open_calls(bot, args.calls, args.latency)
+    return await drive_messages(Relay(bot), channels, rng, args.messages, args.rate)
+
+
+async def attachments_scenario(args, stub: FakeDiscord, rng: random.Random) -> dict:
+    from cogs.relay import Relay
+    mb = 1024 * 1024
+
+    def files(r: random.Random) -> list[FakeAttachment]:
+        out = []
+        for n in range(r.randint(1, 3)):
+            roll = r.random()
+            size = (r.randint(50_000, mb) if roll < .70 else
+                    r.randint(mb, 8 * mb) if roll < .95 else
+                    r.randint(8 * mb, 20 * mb))
+            out.append(FakeAttachment(stub.attachment_url(f"f{n}", size), size, f"file{n}.bin"))
+        return out
+
+    bot = FakeBot()
+    channels = await open_calls(bot, args.file_calls, args.latency)
+    result = await drive_messages(Relay(bot), channels, rng, args.file_messages, args.file_rate, files)
+    result["uploaded_mb"] = stub.bytes_in / mb
+    return result
+
+
+async def storm_scenario(args, stub: FakeDiscord, rng: random.Random) -> dict:
+    from cogs.pairing import Pairing
+    bot = FakeBot()
+    pairing = Pairing(bot)
+    per_guild = max(1, args.callers // args.guilds)
+    channels = [ch for _ in range(args.guilds) for ch in bot.add_guild(per_guild, args.latency)]
+    rng.shuffle(channels)
+    inters = [FakeInteraction(ch, bot.add_user()) for ch in channels]
+
+    latencies: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(pairing._handle_call(i, anon=False), latencies) for i in inters))
+    call_elapsed = time.perf_counter() - start
+
+    outcomes: dict[str, int] = {}
+    for i in inters:
+        final = (i.replies or ["?"])[-1]
+        key = ("error"   if final.startswith("⚠️") else
+               "queued"  if any(r.startswith("📞") for r in i.replies) else
+               "instant" if final.startswith("☎️") else "other")
+        outcomes[key] = outcomes.get(key, 0) + 1
+
+    # every paired channel must point back at its partner
+    active = await state.get_all_active_calls()
+    broken = sum(1 for a, b in active.items() if active.get(b) != a)
+
+    hang: list[float] = []
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(pairing.hangup.callback(pairing, FakeInteraction(i.channel, i.user)), hang)
+                           for i in inters))
+    hang_elapsed = time.perf_counter() - start
+    return {
+        "callers":        len(inters),
+        "calls_per_s":    len(inters) / call_elapsed,
+        "p50_ms":         pct(latencies, .50) * 1000,
+        "p99_ms":         pct(latencies, .99) * 1000,
+        "pairs":          len(active) // 2,
+        "broken":         broken,
+        "hangups_per_s":  len(inters) / hang_elapsed,
+        "hangup_p99_ms":  pct(hang, .99) * 1000,
+        "left_active":    await state.get_active_calls_count(),
+        **outcomes,
+    }
+
+
+_RUN = {"relay": relay_scenario, "storm": storm_scenario, "attachments": attachments_scenario}
+
+
+async def run_one(name: str, args) -> dict:
+    logging.getLogger("discord").setLevel(logging.ERROR)      # 429 retry warnings
+    random.seed(args.seed)
+    rng  = random.Random(f"{args.seed}:{name}")
+    stub = FakeDiscord(args.seed, args.latency, args.jitter, args.p429, args.retry_after)
+    stub.start()
+    await use_redis(args.redis)
+    await open_session()
+    try:
+        result = await _RUN[name](args, stub, rng)
+    finally:
+        await close_session()
+        stub.stop()
+    result.update(scenario=name, posts=stub.posts, rate_limited=stub.rate_limits, rss_mb=rss_mb())
+    return result
+
+
+# ───────── reporting ─────────
+_HEADLINE = {"relay":       ("msgs_per_s", "p99_ms"),
+             "attachments": ("msgs_per_s", "p99_ms"),
+             "storm":       ("calls_per_s", "p99_ms")}
+
+
+def report(results: list[dict], baseline: dict[str, dict]):
+    for r in results:
+        name = r["scenario"]
+        print(f"\n── {name} " + "─" * (40 - len(name)))
+        old = baseline.get(name, {})
+        for key, value in r.items():
+            if key == "scenario":
+                continue
+            line = f"  {key:<15} {value:>12.1f}" if isinstance(value, float) else f"  {key:<15} {value:>12}"
+            if key in (*_HEADLINE[name], "rss_mb") and old.get(key):
+                line += f"   ({(value - old[key]) / old[key]:+.1%} vs baseline)"
+            print(line)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("scenarios", nargs="*", metavar="scenario", help=" | ".join(SCENARIOS))
+    ap.add_argument("--seed",        type=int,   default=1)
+    ap.add_argument("--redis",       default="fake", help="fake | none | redis://…")
+    ap.add_argument("--latency",     type=float, default=0.03, help="mean Discord REST latency (s)")
+    ap.add_argument("--jitter",      type=float, default=0.02)
+    ap.add_argument("--p429",        type=float, default=0.01, help="share of webhook posts answered 429")
+    ap.add_argument("--retry-after", type=float, default=0.5)
+    ap.add_argument("--calls",       type=int,   default=10_000)
+    ap.add_argument("--messages",    type=int,   default=10_000)
+    ap.add_argument("--rate",        type=float, default=150, help="offered msg/s")
+    ap.add_argument("--callers",     type=int,   default=2_000)
+    ap.add_argument("--guilds",      type=int,   default=200)
+    ap.add_argument("--file-calls",    type=int,   default=200)
+    ap.add_argument("--file-messages", type=int,   default=1_000)
+    ap.add_argument("--file-rate",     type=float, default=25)
+    ap.add_argument("--json",     help="write results here")
+    ap.add_argument("--baseline", help="compare against an earlier --json")
+    ap.add_argument("--child",    help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        ap.error(f"unknown scenario(s): {', '.join(sorted(unknown))}")
+    if args.child:
+        print(json.dumps(asyncio.run(run_one(args.child, args))))
+        return
+
+    passthrough = [a for a in sys.argv[1:] if a not in SCENARIOS]
+    results = []
+    for name in args.scenarios or SCENARIOS:
+        print(f"running {name}…", file=sys.stderr)
+        out = subprocess.run([sys.executable, "-m", "bench.load", *passthrough, "--child", name],
+                             stdout=subprocess.PIPE, text=True, check=True)
+        results.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    baseline = {}
+    if args.baseline:
+        baseline = {r["scenario"]: r for r in json.loads(pathlib.Path(args.baseline).read_text())}
+    report(results, baseline)
+    if args.json:
+        pathlib.Path(args.json).write_text(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# ──────────────────────────────────────────────
+# bench/matchmaking.py
+# ──────────────────────────────────────────────
+"""
+Microbenchmark for in‑process partner selection.
+
+    python -m bench.matchmaking [--sizes 100 1000 10000 50000] [--ops 2000]
+
+Any two callers from different guilds match immediately, so a long queue
+can only build up from a single guild. Each run fills the queue with N
+callers from that guild and then times, per op:
+
+  * a caller from the same guild, who must be queued (then cancels), and
+  * a caller from another guild, who matches the oldest entry (which is
+    then refilled so the queue length stays at N).
+
+Per‑op cost should stay flat as N grows.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import time
+
+from utils.matchmaking import Matchmaker
+
+QUEUED_GUILD = 1
+OTHER_GUILD  = 2
+
+
+async def run(size: int, ops: int) -> tuple[float, float]:
+    mm  = Matchmaker()
+    ids = iter(range(1_000, 10**9))
+
+    for _ in range(size):
+        n = next(ids)
+        await mm.enqueue_or_match(n, n, QUEUED_GUILD, anon=False)
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        n = next(ids)
+        match = await mm.enqueue_or_match(n, n, QUEUED_GUILD, anon=False)
+        assert match.position == size + 1
+        await mm.cancel(n)
+    queued = (time.perf_counter() - start) / ops
+
+    start = time.perf_counter()
+    for _ in range(ops):
+        n = next(ids)
+        match = await mm.enqueue_or_match(n, n, OTHER_GUILD, anon=False)
+        assert match.partner is not None
+        n = next(ids)
+        await mm.enqueue_or_match(n, n, QUEUED_GUILD, anon=False)
+    matched = (time.perf_counter() - start) / ops
+    return queued, matched
+
+
+async def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", type=int, nargs="+", default=[100, 1_000, 10_000, 50_000])
+    ap.add_argument("--ops",   type=int, default=2_000)
+    args = ap.parse_args()
+
+    print(f"{'queued':>8}  {'µs/enqueue':>10}  {'µs/match':>9}")
+    for size in args.sizes:
+        queued, matched = await run(size, args.ops)
+        print(f"{size:>8}  {queued * 1e6:>10.2f}  {matched * 1e6:>9.2f}")
+
+if __name__ == "__main__":
+    asyncio.run(main())
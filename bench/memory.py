@@ -0,0 +1,129 @@
+# ──────────────────────────────────────────────
+# bench/memory.py
+# ──────────────────────────────────────────────
+"""
+Client cache footprint: default vs lean (UP_LEAN_CACHE) settings.
+
+    python -m bench.memory [--guilds 1000] [--members 100] [--chunked 400]
+                           [--channels 20] [--messages 20000]
+
+Synthetic gateway payloads are fed straight into a real discord.py
+ConnectionState built with utils.gateway.client_options(): GUILD_CREATE
+for every guild (with --members members inline), the member chunks that
+startup chunking would fetch (--chunked more per guild, only when the
+settings chunk) and a stream of MESSAGE_CREATEs. Each mode runs in a
+fresh interpreter; the RSS growth is reported per 1k guilds.
+"""
+from __future__ import annotations
+import argparse
+import gc
+import json
+import subprocess
+import sys
+from datetime import datetime, timezone
+
+import discord
+
+from utils.gateway import client_options
+
+NOW = datetime.now(timezone.utc).isoformat()
+
+
+def rss_mb() -> float:
+    with open("/proc/self/status") as f:
+        for line in f:
+            if line.startswith("VmRSS:"):
+                return int(line.split()[1]) / 1024
+    return 0.0
+
+
+def _user(uid: int) -> dict:
+    return {"id": str(uid), "username": f"user{uid}", "discriminator": "0", "avatar": None,
+            "global_name": f"User {uid}"}
+
+
+def _member(uid: int) -> dict:
+    return {"user": _user(uid), "roles": [], "joined_at": NOW, "deaf": False, "mute": False,
+            "nick": None, "flags": 0}
+
+
+def _guild(gid: int, members: int, total: int, channels: int) -> dict:
+    return {
+        "id": str(gid), "name": f"guild {gid}", "owner_id": str(gid * 1000), "member_count": total,
+        "large": total > 250, "features": [], "emojis": [], "stickers": [], "threads": [],
+        "stage_instances": [], "guild_scheduled_events": [], "voice_states": [], "presences": [],
+        "roles": [{"id": str(gid), "name": "@everyone", "permissions": "0", "position": 0,
+                   "color": 0, "hoist": False, "managed": False, "mentionable": False}],
+        "channels": [{"id": str(gid * 1000 + c), "type": 0, "name": f"chan-{c}", "position": c,
+                      "permission_overwrites": [], "guild_id": str(gid)} for c in range(channels)],
+        "members": [_member(gid * 1000 + m) for m in range(members)],
+    }
+
+
+def run(lean: bool, args) -> dict:
+    client = discord.Client(**client_options(lean))
+    conn   = client._connection
+    gc.collect()
+    base = rss_mb()
+
+    guilds = range(1, args.guilds + 1)
+    for gid in guilds:
+        conn._get_create_guild(_guild(gid, args.members, args.members + args.chunked, args.channels))
+    if conn.member_cache_flags.joined and client_options(lean).get("chunk_guilds_at_startup", True):
+        # what a completed chunk request stores (parse_guild_members_chunk needs a live request)
+        for guild in conn.guilds:
+            for m in range(args.chunked):
+                data = _member(guild.id * 1000 + args.members + m)
+                guild._add_member(discord.Member(data=data, guild=guild, state=conn))
+
+    for n in range(args.messages):
+        gid  = guilds[n % len(guilds)]
+        uid  = gid * 1000 + n % (args.members + args.chunked)
+        conn.parse_message_create({
+            "id": str(10**15 + n), "channel_id": str(gid * 1000 + n % args.channels),
+            "guild_id": str(gid), "author": _user(uid), "member": _member(uid),
+            "content": "hello there " * 4, "timestamp": NOW, "edited_timestamp": None,
+            "tts": False, "mention_everyone": False, "mentions": [], "mention_roles": [],
+            "attachments": [], "embeds": [], "pinned": False, "type": 0,
+        })
+    gc.collect()
+    grown = rss_mb() - base
+    return {
+        "mode":            "lean" if lean else "default",
+        "rss_mb":          grown,
+        "mb_per_1k":       grown / args.guilds * 1000,
+        "cached_members":  sum(len(g._members) for g in conn.guilds),
+        "cached_messages": len(conn._messages or ()),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--guilds",   type=int, default=1_000)
+    ap.add_argument("--members",  type=int, default=100, help="members sent with GUILD_CREATE")
+    ap.add_argument("--chunked",  type=int, default=400, help="members fetched by startup chunking")
+    ap.add_argument("--channels", type=int, default=20)
+    ap.add_argument("--messages", type=int, default=20_000)
+    ap.add_argument("--child",    choices=["default", "lean"], help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.child:
+        print(json.dumps(run(args.child == "lean", args)))
+        return
+
+    rows = []
+    for mode in ("default", "lean"):
+        out = subprocess.run([sys.executable, "-m", "bench.memory", *sys.argv[1:], "--child", mode],
+                             stdout=subprocess.PIPE, text=True, check=True)
+        rows.append(json.loads(out.stdout.strip().splitlines()[-1]))
+
+    print(f"{args.guilds} guilds × ({args.members} + {args.chunked} chunked) members, "
+          f"{args.channels} channels, {args.messages} messages")
+    print(f"{'mode':<8} {'RSS MiB':>9} {'MiB/1k guilds':>14} {'members':>9} {'messages':>9}")
+    for r in rows:
+        print(f"{r['mode']:<8} {r['rss_mb']:>9.1f} {r['mb_per_1k']:>14.1f} "
+              f"{r['cached_members']:>9} {r['cached_messages']:>9}")
+
+
+if __name__ == "__main__":
+    main()
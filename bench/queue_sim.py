@@ -0,0 +1,162 @@
+# ──────────────────────────────────────────────
+# bench/queue_sim.py
+# ──────────────────────────────────────────────
+"""
+Queue wait simulation: the real Matchmaker on a simulated clock.
+
+    python -m bench.queue_sim [--hours 48] [--rate 0.4] [--guilds 30] [--patience 4]
+                              [--ghost 45] [--ttl 5] [--seed 1] [--json out.json]
+
+Callers arrive as a Poisson stream (--rate per minute) from --guilds
+guilds of Zipf‑skewed size and run /call. A caller who is still queued
+after their patience (exponential, mean --patience minutes) walks away
+without hanging up, which is what people do. Their entry stays behind as
+a ghost. Whoever gets matched with a ghost sits in a dead call for
+--ghost seconds, hangs up and calls again. A caller told "no one
+answered" (the TTL sweep) calls again straight away if they are still
+there.
+
+The same arrivals and patience draws run twice through the in‑process
+queue: without a TTL (the old behaviour) and with --ttl minutes. Waits
+are measured per person, from their first /call to being connected to
+someone who is actually there. Deleted channels are not modelled: they
+behave like ghosts when they can't be detected and cost nothing once
+they're evicted on the channel‑delete event.
+
+The defaults are quiet‑hour traffic, where ghosts pile up and the TTL
+shows: ghost matches -33 %, p50 17 s → 10 s. p95 does not move (227 s
+either way) and no queue order would move it. Two callers from different
+guilds are matched the moment they meet, so every live entry in a queue
+belongs to one guild and the order only decides which of its callers
+goes first. The tail is the gap until someone from another guild calls.
+At busier rates (--rate 1.5) there are too few ghosts for the TTL to
+change anything.
+"""
+from __future__ import annotations
+import argparse
+import asyncio
+import heapq
+import json
+import random
+from dataclasses import dataclass
+from types import SimpleNamespace
+
+from utils import matchmaking
+from utils.matchmaking import Matchmaker
+from bench.load import pct, use_redis
+
+
+@dataclass
+class Caller:
+    uid:      int
+    gid:      int
+    first:    float         # first /call
+    leaves:   float         # walks away if not connected by then
+    gone:     bool = False
+    done:     bool = False
+
+
+async def simulate(args, ttl_minutes: int) -> dict:
+    await use_redis("none")                 # the in‑process queue
+    rng   = random.Random(args.seed)
+    clock = SimpleNamespace(now=0.0)
+    matchmaking.time = SimpleNamespace(time=lambda: clock.now)      # the queue reads this clock
+    mm = Matchmaker()
+    mm.QUEUE_TTL = ttl_minutes * 60
+
+    weights = [1 / (g + 1) ** 1.1 for g in range(args.guilds)]
+    end     = args.hours * 3600
+    events: list[tuple[float, int, str, int]] = []      # (time, seq, kind, uid)
+    seq = 0
+
+    def at(t: float, kind: str, uid: int):
+        nonlocal seq
+        seq += 1
+        heapq.heappush(events, (t, seq, kind, uid))
+
+    callers: dict[int, Caller] = {}
+    t = 0.0
+    while True:
+        t += rng.expovariate(args.rate / 60)
+        if t >= end:
+            break
+        uid = len(callers) + 1
+        gid = rng.choices(range(args.guilds), weights)[0]
+        callers[uid] = Caller(uid, gid, t, t + rng.expovariate(1 / (args.patience * 60)))
+        at(t, "call", uid)
+        at(callers[uid].leaves, "leave", uid)
+    for s in range(0, int(end), 30):         # Pairing.QUEUE_SWEEP
+        at(s, "sweep", 0)
+
+    waits, ghosts, expired, calls = [], 0, 0, 0
+    while events:
+        clock.now, _, kind, uid = heapq.heappop(events)
+        c = callers.get(uid)
+        if kind == "sweep":
+            for cid in await mm.expire():
+                expired += 1
+                if not callers[cid].gone:
+                    at(clock.now, "call", cid)          # "no one answered" → try again
+        elif kind == "leave":
+            if not c.done:
+                c.gone = True                           # stays queued as a ghost, if queued
+        elif kind == "call" and not (c.gone or c.done):
+            calls += 1
+            # channel id = user id: one channel per caller
+            match = await mm.enqueue_or_match(uid, uid, c.gid, False)
+            if match.partner is None:
+                continue
+            partner = callers[match.partner]
+            if partner.gone:
+                ghosts += 1
+                at(clock.now + args.ghost, "call", uid)  # dead air, hang up, call again
+                continue
+            for side in (c, partner):
+                side.done = True
+                waits.append(clock.now - side.first)
+
+    served = len(waits)
+    return {
+        "mode":      f"ttl {ttl_minutes} min" if ttl_minutes else "no ttl",
+        "callers":   len(callers),
+        "connected": served,
+        "calls":     calls,
+        "ghost_matches": ghosts,
+        "expired":   expired,
+        "p50_s":     pct(waits, .50),
+        "p95_s":     pct(waits, .95),
+        "p99_s":     pct(waits, .99),
+    }
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    ap.add_argument("--hours",    type=float, default=48)
+    ap.add_argument("--rate",     type=float, default=0.4, help="new callers per minute")
+    ap.add_argument("--guilds",   type=int,   default=30)
+    ap.add_argument("--patience", type=float, default=4,   help="mean minutes before walking away")
+    ap.add_argument("--ghost",    type=float, default=45,  help="s spent in a call with nobody there")
+    ap.add_argument("--ttl",      type=int,   default=Matchmaker.QUEUE_TTL // 60, help="queue TTL in minutes")
+    ap.add_argument("--seed",     type=int,   default=1)
+    ap.add_argument("--json",     help="write the results here")
+    args = ap.parse_args()
+
+    rows = [asyncio.run(simulate(args, ttl)) for ttl in (0, args.ttl)]
+    print(f"{args.hours:g} h, {args.rate:g} callers/min from {args.guilds} guilds, "
+          f"patience ~{args.patience:g} min, seed {args.seed}")
+    print(f"{'mode':<12} {'connected':>10} {'calls':>7} {'ghosts':>7} {'expired':>8} "
+          f"{'p50 s':>7} {'p95 s':>7} {'p99 s':>7}")
+    for r in rows:
+        print(f"{r['mode']:<12} {r['connected']:>10} {r['calls']:>7} {r['ghost_matches']:>7} "
+              f"{r['expired']:>8} {r['p50_s']:>7.0f} {r['p95_s']:>7.0f} {r['p99_s']:>7.0f}")
+    base, new = rows
+    for key, label in (("ghost_matches", "ghost matches"), ("p50_s", "p50 wait"), ("p95_s", "p95 wait")):
+        if base[key]:
+            print(f"{label}: {base[key]:.0f} → {new[key]:.0f} ({(new[key] - base[key]) / base[key]:+.0%})")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(rows, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
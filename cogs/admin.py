@@ -1,10 +1,24 @@
 # ──────────────────────────────────────────────
 # cogs/admin.py
 # ──────────────────────────────────────────────
+import re
 import discord
 from discord import app_commands
 from discord.ext import commands, tasks
-from utils.state import state
+from utils.state       import state
+from utils.matchmaking import matchmaker
+from utils.cmdsync     import sync_if_changed
+from utils.metrics     import (RELAY_STAGE, QUEUE_WAIT, CALL_REQUESTS, MATCHES, RATE_LIMITED, FILTERED,
+                               OUTBOX, OUTBOX_WAIT)
+from utils.redis_pool  import breaker
+from utils.history     import history
+from utils.content_filter import content_filter, POLICIES
+
+def _ms(seconds):
+    return "–" if seconds is None else f"{seconds * 1000:.0f} ms"
+
+def _span(seconds):
+    return "–" if seconds is None else f"{int(seconds // 60)}m {int(seconds % 60):02d}s"
 
 class Admin(commands.Cog):
     """Administrative commands and monitoring"""
@@ -17,8 +31,8 @@ class Admin(commands.Cog):
 
     @app_commands.command(name="queue", description="Show current queue status")
     async def queue_status(self, interaction: discord.Interaction):
-        regular = len(state.waiting_queue)
-        anon    = len(state.anon_queue)
+        regular = await matchmaker.length(anon=False)
+        anon    = await matchmaker.length(anon=True)
         active  = await state.get_active_calls_count()
         msg = (f"📊 **Queue Status**\n"
                f"Regular queue: {regular}\n"
@@ -28,20 +42,84 @@ class Admin(commands.Cog):
 
     @app_commands.command(name="stats", description="Show detailed userphone statistics")
     async def stats(self, interaction: discord.Interaction):
-        regular = len(state.waiting_queue)
-        anon    = len(state.anon_queue)
+        regular = await matchmaker.length(anon=False)
+        anon    = await matchmaker.length(anon=True)
         active  = await state.get_active_calls_count()
+        pairing = interaction.client.get_cog("Pairing")
         stats = (f"📈 **UserPhone Statistics**\n"
                  f"📞 Regular queue: {regular} waiting\n"
                  f"👤 Anonymous queue: {anon} waiting\n"
                  f"🔗 Active calls: {active}\n"
+                 f"🧹 Stale calls reaped: {getattr(pairing, 'reaped_total', 0)}\n"
                  f"🌐 Total servers: {len(interaction.client.guilds)}")
+        requests = CALL_REQUESTS.total()
+        if requests:
+            wait = QUEUE_WAIT.quantile(.5)
+            stats += (f"\n🎯 Instant match rate: {MATCHES.total() / requests:.0%} of {requests:.0f} calls"
+                      f"\n⏳ Median queue wait: {'–' if wait is None else f'{wait:.0f} s'}")
+        # call history, from the precomputed rollups (utils/history.py)
+        h = await history.summary()
+        if h.calls:
+            stats += (f"\n📅 Calls: {h.last_day} in the last 24 h (peak {h.peak_hour}/h) · {h.calls} all time"
+                      f"\n⌛ Avg wait for a match: {_span(h.avg_wait)} · avg call: {_span(h.avg_talk)}")
+        if h.durations:
+            stats += "\n📊 Call lengths: " + " · ".join(f"{label} {n}" for label, n in h.durations)
+        if h.top_guilds:
+            names = (getattr(interaction.client.get_guild(gid), "name", None) or str(gid) for gid, _ in h.top_guilds)
+            stats += "\n🏆 Busiest servers: " + ", ".join(
+                f"{name} ({n})" for name, (_, n) in zip(names, h.top_guilds))
+        for stage in ("state", "filter", "attachments", "stickers", "send", "total"):
+            if stage in RELAY_STAGE.series:
+                stats += (f"\n⏱️ Relay {stage}: p50 {_ms(RELAY_STAGE.quantile(.5, stage))}"
+                          f" · p99 {_ms(RELAY_STAGE.quantile(.99, stage))}")
+        if FILTERED.total():
+            stats += "\n🛡️ Filtered: " + " · ".join(f"{n:.0f} {action}" for action, n in FILTERED.values.items())
+        posts = OUTBOX.values.get("posts", 0)
+        if posts:
+            stats += (f"\n📮 Outbox: {OUTBOX.values['delivered']:.0f} messages in {posts:.0f} posts"
+                      f" · p99 wait {_ms(OUTBOX_WAIT.quantile(.99))}")
+        if RATE_LIMITED.total():
+            stats += f"\n🚦 Discord 429s: {RATE_LIMITED.total():.0f}"
+        if state.degraded:
+            stats += "\n⚠️ Redis unreachable – serving from memory"
+        if breaker.trips:
+            stats += f"\n🔌 Redis outages since start: {breaker.trips}"
         await interaction.response.send_message(stats)
 
+    filter_group = app_commands.Group(name="filter", description="Content filter for relayed messages",
+                                      default_permissions=discord.Permissions(manage_guild=True),
+                                      guild_only=True)
+
+    @filter_group.command(name="policy", description="What happens to blocked messages in this channel's calls")
+    @app_commands.describe(action="redact: blank out the match · drop: don't relay it · hangup: end the call")
+    @app_commands.choices(action=[app_commands.Choice(name=p, value=p) for p in POLICIES])
+    async def filter_policy(self, interaction: discord.Interaction, action: app_commands.Choice[str]):
+        await content_filter.set_policy(interaction.channel_id, action.value)
+        await interaction.response.send_message(
+            f"🛡️ Blocked messages in this channel's calls: **{action.value}** "
+            f"(the stricter side of a call wins).", ephemeral=True)
+
+    @filter_group.command(name="reload", description="Re-read the blocklist now")
+    async def filter_reload(self, interaction: discord.Interaction):
+        await interaction.response.defer(ephemeral=True)
+        try:
+            rules = await content_filter.reload()
+        except re.error as exc:
+            return await interaction.edit_original_response(
+                content=f"⚠️ Blocklist not reloaded, the previous one stays active: {exc}")
+        await interaction.edit_original_response(
+            content=f"🛡️ {rules} rule(s) loaded. Other processes pick changes up within "
+                    f"{content_filter.RELOAD_EVERY} s.")
+
     @tasks.loop(minutes=30)
     async def auto_sync(self):
-        await self.bot.tree.sync()
-        print("🔄 Slash‑commands auto‑synced")
+        # a REST call only if the tree changed since the last sync (e.g. a cog was reloaded)
+        try:
+            synced = await sync_if_changed(self.bot.tree, self.bot.application_id)
+        except discord.HTTPException as exc:
+            return print(f"⚠️ Slash‑command auto‑sync failed, retrying next run: {exc}")
+        if synced is not None:
+            print(f"🔄 Slash‑commands auto‑synced ({synced})")
 
     @auto_sync.before_loop
     async def before_auto_sync(self): await self.bot.wait_until_ready()
@@ -1,17 +1,24 @@
 # cogs/pairing.py
 
-import asyncio
+import os
 import time
+import asyncio
 import traceback
 from typing import Optional
 
 import discord
 from discord import app_commands
-from discord.ext import commands
+from discord.ext import commands, tasks
 
-from utils.state     import state
-from utils.profiles  import set_profile
-from utils.webhooks  import remove_webhook
+from utils.state       import state
+from utils.matchmaking import matchmaker
+from utils.profiles    import set_profile
+from utils.webhooks    import warm_webhooks
+from utils.relay_map   import relay_map
+from utils.bus         import bus
+from utils.ratelimit   import TokenBucket
+from utils.metrics     import CALL_REQUESTS, MATCHES, QUEUE_WAIT
+from utils.redis_pool  import UNAVAILABLE
 
 
 class Pairing(commands.Cog):
@@ -20,36 +27,131 @@ class Pairing(commands.Cog):
     SERVER_LIMIT  = 50          # calls per guild per hour
     SERVER_WINDOW = 60 * 60     # window length (s)
 
+    IDLE_LIMIT    = int(os.getenv("UP_CALL_IDLE_MINUTES", "60")) * 60   # reap calls quiet this long (s)
+    REAP_EVERY    = 5           # minutes between reaper runs
+
+    POSITION_TICK   = 5         # s between queue position refreshes
+    POSITION_BUDGET = 20        # placeholder edits per tick, front of the line first
+    POSITION_GAP    = 15        # s between position edits of the same placeholder
+    QUEUE_SWEEP     = 30        # s between sweeps for callers past Matchmaker.QUEUE_TTL
+
+    NO_ANSWER = (f"❌ No one answered – run `/call` again within {matchmaker.AGING_GRACE // 60} minutes "
+                 "to keep your place in line.")
+
+    CONFLICTS = {
+        "busy":      "This channel is already used by another caller. Please run `/call` in a different channel.",
+        "waiting":   "You're already waiting here.",
+        "elsewhere": "You have another pending call elsewhere.",
+    }
+
     def __init__(self, bot: commands.Bot):
         self.bot = bot
-        # maps user_id -> channel_id for queued callers
-        self.user_queue: dict[int, int] = {}
-        # maps channel_id -> placeholder message ID
-        self.queue_msg: dict[int, int] = {}
-        # per-guild rate-limit state
-        self.guild_usage: dict[int, tuple[int,int]] = {}
+        # maps channel_id -> placeholder handle: the /call interaction until its
+        # message id is known, then a PartialMessage (edits need no fetch)
+        self.queue_msg: dict[int, discord.Interaction | discord.PartialMessage] = {}
+        # channel_id -> (position on its placeholder, when it was written)
+        self._shown: dict[int, tuple[int, float]] = {}
+        # channel_id -> position edit in flight; a final text must land after it
+        self._pos_edits: dict[int, asyncio.Task] = {}
+        # per-guild rate limit, shared by every process
+        self.guild_usage = TokenBucket("guild_calls", self.SERVER_LIMIT, self.SERVER_WINDOW)
+        # placeholder updates for channels hosted by this process (cluster mode)
+        bus.on("placeholder", self._bus_placeholder)
+        # calls ended by the stale-call reaper since start-up
+        self.reaped_total = 0
+
+    @commands.Cog.listener()
+    async def on_ready(self):
+        await self._restore_placeholders()
+        if not self.reaper.is_running():
+            self.reaper.start()
+        if not self.positions.is_running():
+            self.positions.start()
+        if not self.expire_queue.is_running():
+            self.expire_queue.start()
+
+    # a queued channel that is deleted, or in a guild we leave, can never answer
+    @commands.Cog.listener()
+    async def on_guild_channel_delete(self, channel: discord.abc.GuildChannel):
+        await self._evict_dead(channel.id)
+
+    @commands.Cog.listener()
+    async def on_guild_remove(self, guild: discord.Guild):
+        await self._evict_dead(*(ch.id for ch in guild.text_channels))
+
+    async def _restore_placeholders(self):
+        """Pick up the placeholders of callers hosted here who queued before a restart."""
+        for cid, mid in (await matchmaker.placeholders()).items():
+            ch = self.bot.get_channel(cid)
+            if ch is not None and cid not in self.queue_msg:
+                self.queue_msg[cid] = ch.get_partial_message(mid)
 
     # ───────────────────── helpers ─────────────────────
     async def _edit(self, cid: int, text: str):
         """Edit the stored placeholder for channel `cid`."""
-        mid = self.queue_msg.get(cid)
-        if not mid:
+        handle = self.queue_msg.get(cid)
+        if handle is None:
             return
-        ch = self.bot.get_channel(cid)
-        try:
-            msg = await ch.fetch_message(mid)
-            await msg.edit(content=text)
-        except Exception:
-            pass
         # once connected or ended, drop the placeholder
         if text.startswith(("☎️", "📴", "❌")):
             self.queue_msg.pop(cid, None)
+            self._shown.pop(cid, None)
+            pending = self._pos_edits.get(cid)
+            if pending:
+                await asyncio.wait({pending})
+        try:
+            if isinstance(handle, discord.Interaction):
+                await handle.edit_original_response(content=text)
+            else:
+                await handle.edit(content=text)
+        except discord.HTTPException:
+            pass
+
+    async def _edit_anywhere(self, cid: int, text: str, warm: bool = False):
+        """`_edit` for a channel that may be hosted by another process."""
+        ch = self.bot.get_channel(cid)
+        if ch is None:
+            if bus.enabled:
+                await bus.publish("placeholder", dest=cid, text=text, warm=warm)
+            return
+        if warm:
+            # resolve the webhook now so the first relayed message doesn't pay for it
+            await asyncio.gather(self._edit(cid, text), warm_webhooks(ch))
+        else:
+            await self._edit(cid, text)
 
-    async def _pair(self, ch1: discord.TextChannel, ch2: discord.TextChannel, anon: bool):
-        """Wire two channels together and flip placeholders."""
-        await state.start_call(ch1.id, ch2.id, anon)
-        await self._edit(ch1.id, "☎️ Connected!")
-        await self._edit(ch2.id, "☎️ Connected!")
+    async def _bus_placeholder(self, ev: dict):
+        if self.bot.get_channel(ev["dest"]) is not None:
+            await self._edit_anywhere(ev["dest"], ev["text"], ev.get("warm", False))
+
+    async def _notify(self, cid: int, text: str):
+        """Plain message in `cid`, wherever it is hosted."""
+        ch = self.bot.get_channel(cid)
+        if ch is not None:
+            await ch.send(text)
+        elif bus.enabled:
+            await bus.publish("notice", dest=cid, text=text)
+
+    @staticmethod
+    def _queued_text(position: int, rate: Optional[float]) -> str:
+        text = f"📞 Calling… you're **#{position}** in line."
+        if rate:
+            # each match takes the head of the line, so we're `position` matches away
+            text += f" Estimated wait: ~{TokenBucket.describe(position / rate)}."
+        return text
+
+    @staticmethod
+    async def _fanout(*aws):
+        """Run independent side effects at once; one failing doesn't stop the others."""
+        for res in await asyncio.gather(*aws, return_exceptions=True):
+            if isinstance(res, Exception):
+                traceback.print_exception(res)
+
+    async def _pair(self, ch1: discord.TextChannel, partner_id: int, anon: bool):
+        """Wire two channels together and flip both placeholders."""
+        await state.start_call(ch1.id, partner_id, anon)
+        await self._fanout(self._edit_anywhere(ch1.id,     "☎️ Connected!", warm=True),
+                           self._edit_anywhere(partner_id, "☎️ Connected!", warm=True))
 
     # ───────────────────── core handler ─────────────────────
     async def _handle_call(self, inter: discord.Interaction, anon: bool):
@@ -62,11 +164,9 @@ class Pairing(commands.Cog):
             )
 
         # ▶️ Prevent two callers in the same channel
-        if ch.id in self.user_queue.values() and self.user_queue.get(uid) != ch.id:
-            return await inter.response.send_message(
-                "This channel is already used by another caller. Please run `/call` in a different channel.",
-                ephemeral=True,
-            )
+        owner = await matchmaker.owner_of(ch.id)
+        if owner is not None and owner != uid:
+            return await inter.response.send_message(self.CONFLICTS["busy"], ephemeral=True)
 
         # 1️⃣ ACK to avoid Discord timeouts
         await inter.response.defer(thinking=True)
@@ -77,59 +177,53 @@ class Pairing(commands.Cog):
                 return await inter.edit_original_response(
                     content="This channel is already in a live call."
                 )
-            if uid in self.user_queue and self.user_queue[uid] == ch.id:
-                return await inter.edit_original_response(
-                    content="You're already waiting here."
-                )
-            if uid in self.user_queue.values() and self.user_queue.get(uid) != ch.id:
-                return await inter.edit_original_response(
-                    content="You have another pending call elsewhere."
-                )
+            queued = await matchmaker.queued_channel(uid)
+            if queued is not None:
+                conflict = "waiting" if queued == ch.id else "elsewhere"
+                return await inter.edit_original_response(content=self.CONFLICTS[conflict])
 
             # per-server rate limit
             if inter.guild:
-                gid = inter.guild.id
-                used, reset = self.guild_usage.get(gid, (0, time.time() + self.SERVER_WINDOW))
-                now = time.time()
-                if now > reset:
-                    used, reset = 0, now + self.SERVER_WINDOW
-                if used >= self.SERVER_LIMIT:
+                verdict = await self.guild_usage.take(inter.guild.id)
+                if not verdict.allowed:
                     return await inter.edit_original_response(
-                        content=f"🚦 This server hit the {self.SERVER_LIMIT}/h limit."
+                        content=f"🚦 This server hit the {self.SERVER_LIMIT}/h limit. "
+                                f"Try again in {TokenBucket.describe(verdict.retry_after)}."
                     )
-                self.guild_usage[gid] = (used + 1, reset)
-
-            # 3️⃣ queue bookkeeping
-            # mark this user as queued on this channel
-            self.user_queue[uid] = ch.id
-            queue = state.anon_queue if anon else state.waiting_queue
-
-            # attempt to find a partner from a different guild
-            partner_cid: Optional[int] = None
-            for _ in range(len(queue)):
-                candidate = queue[0]
-                owner = next((u for u, cid in self.user_queue.items() if cid == candidate), None)
-                candidate_ch = self.bot.get_channel(candidate)
-                if owner and owner != uid and candidate_ch and candidate_ch.guild.id != ch.guild.id:
-                    partner_cid = queue.popleft()
+
+            # 3️⃣ match against another guild's caller, or join the queue
+            CALL_REQUESTS.inc()
+            # a partner may pair with us before the reply below lands – give it a handle now
+            self.queue_msg[ch.id] = inter
+            while True:
+                match = await matchmaker.enqueue_or_match(ch.id, uid, ch.guild.id, anon)
+                if match.conflict:
+                    self.queue_msg.pop(ch.id, None)
+                    return await inter.edit_original_response(content=self.CONFLICTS[match.conflict])
+                if match.partner is None:
                     break
-                queue.rotate(-1)
-
-            # instant match
-            if partner_cid:
-                msg = await inter.edit_original_response(content="🔗 Connecting…")
-                self.queue_msg[ch.id] = msg.id
-                partner_ch = self.bot.get_channel(partner_cid)
-                await self._pair(ch, partner_ch, anon)
+                if self._gone(match.partner, match.guild):
+                    # partner channel vanished while queued – already dequeued, try the next one
+                    continue
+
+                # instant match (the partner may live on another process in cluster mode)
+                MATCHES.inc()
+                QUEUE_WAIT.observe(match.waited)
+                await self._pair(ch, match.partner, anon)
                 return
 
-            # else, enqueue
-            queue.append(ch.id)
-            pos = len(queue)
+            # else, queued
             msg = await inter.edit_original_response(
-                content=f"📞 Calling… you're **#{pos}** in line."
+                content=self._queued_text(match.position, await matchmaker.match_rate(anon))
             )
-            self.queue_msg[ch.id] = msg.id
+            if self.queue_msg.get(ch.id) is inter:
+                # interaction tokens expire after 15 min; the queue can take longer
+                self.queue_msg[ch.id] = ch.get_partial_message(msg.id)
+                self._shown[ch.id] = (match.position, time.monotonic())
+                await matchmaker.set_placeholder(ch.id, msg.id)
+            elif await state.is_in_call(ch.id):
+                # paired while that edit was in flight – don't leave "Calling…" on top
+                await inter.edit_original_response(content="☎️ Connected!")
 
         except Exception:
             traceback.print_exc()
@@ -157,28 +251,142 @@ class Pairing(commands.Cog):
         # 1️⃣ live call?
         partner_id = await state.end_call(ch.id)
         if partner_id:
-            await self._edit(ch.id,      "📴 Ended.")
-            await self._edit(partner_id, "📴 Call ended by other side.")
-            partner_ch = self.bot.get_channel(partner_id)
-            if partner_ch:
-                await partner_ch.send("📴 Call ended by the other side.")
-            await asyncio.gather(
-                remove_webhook(ch.id), remove_webhook(partner_id),
-                return_exceptions=True
+            return await self._fanout(
+                inter.edit_original_response(content="Call ended."),
+                self._edit(ch.id, "📴 Ended."),
+                self._edit_anywhere(partner_id, "📴 Call ended by other side."),
+                self._notify(partner_id, "📴 Call ended by the other side."),
+                relay_map.forget_call(ch.id, partner_id),
             )
-            return await inter.edit_original_response(content="Call ended.")
 
         # 2️⃣ queued?
-        queued_cid = self.user_queue.pop(uid, None)
+        queued_cid = await matchmaker.cancel(uid)
         if queued_cid:
-            for q in (state.waiting_queue, state.anon_queue):
-                if queued_cid in q:
-                    q.remove(queued_cid)
-            await self._edit(queued_cid, "❌ Cancelled.")
-            return await inter.edit_original_response(content="Left queue.")
+            return await self._fanout(inter.edit_original_response(content="Left queue."),
+                                      self._edit(queued_cid, "❌ Cancelled."))
 
         await inter.edit_original_response(content="You're not in a call or queue.")
 
+    # ───────────────────── queue positions ─────────────────────
+    @tasks.loop(seconds=POSITION_TICK)
+    async def positions(self):
+        """Rewrite "#N in line" on placeholders whose position changed, a budget per tick."""
+        # placeholders still held as an interaction get their first text from _handle_call
+        waiting = {cid: h for cid, h in self.queue_msg.items() if not isinstance(h, discord.Interaction)}
+        self._shown = {cid: v for cid, v in self._shown.items() if cid in waiting}
+        if not waiting:
+            return
+
+        # one read per queue gives every position; ties to the front of the line go first
+        now, due, rates = time.monotonic(), [], {}
+        for anon in (False, True):
+            rates[anon] = await matchmaker.match_rate(anon)
+            for cid, pos in (await matchmaker.positions(anon)).items():
+                shown, at = self._shown.get(cid, (None, -self.POSITION_GAP))
+                if cid in waiting and pos != shown and now - at >= self.POSITION_GAP:
+                    due.append((pos, cid, anon))
+        due.sort()
+
+        edits = []
+        for pos, cid, anon in due[:self.POSITION_BUDGET]:
+            self._shown[cid] = (pos, now)
+            text = self._queued_text(pos, rates[anon])
+            task = asyncio.create_task(self._edit_position(cid, waiting[cid], text))
+            task.add_done_callback(lambda _, cid=cid: self._pos_edits.pop(cid, None))
+            self._pos_edits[cid] = task
+            edits.append(task)
+        await self._fanout(*edits)
+        # whatever is left over is still different next tick and goes then
+
+    async def _edit_position(self, cid: int, handle: discord.PartialMessage, text: str):
+        if self.queue_msg.get(cid) is not handle:
+            return              # connected or cancelled meanwhile
+        try:
+            await handle.edit(content=text)
+        except discord.Forbidden:
+            await self._evict_dead(cid)                 # lost access to the channel
+        except discord.NotFound as exc:
+            if exc.code == 10003:                       # unknown channel
+                await self._evict_dead(cid)
+            elif self.queue_msg.get(cid) is handle:     # placeholder deleted: stop updating it
+                del self.queue_msg[cid]
+        except discord.HTTPException:
+            pass
+
+    async def _evict_dead(self, *cids: int):
+        """Take channels that can no longer take a call out of the queue."""
+        for cid in cids:
+            self.queue_msg.pop(cid, None)
+            self._shown.pop(cid, None)
+        await matchmaker.evict(*cids)
+
+    @positions.before_loop
+    async def before_positions(self):
+        await self.bot.wait_until_ready()
+
+    @tasks.loop(seconds=QUEUE_SWEEP)
+    async def expire_queue(self):
+        """Release callers nobody answered within Matchmaker.QUEUE_TTL."""
+        if not await state.try_lock("queue-expiry", self.QUEUE_SWEEP - 5):
+            return          # another process has this run
+        expired = await matchmaker.expire()
+        await self._fanout(*(self._edit_anywhere(cid, self.NO_ANSWER) for cid in expired))
+
+    @expire_queue.before_loop
+    async def before_expire_queue(self):
+        await self.bot.wait_until_ready()
+
+    # ───────────────────── stale-call reaper ─────────────────────
+    def _gone(self, cid: int, gid: int | None = None) -> bool:
+        # a channel we should host but can't see was deleted; in cluster mode we
+        # can only tell for guilds on our own shards
+        if self.bot.get_channel(cid) is not None:
+            return False
+        return not bus.enabled or (gid is not None and self.bot.get_guild(gid) is not None)
+
+    @tasks.loop(minutes=REAP_EVERY)
+    async def reaper(self):
+        """End calls whose channel is gone or that have been idle past IDLE_LIMIT."""
+        if not await state.try_lock("reaper", self.REAP_EVERY * 60 - 5):
+            return          # another process has this run
+        cutoff = time.time() - self.IDLE_LIMIT
+        idle:  set[int] = set()
+        stale: set[int] = set()
+        calls: dict[int, int | None] = {}
+        try:
+            async for rows in state.scan_calls():
+                for cid, partner_id, _, seen in rows:
+                    calls[cid] = partner_id
+                    if seen < cutoff:
+                        idle.add(cid)
+                    if partner_id is None or self._gone(cid):
+                        stale.add(cid)          # orphaned index entry or deleted channel
+        except UNAVAILABLE:
+            return          # Redis dropped out mid‑scan; the next run starts over
+        # a call is idle only when neither side has spoken
+        stale.update(cid for cid in idle if calls[cid] in idle)
+
+        reaped = 0
+        for cid in stale:
+            partner_id = await state.end_call(cid)      # atomic: the partner may already be done
+            if not partner_id:
+                continue
+            reaped += 1
+            await self._fanout(
+                relay_map.forget_call(cid, partner_id),
+                *(self._notify(side, "📴 Call ended – no activity.") for side in (cid, partner_id)),
+            )
+        if reaped:
+            self.reaped_total += reaped
+            print(f"🧹 Reaped {reaped} stale call(s)")
+
+    @reaper.before_loop
+    async def before_reaper(self):
+        await self.bot.wait_until_ready()
+        added = await state.index_calls()
+        if added:
+            print(f"🧹 Indexed {added} pre-existing call channel(s)")
+
     # ───── misc ─────
     @app_commands.command(name="duration", description="Show current call duration")
     async def duration(self, inter: discord.Interaction):
@@ -1,24 +1,43 @@
 # cogs/relay.py
 
-import aiohttp
 import io
+import time
+import asyncio
 import discord
 from discord.ext import commands
 
-from utils.state    import state
-from utils.webhooks import forward_message
+from utils.state       import state
+from utils.webhooks    import forward_message, edit_message, delete_messages
+from utils.relay_map   import relay_map
+from utils.cache       import TTLCache
+from utils.attachments import fetch_attachments, release
+from utils.http        import get_session
+from utils.stickers    import sticker_cache, extension
+from utils.bus         import bus
+from utils.outbox      import Outbox
+from utils.ratelimit   import TokenBucket
+from utils.metrics     import RELAY_STAGE, FILTERED
+from utils.content_filter import content_filter
 
 class Relay(commands.Cog):
     """Cog for handling message forwarding between channels"""
     
     def __init__(self, bot):
         self.bot = bot
-        # For rate limiting (fallback when not using Redis)
-        self.last_sent = {}
-        # For tracking profile changes
-        self.last_profile = {}
-        # For message edit mapping
-        self.relay_map = {}
+        # For rate limiting: one message per author per COOLDOWN, cluster-wide
+        self.last_sent = TokenBucket("relay_user", 1, state.COOLDOWN)
+        # For tracking profile changes: (author, partner) -> (alias, avatar)
+        self.last_profile: TTLCache[tuple[str, str]] = TTLCache(10_000)
+        # Recent message text on both sides of a call, (channel, message) -> content
+        self.recent: TTLCache[str] = TTLCache(20_000, 6 * 60 * 60)
+        # Posts carrying several merged messages, (channel, post) -> (alias, [[source message, text], …]),
+        # so an edit or delete of one of them rebuilds the post from the others
+        self.merged: TTLCache[tuple[str, list]] = TTLCache(20_000, relay_map.TTL)
+        # Deliveries handed over by other processes (cluster mode)
+        bus.on("relay",  self._bus_relay)
+        bus.on("edit",   self._bus_edit)
+        bus.on("delete", self._bus_delete)
+        bus.on("notice", self._bus_notice)
     
     @commands.Cog.listener()
     async def on_message(self, msg: discord.Message):
@@ -27,73 +46,174 @@ class Relay(commands.Cog):
             return
         
         cid = msg.channel.id
+        started = time.perf_counter()
         
-        # Check if channel is in a call
-        if not await state.is_in_call(cid):
+        # Partner, anon flag, profile and the rate limit – one round trip at most
+        with RELAY_STAGE.time("state"):
+            ctx = await state.get_call_context(cid, msg.author, cooldown=self.last_sent)
+        if ctx is None:
             return
+        partner_id = ctx.partner
+        await state.touch(cid)
         
-        # Get partner channel from active calls
-        if state._r:
-            partner_str = await state._r.hget(state._H_ACTIVE, str(cid))
-            partner_id  = int(partner_str) if partner_str else None
-        else:
-            partner_id = state.active_calls.get(cid)
-        
-        if not partner_id:
-            return
-        
-        # Rate limiting
-        now = msg.created_at.timestamp()
-        last = self.last_sent.get(msg.author.id, 0)
-        if now - last < state.COOLDOWN:
+        if not ctx.allowed:
             return
-        self.last_sent[msg.author.id] = now
         
-        # Handle attachments
-        files = [await a.to_file() for a in msg.attachments]
-        
-        # Handle stickers, preserving GIF animation
-        if msg.stickers:
-            async with aiohttp.ClientSession() as session:
-                for st in msg.stickers:
-                    try:
-                        async with session.get(st.url) as resp:
-                            data = io.BytesIO(await resp.read())
-                            # Choose extension based on sticker format
-                            if st.format is discord.StickerFormatType.gif:
-                                ext = "gif"
-                            elif st.format is discord.StickerFormatType.apng:
-                                ext = "png"
-                            else:
-                                ext = "png"
-                            files.append(discord.File(data, filename=f"{st.id}.{ext}"))
-                    except Exception:
-                        continue
-        
-        if not msg.content and not files:
+        partner_ch = self.bot.get_channel(partner_id)
+        if not partner_ch and not bus.enabled:
             return
         
-        partner_ch = self.bot.get_channel(partner_id)
-        if not partner_ch:
+        # Blocklist – before any attachment is downloaded
+        text = await self._screen(cid, partner_id, msg.content, msg)
+        if text is None:
             return
         
-        # Get user info
-        anon   = await state.is_anonymous(cid)
-        alias  = await state.alias_for(msg.author, anon)
-        avatar = await state.avatar_for(msg.author, anon)
+        files, urls = [], []
+        if partner_ch is None:
+            # Partner is hosted by another process, which re-posts media as links
+            urls = [a.url for a in msg.attachments] + [st.url for st in msg.stickers]
+        elif msg.attachments or msg.stickers:
+            session = get_session()
+            # Handle attachments: downloaded concurrently, large ones passed through as links
+            if msg.attachments:
+                with RELAY_STAGE.time("attachments"):
+                    files, urls = await fetch_attachments(msg.attachments, session, partner_ch)
+            
+            # Handle stickers from the shared cache, preserving GIF animation
+            with RELAY_STAGE.time("stickers"):
+                data = await asyncio.gather(*(sticker_cache.get(st, session) for st in msg.stickers),
+                                            return_exceptions=True)
+            for st, blob in zip(msg.stickers, data):
+                if isinstance(blob, bytes):
+                    files.append(discord.File(io.BytesIO(blob), filename=f"{st.id}.{extension(st)}"))
         
-        # Check for profile changes (non-anon only)
-        if not anon:
-            lp_key = (msg.author.id, partner_id)
-            prev = self.last_profile.get(lp_key, (None, None))
-            if (alias, avatar) != prev:
-                if prev[0] is not None:
-                    await partner_ch.send(f"ℹ️ **{prev[0]}** updated their profile.")
-                self.last_profile[lp_key] = (alias, avatar)
+        content = self._compose(text, urls)
+        if not content and not files:
+            return
         
-        # Forward message
-        dest_msg = await forward_message(msg.content, files, alias, avatar, partner_ch)
-        self.relay_map[(cid, msg.id)] = dest_msg.id
+        try:
+            anon, alias, avatar = ctx.anon, ctx.alias, ctx.avatar
+            
+            # Check for profile changes (non-anon only)
+            if not anon:
+                lp_key = (msg.author.id, partner_id)
+                prev = self.last_profile.get(lp_key, (None, None))
+                if (alias, avatar) != prev:
+                    if prev[0] is not None:
+                        await self._notice(partner_id, f"ℹ️ **{prev[0]}** updated their profile.")
+                    self.last_profile.put(lp_key, (alias, avatar))
+            
+            # Forward message
+            with RELAY_STAGE.time("send"):
+                if partner_ch is None:
+                    self.recent.put((cid, msg.id), text)
+                    await bus.publish("relay", dest=partner_id, src_ch=cid, src_mid=msg.id,
+                                      content=content, alias=alias, avatar=avatar, text=text)
+                else:
+                    await self._deliver(cid, msg.id, partner_ch, content, files, alias, avatar, text)
+            RELAY_STAGE.observe(time.perf_counter() - started, "total")
+        finally:
+            release(files)
+    
+    @staticmethod
+    def _compose(text: str, urls: list[str]) -> str:
+        """Text plus media links within Discord's length limit – the text gives way, not the links"""
+        limit, links, kept = Outbox.MAX_CONTENT, list(urls), len(urls)
+        while len("\n".join(links)) > limit:
+            kept -= 1
+            links = urls[:kept] + [f"(+{len(urls) - kept} more attachments)"]
+        room = limit - (len("\n".join(links)) + 1 if links else 0)
+        if len(text) > room:
+            text = text[:room - 1] + "…" if room > 1 else ""
+        return "\n".join(filter(None, [text, *links]))
+    
+    async def _screen(self, cid: int, partner_id: int, text: str,
+                      msg: discord.Message | None = None) -> str | None:
+        """Text to forward after the content filter, or None if the call's policy stops it"""
+        with RELAY_STAGE.time("filter"):
+            hit = content_filter.screen(text)
+        if hit is None:
+            return text
+        action = await content_filter.policy(cid, partner_id)
+        FILTERED.inc(action)
+        if action == "redact":
+            return hit.text
+        if action == "hangup":
+            if await state.end_call(cid) == partner_id:
+                notice = "📴 Call ended – a message was blocked by the content filter."
+                await asyncio.gather(relay_map.forget_call(cid, partner_id),
+                                     self._notice(cid, notice), self._notice(partner_id, notice),
+                                     return_exceptions=True)
+        elif msg is not None:
+            try:
+                await msg.add_reaction("🚫")
+            except discord.HTTPException:
+                pass
+        return None
+    
+    async def _deliver(self, src_id: int, src_mid: int, dest: discord.TextChannel,
+                       content: str, files: list, alias: str, avatar: str, text: str):
+        """Post into `dest` and remember the copy for edits, deletes and reactions"""
+        posted = await forward_message(content, files, alias, avatar, dest)
+        dest_mid = posted.message.id
+        self.recent.put((src_id, src_mid), text)
+        if len(posted.parts) > 1:
+            # every message of the post registers its own part, whichever resumes first
+            key   = (dest.id, dest_mid)
+            entry = self.merged.get(key) or (alias, [[None, part] for part in posted.parts])
+            entry[1][posted.part][0] = src_mid
+            self.merged.put(key, entry)
+            text = "\n".join(posted.parts)
+        await relay_map.add(src_id, src_mid, dest.id, dest_mid)
+        self.recent.put((dest.id, dest_mid), text)
+    
+    def _rebuild(self, dest_id: int, mid: int, changes: dict) -> tuple[str, str] | None:
+        """
+        (alias, text) of merged post `mid` once `changes` (source message -> new
+        text, None: deleted) are applied; None if `mid` carries a single message
+        """
+        entry = self.merged.get((dest_id, mid))
+        if entry is None:
+            return None
+        alias, parts = entry
+        parts = [[src, changes[src] if src in changes else part] for src, part in parts]
+        parts = [p for p in parts if p[1] is not None]
+        self.merged.put((dest_id, mid), (alias, parts))
+        return alias, "\n".join(part for _, part in parts)[:Outbox.MAX_CONTENT]
+    
+    async def _apply_edit(self, dest: discord.TextChannel, mid: int, src_mid: int,
+                          content: str, alias: str | None):
+        """Edit a relayed copy; in a merged post only the edited message's part changes"""
+        merged  = self._rebuild(dest.id, mid, {src_mid: content})
+        content = merged[1] if merged else content[:Outbox.MAX_CONTENT]
+        self.recent.put((dest.id, mid), content)
+        await edit_message(dest, mid, content, alias)
+    
+    async def _apply_delete(self, dest: discord.TextChannel, pairs):
+        """Delete relayed copies; a merged post only loses the deleted messages while others remain"""
+        gone: dict[int, list[int]] = {}
+        for src_mid, copy in pairs:
+            gone.setdefault(copy, []).append(src_mid)
+        doomed, edits = [], []
+        for copy, src_mids in gone.items():
+            merged = self._rebuild(dest.id, copy, dict.fromkeys(src_mids))
+            if merged and merged[1]:
+                self.recent.put((dest.id, copy), merged[1])
+                edits.append(edit_message(dest, copy, merged[1], merged[0]))
+            else:
+                self.merged.pop((dest.id, copy))
+                doomed.append(copy)
+        if doomed:
+            edits.append(delete_messages(dest, doomed))
+        await asyncio.gather(*edits, return_exceptions=True)
+    
+    async def _notice(self, dest_id: int, text: str):
+        """Plain bot message in `dest_id`, whichever process hosts it"""
+        dest = self.bot.get_channel(dest_id)
+        if isinstance(dest, discord.TextChannel):
+            await dest.send(text)
+        elif bus.enabled:
+            await bus.publish("notice", dest=dest_id, text=text)
     
     @commands.Cog.listener()
     async def on_raw_message_edit(self, payload: discord.RawMessageUpdateEvent):
@@ -102,37 +222,53 @@ class Relay(commands.Cog):
         if not isinstance(src_ch, discord.TextChannel):
             return
         
-        if not await state.is_in_call(src_ch.id):
+        content = payload.data.get("content", "")
+        if content == "":
             return
         
-        # Get partner channel
-        if state._r:
-            partner_str = await state._r.hget(state._H_ACTIVE, str(src_ch.id))
-            partner_id  = int(partner_str) if partner_str else None
-        else:
-            partner_id = state.active_calls.get(src_ch.id)
-        
-        if not partner_id:
+        ctx = await state.get_call_context(src_ch.id, self._editor(src_ch, payload))
+        if ctx is None:
             return
+        partner_id = ctx.partner
         
-        dest_id = self.relay_map.get((src_ch.id, payload.message_id))
+        dest_id = await relay_map.copy_of(src_ch.id, payload.message_id)
         if not dest_id:
             return
         
-        partner_ch = self.bot.get_channel(partner_id)
-        if not isinstance(partner_ch, discord.TextChannel):
+        # an edit can't sneak past the filter; a dropped edit leaves the copy as it was
+        content = await self._screen(src_ch.id, partner_id, content)
+        if content is None:
             return
         
-        content = payload.data.get("content", "")
-        if content == "":
-            return
+        self.recent.put((src_ch.id, payload.message_id), content)
         
+        partner_ch = self.bot.get_channel(partner_id)
+        if partner_ch is None and bus.enabled:
+            return await bus.publish("edit", dest=partner_id, mid=dest_id, src_mid=payload.message_id,
+                                     content=content, alias=ctx.alias)
+        if not isinstance(partner_ch, discord.TextChannel):
+            return
         try:
-            dest_msg = await partner_ch.fetch_message(dest_id)
-            await dest_msg.edit(content=content)
+            await self._apply_edit(partner_ch, dest_id, payload.message_id, content, ctx.alias)
         except Exception:
             pass
     
+    @staticmethod
+    def _editor(ch: discord.TextChannel, payload: discord.RawMessageUpdateEvent) -> discord.abc.User | None:
+        """Author of an edited message – from the cache, else from the edit payload itself"""
+        if payload.cached_message:
+            return payload.cached_message.author
+        data = payload.data.get("author")
+        if data is None:
+            return None
+        member = ch.guild.get_member(int(data["id"]))
+        if member is not None:
+            return member
+        if "member" in payload.data:        # carries the nickname the alias falls back to
+            return discord.Member(data={"roles": [], "flags": 0, **payload.data["member"], "user": data},
+                                  guild=ch.guild, state=ch._state)
+        return discord.User(state=ch._state, data=data)
+    
     @commands.Cog.listener()
     async def on_raw_reaction_add(self, payload: discord.RawReactionActionEvent):
         """Handle reaction forwarding"""
@@ -140,42 +276,96 @@ class Relay(commands.Cog):
             return
         
         cid = payload.channel_id
-        if not await state.is_in_call(cid):
-            return
-        
-        # Get partner channel
-        if state._r:
-            partner_str = await state._r.hget(state._H_ACTIVE, str(cid))
-            partner_id  = int(partner_str) if partner_str else None
-        else:
-            partner_id = state.active_calls.get(cid)
         
-        if not partner_id:
-            return
-        
-        partner_ch = self.bot.get_channel(partner_id)
-        if not isinstance(partner_ch, discord.TextChannel):
+        # Most reactions aren't in a call – check before resolving who reacted
+        ctx = await state.get_call_context(cid)
+        if ctx is None:
             return
-        
-        guild  = self.bot.get_guild(payload.guild_id) if payload.guild_id else None
-        member = guild.get_member(payload.user_id) if guild else None
-        user   = member or payload.member or payload.user
+        user = discord.Object(payload.user_id) if ctx.anon else await self._reactor(payload)
         if not user:
             return
         
-        alias = await state.alias_for(user, await state.is_anonymous(cid))
+        ctx = await state.get_call_context(cid, user)
+        if ctx is None:
+            return
+        partner_id = ctx.partner
+        alias = ctx.alias
         
-        # Get message snippet
-        try:
-            src_ch  = self.bot.get_channel(cid)
-            src_msg = await src_ch.fetch_message(payload.message_id)
-            snippet = (src_msg.content or "[non‑text]")[:60]
-            if len(src_msg.content) > 60:
-                snippet += "..."
-        except Exception:
+        # Get message snippet – from the recent-content cache, fetching only on a miss
+        text = self.recent.get((cid, payload.message_id))
+        if text is None:
+            try:
+                src_ch = self.bot.get_channel(cid)
+                text   = (await src_ch.fetch_message(payload.message_id)).content
+                self.recent.put((cid, payload.message_id), text)
+            except Exception:
+                text = None
+        if text is None:
             snippet = "a message"
+        else:
+            snippet = (text or "[non‑text]")[:60]
+            if len(text) > 60:
+                snippet += "..."
         
-        await partner_ch.send(f"**{alias}** reacted with {payload.emoji} to \"{snippet}\"")
+        await self._notice(partner_id, f"**{alias}** reacted with {payload.emoji} to \"{snippet}\"")
+
+    async def _reactor(self, payload: discord.RawReactionActionEvent):
+        """The reacting user: from the event, the caches, or (lean cache mode) the API"""
+        if payload.member:
+            return payload.member
+        guild = self.bot.get_guild(payload.guild_id) if payload.guild_id else None
+        user  = (guild and guild.get_member(payload.user_id)) or self.bot.get_user(payload.user_id)
+        if user or guild is None:
+            return user
+        try:
+            return await guild.fetch_member(payload.user_id)
+        except discord.HTTPException:
+            return None
+
+    @commands.Cog.listener()
+    async def on_raw_message_delete(self, payload: discord.RawMessageDeleteEvent):
+        """Mirror deletions of relayed messages"""
+        await self._mirror_delete(payload.channel_id, [payload.message_id])
+    
+    @commands.Cog.listener()
+    async def on_raw_bulk_message_delete(self, payload: discord.RawBulkMessageDeleteEvent):
+        """Mirror purges of relayed messages"""
+        await self._mirror_delete(payload.channel_id, payload.message_ids)
+    
+    async def _mirror_delete(self, cid: int, mids):
+        ctx = await state.get_call_context(cid)
+        if ctx is None:
+            return
+        pairs = await relay_map.pop(cid, ctx.partner, mids)
+        if not pairs:
+            return
+        partner_ch = self.bot.get_channel(ctx.partner)
+        if isinstance(partner_ch, discord.TextChannel):
+            await self._apply_delete(partner_ch, pairs)
+        elif bus.enabled:
+            await bus.publish("delete", dest=ctx.partner, pairs=pairs)
+    
+    # ───── cluster-mode deliveries ─────
+    async def _bus_relay(self, ev: dict):
+        dest = self.bot.get_channel(ev["dest"])
+        if isinstance(dest, discord.TextChannel):
+            await self._deliver(ev["src_ch"], ev["src_mid"], dest, ev["content"], [],
+                                ev["alias"], ev["avatar"], ev["text"])
+    
+    async def _bus_edit(self, ev: dict):
+        dest = self.bot.get_channel(ev["dest"])
+        if isinstance(dest, discord.TextChannel):
+            await self._apply_edit(dest, ev["mid"], ev["src_mid"], ev["content"], ev["alias"])
+    
+    async def _bus_delete(self, ev: dict):
+        dest = self.bot.get_channel(ev["dest"])
+        if isinstance(dest, discord.TextChannel):
+            await self._apply_delete(dest, ev["pairs"])
+    
+    async def _bus_notice(self, ev: dict):
+        dest = self.bot.get_channel(ev["dest"])
+        if isinstance(dest, discord.TextChannel):
+            await dest.send(ev["text"])
 
 async def setup(bot: commands.Bot):
     await bot.add_cog(Relay(bot))
@@ -1,38 +1,92 @@
 # ──────────────────────────────────────────────
 # main.py  ─ entrypoint
 # ──────────────────────────────────────────────
-import os, asyncio, discord
+import os, asyncio
 from discord.ext import commands
 from dotenv import load_dotenv
 
+load_dotenv()                       # before utils.* read REDIS_URL & co.
+
 from cogs.pairing import Pairing
 from cogs.relay   import Relay
 from cogs.fun     import Fun
 from cogs.admin   import Admin
+from utils.state  import state
+from utils.http   import open_session, close_session
+from utils.bus    import bus
+from utils.cmdsync import sync_if_changed
+from utils.gateway import LEAN, client_options
+from utils.matchmaking import matchmaker
+from utils.webhooks    import outbox
+from utils.redis_pool  import breaker
+from utils.history     import history
+from utils.content_filter import content_filter
+from utils import metrics
 
-load_dotenv()
 TOKEN = os.getenv("DISCORD_TOKEN")
 
-INTENTS               = discord.Intents.default()
-INTENTS.message_content = True
-INTENTS.reactions       = True
-INTENTS.members         = True
+def _shard_ids(spec: str) -> list[int] | None:
+    """Parse "0-3" or "0,2,4" into the shard ids owned by this process; empty → all."""
+    ids: list[int] = []
+    for part in filter(None, (p.strip() for p in spec.split(","))):
+        lo, _, hi = part.partition("-")
+        ids.extend(range(int(lo), int(hi or lo) + 1))
+    return ids or None
+
+# cluster mode: every process runs SHARD_IDS out of SHARD_COUNT shards and
+# hands events for channels it doesn't own to the others over Redis
+SHARD_COUNT = int(os.getenv("SHARD_COUNT", "0")) or None
+SHARD_IDS   = _shard_ids(os.getenv("SHARD_IDS", ""))
+
+OPTIONS = client_options()          # intents + caches; UP_LEAN_CACHE=1 for the lean set
 
-bot = commands.Bot(command_prefix="!", intents=INTENTS)
+if SHARD_COUNT:
+    bot = commands.AutoShardedBot(command_prefix="!", **OPTIONS,
+                                  shard_count=SHARD_COUNT, shard_ids=SHARD_IDS)
+else:
+    bot = commands.Bot(command_prefix="!", **OPTIONS)
 
 @bot.event
 async def on_ready():
     print(f"🚀 {bot.user} is online!")
-    print(f"📊 Serving {len(bot.guilds)} servers")
-    synced = await bot.tree.sync()
-    print(f"✅ Synced {len(synced)} command(s)")
+    print(f"📊 Serving {len(bot.guilds)} servers" + (" (lean cache)" if LEAN else ""))
+    if SHARD_IDS is None or 0 in SHARD_IDS:     # one process per cluster syncs
+        synced = await sync_if_changed(bot.tree, bot.application_id)
+        print("✅ Commands unchanged, sync skipped" if synced is None else f"✅ Synced {synced} command(s)")
+
+async def _outbox_depth() -> int:
+    return outbox.depth()
+
+async def _breaker_open() -> int:
+    return int(breaker.open)
+
+metrics.gauge("userphone_queue_depth_regular", "Callers waiting in /call", lambda: matchmaker.length(anon=False))
+metrics.gauge("userphone_queue_depth_anon", "Callers waiting in /anoncall", lambda: matchmaker.length(anon=True))
+metrics.gauge("userphone_active_calls", "Calls in progress", state.get_active_calls_count)
+metrics.gauge("userphone_outbox_depth", "Relayed messages waiting for a webhook slot", _outbox_depth)
+metrics.gauge("userphone_redis_breaker_open", "1 while Redis is unreachable and state is served from memory", _breaker_open)
 
 async def main():
-    await bot.add_cog(Pairing(bot))
-    await bot.add_cog(Relay(bot))
-    await bot.add_cog(Fun(bot))
-    await bot.add_cog(Admin(bot))
-    await bot.start(TOKEN)
+    await state.start()
+    await history.start()
+    await content_filter.start()
+    await open_session()
+    metrics.watch_rate_limits()
+    await metrics.start_server()
+    if SHARD_IDS is not None:
+        await bus.start()
+    try:
+        await bot.add_cog(Pairing(bot))
+        await bot.add_cog(Relay(bot))
+        await bot.add_cog(Fun(bot))
+        await bot.add_cog(Admin(bot))
+        await bot.start(TOKEN)
+    finally:
+        await metrics.stop_server()
+        await close_session()
+        await history.close()
+        await content_filter.close()
+        await state.close()
 
 if __name__ == "__main__":
     asyncio.run(main())
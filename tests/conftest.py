@@ -0,0 +1,36 @@
+# ──────────────────────────────────────────────
+# tests/conftest.py
+# ──────────────────────────────────────────────
+import sys
+import pathlib
+
+import pytest
+
+sys.path.insert(0, str(pathlib.Path(__file__).resolve().parents[1]))
+
+from utils.state import state, _END_CALL_LUA     # noqa: E402
+
+
+@pytest.fixture
+def redis_state():
+    """The shared `state`, pointed at an empty fakeredis server (Lua included)."""
+    fakeredis = pytest.importorskip("fakeredis")
+    pytest.importorskip("lupa")                 # EVAL support
+    saved  = state._redis, state._end_call
+    from redis.asyncio import BlockingConnectionPool
+    # a bounded pool that queues callers, like the real one (redis_pool.get_redis)
+    client = fakeredis.aioredis.FakeRedis(server=fakeredis.FakeServer(), decode_responses=True,
+                                          max_connections=32, connection_pool_class=BlockingConnectionPool)
+    client.connection_pool.timeout = None
+    state._redis    = client
+    state._end_call = client.register_script(_END_CALL_LUA)
+    yield state
+    state._redis, state._end_call = saved
+    state._outage_calls.clear()
+    state._calls.clear()
+    state._profiles.clear()
+    state._touched = type(state._touched)(state.CACHE_SIZE, state.TOUCH_EVERY)
+    state.active_calls.clear()
+    state.call_started.clear()
+    state.anon_channels.clear()
+    state.last_activity.clear()
@@ -0,0 +1,78 @@
+# ──────────────────────────────────────────────
+# tests/test_matchmaking.py
+# ──────────────────────────────────────────────
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+from utils import matchmaking
+from utils.matchmaking import Matchmaker
+from utils.state import state
+
+TTL = 60
+
+
+@pytest.fixture(params=["redis", "local"])
+def mm(request, monkeypatch):
+    """A Matchmaker on a settable clock, over fakeredis or the in‑process queue."""
+    if request.param == "redis":
+        request.getfixturevalue("redis_state")
+    else:
+        monkeypatch.setattr(state, "_redis", None)
+    monkeypatch.setattr(state, "_healthy", [])
+    clock = SimpleNamespace(now=1_000.0)
+    monkeypatch.setattr(matchmaking, "time", SimpleNamespace(time=lambda: clock.now))
+    m = Matchmaker()
+    m.QUEUE_TTL = TTL
+    m.clock = clock
+    return m
+
+
+async def _call(m: Matchmaker, cid: int, gid: int):
+    return await m.enqueue_or_match(cid, uid=cid, gid=gid, anon=False)
+
+
+def test_unanswered_callers_expire(mm):
+    async def run():
+        assert (await _call(mm, 1, gid=10)).position == 1
+        mm.clock.now += TTL + 1
+
+        # the expired caller is skipped by the scan, then swept by expire()
+        assert (await _call(mm, 2, gid=20)).partner is None
+        assert await mm.positions(anon=False) == {2: 1}
+        assert await mm.expire() == {1: 1}
+        assert await mm.length(anon=False) == 1
+        assert await mm.queued_channel(1) is None
+        assert await mm.expire() == {}
+
+    asyncio.run(run())
+
+
+def test_calling_again_keeps_your_place(mm):
+    async def run():
+        await _call(mm, 1, gid=10)
+        mm.clock.now += TTL // 2
+        await _call(mm, 2, gid=10)
+        mm.clock.now += TTL // 2 + 1
+        assert await mm.expire() == {1: 1}         # 2 joined later and is still live
+
+        mm.clock.now += 5
+        assert (await _call(mm, 1, gid=10)).position == 1
+        match = await _call(mm, 3, gid=30)
+        assert match.partner == 1
+        assert match.waited == pytest.approx(TTL + 6)      # counted from the first /call
+
+    asyncio.run(run())
+
+
+def test_evicted_channels_go_to_the_back(mm):
+    async def run():
+        await _call(mm, 1, gid=10)
+        mm.clock.now += 1
+        await _call(mm, 2, gid=10)
+        mm.clock.now += 1
+        assert await mm.evict(1) == {1: 1}          # e.g. lost access, no place kept
+        assert (await _call(mm, 1, gid=10)).position == 2
+
+    asyncio.run(run())
@@ -0,0 +1,50 @@
+# ──────────────────────────────────────────────
+# tests/test_redis_pool.py
+# ──────────────────────────────────────────────
+import asyncio
+import threading
+
+import pytest
+
+from utils import redis_pool
+from utils.redis_pool import BlockingConnectionPool, breaker, listen
+
+
+@pytest.fixture
+def redis_url():
+    fakeredis = pytest.importorskip("fakeredis")
+    srv = fakeredis.TcpFakeServer(("127.0.0.1", 0), server_type="redis")
+    threading.Thread(target=srv.serve_forever, daemon=True).start()
+    yield "redis://%s:%d" % srv.server_address
+    srv.shutdown()
+    srv.server_close()
+
+
+def test_idle_subscriber_is_not_a_failing_server(redis_url, monkeypatch):
+    monkeypatch.setattr(redis_pool, "LISTEN_POLL", 0.3)
+    failures = []
+    monkeypatch.setattr(breaker, "failure", lambda: failures.append(1))
+
+    async def run():
+        # the shared pool's short socket timeout, on the managed connection class
+        pool = BlockingConnectionPool.from_url(redis_url, decode_responses=True, socket_timeout=0.1)
+        pool.connection_class = redis_pool._ManagedConnection
+        client = redis_pool.aioredis.Redis(connection_pool=pool)
+        got = []
+
+        async def subscriber():
+            async with client.pubsub() as pubsub:
+                await pubsub.subscribe("chan")
+                async for m in listen(pubsub):
+                    got.append(m["data"])
+                    return
+
+        task = asyncio.create_task(subscriber())
+        await asyncio.sleep(1.5)                # many socket timeouts' worth of silence
+        await client.publish("chan", "hello")
+        await asyncio.wait_for(task, 2)
+        await client.aclose()
+        return got
+
+    assert asyncio.run(run()) == ["hello"]
+    assert not failures
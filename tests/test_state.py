@@ -0,0 +1,101 @@
+# ──────────────────────────────────────────────
+# tests/test_state.py
+# ──────────────────────────────────────────────
+import asyncio
+import random
+
+PAIRS = 200
+
+
+async def _tables(st) -> dict:
+    r = st._redis
+    return {
+        "active":  await r.hgetall(st._H_ACTIVE),
+        "started": await r.hgetall(st._H_STARTED),
+        "anon":    await r.smembers(st._S_ANON),
+        "calls":   dict(await r.zrange(st._Z_CALLS, 0, -1, withscores=True)),
+        "seen":    await r.hgetall(st._H_SEEN),
+    }
+
+
+def _assert_consistent(t: dict):
+    """Every call is stored on both sides, and nothing outlives the call it belongs to."""
+    active = t["active"]
+    for cid, partner in active.items():
+        assert active.get(partner) == cid, f"{cid} -> {partner} has no way back"
+    assert set(t["started"]) == set(active)
+    assert set(t["calls"]) == set(active)
+    assert t["anon"] <= set(active)
+    assert set(t["seen"]) <= set(active)
+
+
+async def _start(st, pairs: range):
+    await asyncio.gather(*(st.start_call(2 * i, 2 * i + 1, i % 3 == 0) for i in pairs))
+    await asyncio.gather(*(st.touch(c) for i in pairs for c in (2 * i, 2 * i + 1)))
+
+
+def test_simultaneous_hangups_end_each_call_once(redis_state):
+    async def run():
+        st = redis_state
+        await _start(st, range(PAIRS))
+        _assert_consistent(await _tables(st))
+
+        # both sides of every call hang up at the same moment
+        sides = [c for i in range(PAIRS) for c in (2 * i, 2 * i + 1)]
+        random.Random(5).shuffle(sides)
+        ended = dict(zip(sides, await asyncio.gather(*(st.end_call(c) for c in sides))))
+
+        for i in range(PAIRS):
+            a, b = 2 * i, 2 * i + 1
+            # exactly one side ends the call and learns the partner; the other finds nothing
+            assert sorted((ended[a], ended[b]), key=lambda p: p is None) in ([b, None], [a, None])
+        assert await _tables(st) == {"active": {}, "started": {}, "anon": set(), "calls": {}, "seen": {}}
+
+        events = await st._redis.xrange(st._X_EVENTS)
+        kinds  = [ev["kind"] for _, ev in events]
+        assert kinds.count("start") == PAIRS
+        assert kinds.count("end") == PAIRS          # one "end" per call, never two
+
+    asyncio.run(run())
+
+
+def test_hangups_racing_new_calls_keep_tables_consistent(redis_state):
+    async def run():
+        st = redis_state
+        await _start(st, range(PAIRS))
+
+        # half the calls end from both sides while the other channels start new calls
+        ending   = [c for i in range(PAIRS // 2) for c in (2 * i, 2 * i + 1)]
+        starting = range(PAIRS, 2 * PAIRS)
+        await asyncio.gather(*(st.end_call(c) for c in ending),
+                             *(st.start_call(2 * i, 2 * i + 1, False) for i in starting))
+
+        t = await _tables(st)
+        _assert_consistent(t)
+        expected = {str(c) for i in [*range(PAIRS // 2, PAIRS), *starting] for c in (2 * i, 2 * i + 1)}
+        assert set(t["active"]) == expected
+        assert await st.get_active_calls_count() == len(expected) // 2
+
+    asyncio.run(run())
+
+
+def test_relay_cooldown_rides_on_the_context_lookup(redis_state, monkeypatch):
+    from types import SimpleNamespace
+    from utils.ratelimit import TokenBucket
+    monkeypatch.setattr(TokenBucket, "_script", None)       # registered on this test's client
+
+    async def run():
+        st = redis_state
+        await st.start_call(1, 2, False)
+        st._calls.clear()
+        user   = SimpleNamespace(id=7, display_name="caller", display_avatar=SimpleNamespace(url="av"))
+        bucket = TokenBucket("test_relay", 1, 60)
+
+        first = await st.get_call_context(1, user, cooldown=bucket)     # lookup + take, one pipeline
+        assert (first.partner, first.alias, first.allowed) == (2, "caller", True)
+        assert not (await st.get_call_context(1, user, cooldown=bucket)).allowed     # cached context
+        st._calls.clear()
+        assert not (await st.get_call_context(1, user, cooldown=bucket)).allowed
+        assert await st.get_call_context(3, user, cooldown=bucket) is None
+
+    asyncio.run(run())
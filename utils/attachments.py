@@ -0,0 +1,68 @@
+# ──────────────────────────────────────────────
+# utils/attachments.py
+# ──────────────────────────────────────────────
+"""
+Concurrent, streaming attachment download for the relay.
+
+Files are streamed in CHUNK‑sized pieces into spooled temp files that stay
+in RAM up to SPOOL_BYTES and spill to disk beyond that, so one forwarded
+message holds at most  10 × SPOOL_BYTES + MAX_CONCURRENT × CHUNK  in memory
+(Discord caps a message at 10 attachments). Anything above the passthrough
+threshold – or above the destination guild's upload limit – is forwarded as
+its CDN URL instead of being re‑uploaded.
+"""
+from __future__ import annotations
+import os
+import asyncio
+import tempfile
+
+import aiohttp
+import discord
+
+PASSTHROUGH_BYTES = int(float(os.getenv("UP_ATTACHMENT_PASSTHROUGH_MB", "8")) * 1024 * 1024)
+SPOOL_BYTES       = 1024 * 1024
+CHUNK             = 64 * 1024
+MAX_CONCURRENT    = 4
+
+
+async def _download(a: discord.Attachment, session: aiohttp.ClientSession,
+                    sem: asyncio.Semaphore) -> discord.File:
+    fp = tempfile.SpooledTemporaryFile(max_size=SPOOL_BYTES)
+    try:
+        async with sem, session.get(a.url) as resp:
+            resp.raise_for_status()
+            async for chunk in resp.content.iter_chunked(CHUNK):
+                fp.write(chunk)
+        fp.seek(0)
+        return discord.File(fp, filename=a.filename, spoiler=a.is_spoiler(),
+                            description=a.description)
+    except BaseException:
+        fp.close()
+        raise
+
+
+async def fetch_attachments(attachments: list[discord.Attachment],
+                            session: aiohttp.ClientSession,
+                            dest: discord.TextChannel) -> tuple[list[discord.File], list[str]]:
+    """Return (files to upload, URLs to forward as text) for `attachments`."""
+    limit = min(PASSTHROUGH_BYTES, dest.guild.filesize_limit)
+    small = [a for a in attachments if a.size <= limit]
+    urls  = [a.url for a in attachments if a.size > limit]
+
+    sem     = asyncio.Semaphore(MAX_CONCURRENT)
+    results = await asyncio.gather(*(_download(a, session, sem) for a in small),
+                                   return_exceptions=True)
+    files = []
+    for a, res in zip(small, results):
+        if isinstance(res, discord.File):
+            files.append(res)
+        else:
+            urls.append(a.url)      # download failed – the CDN link still works
+    return files, urls
+
+
+def release(files: list[discord.File]) -> None:
+    """Close the temp files behind `files` once they have been sent."""
+    for f in files:
+        f.close()
+        f.fp.close()
@@ -0,0 +1,86 @@
+# ──────────────────────────────────────────────
+# utils/bus.py
+# ──────────────────────────────────────────────
+"""
+Cross‑process event bus for cluster mode.
+
+When a call spans two processes, the side that sees an event cannot reach
+the partner channel (`bot.get_channel` is None for guilds on other shards).
+It publishes the event on one Redis pub/sub channel instead; every process
+receives it, and the one that has the destination channel delivers it.
+
+Events are JSON objects {"kind": ..., "dest": ch_id, ...}. Cogs register a
+handler per kind with `bus.on(kind, handler)`. Delivery is at‑most‑once,
+same as a Discord send that fails – events published while Redis is
+unreachable are dropped.
+"""
+from __future__ import annotations
+import json
+import asyncio
+import traceback
+from typing import Awaitable, Callable, Dict
+
+from .redis_pool import UNAVAILABLE, breaker, listen
+from .state      import state
+
+Handler = Callable[[dict], Awaitable[None]]
+
+
+class Bus:
+    _C_BUS = "up:bus"
+
+    def __init__(self):
+        self._handlers: Dict[str, Handler] = {}
+        self._listener: asyncio.Task | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self._listener is not None
+
+    def on(self, kind: str, handler: Handler):
+        self._handlers[kind] = handler
+
+    async def start(self):
+        if state._redis is None:
+            print("[Bus disabled] cluster mode needs Redis")
+            return
+        if self._listener is None:
+            self._listener = asyncio.create_task(self._listen())
+
+    async def publish(self, kind: str, **payload):
+        if state._r is None:
+            return
+        try:
+            await state._r.publish(self._C_BUS, json.dumps({"kind": kind, **payload}))
+        except UNAVAILABLE:
+            pass
+
+    async def _listen(self):
+        while True:
+            try:
+                # closed on the way out, so its connection goes back to the bounded pool
+                async with state._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self._C_BUS)
+                    async for m in listen(pubsub):
+                        if m["type"] != "message":
+                            continue
+                        event   = json.loads(m["data"])
+                        handler = self._handlers.get(event.get("kind"))
+                        if handler:
+                            asyncio.create_task(self._dispatch(handler, event))
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if not breaker.open:
+                    traceback.print_exc()
+                await asyncio.sleep(1)
+
+    @staticmethod
+    async def _dispatch(handler: Handler, event: dict):
+        try:
+            await handler(event)
+        except Exception:
+            traceback.print_exc()
+
+
+bus = Bus()
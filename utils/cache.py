@@ -0,0 +1,60 @@
+# ──────────────────────────────────────────────
+# utils/cache.py
+# ──────────────────────────────────────────────
+from __future__ import annotations
+import time
+from collections import OrderedDict
+from typing import Any, Generic, Hashable, Optional, TypeVar
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """
+    Bounded LRU with optional per-entry TTL.
+
+    `gen` is bumped on every invalidation so read-through callers can take
+    a snapshot before a network fetch and skip `put` if something changed
+    underneath them (otherwise a stale read could overwrite an eviction).
+    """
+
+    def __init__(self, maxsize: int, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl     = ttl
+        self.gen     = 0
+        self._data: "OrderedDict[Hashable, tuple[float, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key) is not None
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[V]:
+        item = self._data.get(key)
+        if item is None:
+            return default
+        expires, value = item
+        if expires and expires < time.monotonic():
+            del self._data[key]
+            return default
+        self._data.move_to_end(key)
+        return value
+
+    def put(self, key: Hashable, value: V, gen: int | None = None) -> None:
+        if gen is not None and gen != self.gen:
+            return
+        expires = time.monotonic() + self.ttl if self.ttl else 0.0
+        self._data[key] = (expires, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Optional[V]:
+        self.gen += 1
+        item = self._data.pop(key, None)
+        return item[1] if item else default
+
+    def clear(self) -> None:
+        self.gen += 1
+        self._data.clear()
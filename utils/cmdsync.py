@@ -0,0 +1,72 @@
+# ──────────────────────────────────────────────
+# utils/cmdsync.py
+# ──────────────────────────────────────────────
+"""
+Slash‑command sync that only talks to Discord when the tree changed.
+
+A global `tree.sync()` is a rate‑limited REST call and is almost always a
+no‑op (on_ready fires on every reconnect). The payload Discord would get
+is hashed instead, and the hash of the last successful sync is kept in
+Redis (shared by every process of the application) or in a local file,
+which also stands in while Redis is unreachable.
+"""
+from __future__ import annotations
+import json
+import hashlib
+import pathlib
+from typing import Optional
+
+from discord import app_commands
+
+from .redis_pool import UNAVAILABLE
+from .state      import state
+
+_K_HASH = "up:cmdsync:"                                        # + application id
+_FILE   = pathlib.Path(__file__).with_name("command_sync.json")    # fallback: {app_id: hash}
+
+
+def tree_hash(tree: app_commands.CommandTree) -> str:
+    """Stable hash of the global commands' registration payload."""
+    payload = sorted((c.to_dict() for c in tree.get_commands()),
+                     key=lambda d: (d.get("type", 1), d["name"]))
+    blob = json.dumps(payload, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(blob.encode()).hexdigest()
+
+
+async def _stored(app_id: int) -> Optional[str]:
+    if state._r:
+        try:
+            return await state._r.get(f"{_K_HASH}{app_id}")
+        except UNAVAILABLE:
+            pass
+    try:
+        stored = json.loads(_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        return None
+    return stored.get(str(app_id))
+
+
+async def _store(app_id: int, digest: str):
+    if state._r:
+        try:
+            await state._r.set(f"{_K_HASH}{app_id}", digest)
+            return
+        except UNAVAILABLE:
+            pass
+    try:
+        stored = json.loads(_FILE.read_text())
+    except (FileNotFoundError, ValueError):
+        stored = {}
+    stored[str(app_id)] = digest
+    _FILE.write_text(json.dumps(stored))
+
+
+async def sync_if_changed(tree: app_commands.CommandTree, app_id: int,
+                          force: bool = False) -> Optional[int]:
+    """Sync global commands if they differ from the last sync; the count synced, or None if skipped."""
+    digest = tree_hash(tree)
+    if not force and await _stored(app_id) == digest:
+        return None
+    synced = await tree.sync()
+    await _store(app_id, digest)
+    return len(synced)
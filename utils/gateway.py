@@ -0,0 +1,38 @@
+# ──────────────────────────────────────────────
+# utils/gateway.py
+# ──────────────────────────────────────────────
+"""
+Intents and cache settings for the discord.py client.
+
+Relaying needs channels, the author of each message (sent with the
+message itself) and little else, so large deployments can run lean
+(UP_LEAN_CACHE=1): no members intent, no member cache, no member
+chunking at startup and a small message cache (UP_MESSAGE_CACHE).
+Reactors are then resolved on demand – see Relay.on_raw_reaction_add.
+"""
+from __future__ import annotations
+import os
+
+import discord
+
+LEAN          = os.getenv("UP_LEAN_CACHE", "").lower() in ("1", "true", "yes")
+MESSAGE_CACHE = int(os.getenv("UP_MESSAGE_CACHE", "100"))      # lean mode only
+
+
+def client_options(lean: bool = LEAN) -> dict:
+    """Keyword arguments for commands.Bot / AutoShardedBot."""
+    intents = discord.Intents.default()
+    intents.message_content = True
+    intents.reactions       = True
+    intents.members         = not lean
+    if not lean:
+        return {"intents": intents}
+
+    intents.typing       = False      # never used; saves gateway traffic
+    intents.voice_states = False
+    return {
+        "intents":                 intents,
+        "member_cache_flags":      discord.MemberCacheFlags.none(),
+        "chunk_guilds_at_startup": False,
+        "max_messages":            MESSAGE_CACHE,
+    }
@@ -0,0 +1,309 @@
+# ──────────────────────────────────────────────
+# utils/history.py
+# ──────────────────────────────────────────────
+"""
+Call history: an event stream folded into rollups that /stats reads.
+
+Events ({"kind": "match" | "start" | "end", "ts", "a", "b", …}) are
+appended where they happen, in the same round trip as the state change:
+matches by the matchmaking script, starts by State.start_call's pipeline,
+ends by the hang‑up script (exactly one side records it). They land in
+the `up:events` stream, capped at State.EVENTS_KEPT.
+
+One process at a time (`try_lock`) reads new events every ROLLUP_EVERY s
+and adds them to the rollups in a transaction that also moves the read
+cursor, so every event is counted once:
+  up:stats:cursor        str   last stream id folded in
+  up:stats:totals        hash  matches, wait_s, calls, anon, ended, talk_s
+  up:stats:hour:<h>      hash  calls, ended, talk_s for epoch hour h (HOURS_KEPT)
+  up:stats:duration      hash  bucket label -> ended calls
+  up:stats:guilds        zset  guild_id -> matches
+
+Without Redis, events are appended to call_events.jsonl and folded in at
+once; the rollups are snapshotted with the log offset they cover, so a
+restart replays only the tail of the log. Events recorded while Redis is
+unreachable are kept in memory and added to the stream once it answers.
+"""
+from __future__ import annotations
+import json
+import math
+import time
+import heapq
+import asyncio
+import pathlib
+import traceback
+from collections import deque
+from typing import Dict, NamedTuple, Optional
+
+from redis.exceptions import WatchError
+
+from .redis_pool import UNAVAILABLE
+from .state      import state
+from .jsonstore  import JsonStore
+
+# upper bound (s) → label; an ended call goes in the first bucket it fits
+DURATION_BUCKETS = ((60, "<1m"), (300, "1–5m"), (900, "5–15m"), (1800, "15–30m"),
+                    (3600, "30–60m"), (math.inf, "1h+"))
+
+
+def _bucket(secs: float) -> str:
+    return next(label for limit, label in DURATION_BUCKETS if secs < limit)
+
+
+def _add(d: dict, key, n: float = 1):
+    d[key] = d.get(key, 0) + n
+
+
+class Rollup:
+    """Aggregates folded from call events – the whole history, or one batch's delta."""
+
+    def __init__(self):
+        self.totals:    Dict[str, float]            = {}
+        self.hours:     Dict[int, Dict[str, float]] = {}   # epoch hour -> counters
+        self.durations: Dict[str, float]            = {}
+        self.guilds:    Dict[int, float]            = {}
+
+    def apply(self, ev: dict):
+        """Fold in one event (values may be strings, as read from the stream)."""
+        kind, hour = ev["kind"], int(float(ev["ts"]) // 3600)
+        if kind == "match":
+            _add(self.totals, "matches")
+            _add(self.totals, "wait_s", float(ev["wait"]))
+            _add(self.guilds, int(ev["ga"]))
+            _add(self.guilds, int(ev["gb"]))
+        elif kind == "start":
+            _add(self.totals, "calls")
+            _add(self.totals, "anon", int(ev["anon"]))
+            _add(self.hours.setdefault(hour, {}), "calls")
+        elif kind == "end":
+            secs = float(ev["secs"])
+            _add(self.totals, "ended")
+            _add(self.totals, "talk_s", secs)
+            _add(self.hours.setdefault(hour, {}), "ended")
+            _add(self.hours.setdefault(hour, {}), "talk_s", secs)
+            _add(self.durations, _bucket(secs))
+
+    def trim(self, oldest: int):
+        for h in [h for h in self.hours if h < oldest]:
+            del self.hours[h]
+
+    def to_json(self) -> dict:
+        return {"totals": self.totals, "hours": self.hours,
+                "durations": self.durations, "guilds": self.guilds}
+
+    @classmethod
+    def from_json(cls, data: dict) -> "Rollup":
+        r = cls()
+        r.totals    = dict(data.get("totals", {}))
+        r.hours     = {int(h): dict(v) for h, v in data.get("hours", {}).items()}
+        r.durations = dict(data.get("durations", {}))
+        r.guilds    = {int(g): n for g, n in data.get("guilds", {}).items()}
+        return r
+
+
+class Summary(NamedTuple):
+    calls:      int                         # started, all time
+    last_day:   int                         # started in the last 24 h
+    peak_hour:  int                         # most calls started in one of those hours
+    avg_wait:   Optional[float]             # s from first /call to a match
+    avg_talk:   Optional[float]             # s per ended call
+    durations:  list[tuple[str, int]]       # (bucket label, ended calls), shortest first
+    top_guilds: list[tuple[int, int]]       # (guild_id, matches), busiest first
+
+
+class History:
+    _K_CURSOR = "up:stats:cursor"
+    _H_TOTALS = "up:stats:totals"
+    _P_HOUR   = "up:stats:hour:"
+    _H_DUR    = "up:stats:duration"
+    _Z_GUILDS = "up:stats:guilds"
+
+    ROLLUP_EVERY = 5            # s between folds of new stream events
+    BATCH        = 1000         # events per fold transaction
+    HOURS_KEPT   = 48           # hourly rollups older than this expire
+    TOP_GUILDS   = 5
+    OUTAGE_KEPT  = 10_000       # events buffered while Redis is unreachable
+
+    def __init__(self):
+        self._rollup  = Rollup()
+        self._outage: deque[dict] = deque(maxlen=self.OUTAGE_KEPT)
+        self._task:   asyncio.Task | None = None
+        self._last:   Summary | None = None     # served while Redis is unreachable
+
+        # no‑Redis mode: append‑only log + rollup snapshot
+        here = pathlib.Path(__file__)
+        self.log_path = here.with_name("call_events.jsonl")
+        self._store   = JsonStore(here.with_name("call_stats.json"), self._snapshot)
+        self._offset  = 0                   # log bytes covered by the rollup, written or not
+        self._pending: list[str] = []       # lines not appended yet
+        self._writer: asyncio.Task | None = None
+
+        state.on_record(self._record)
+        state.on_healthy(self._flush_outage)
+        if state._redis is None:
+            self.load()
+
+    # ───────── lifecycle ─────────
+    def load(self):
+        """Restore the rollup snapshot and fold in the log written after it."""
+        data = self._store.load({})
+        self._rollup = Rollup.from_json(data.get("rollup", {}))
+        try:
+            with open(self.log_path, "rb") as f:
+                start = min(data.get("offset", 0), f.seek(0, 2))
+                f.seek(start)
+                tail = f.read()
+        except FileNotFoundError:
+            return
+        for line in tail.splitlines():
+            try:
+                self._rollup.apply(json.loads(line))
+            except (ValueError, KeyError):
+                continue                    # torn last line after a crash
+        # the snapshot catches up with the next recorded event
+        self._offset = start + len(tail)
+
+    async def start(self):
+        """Start folding the Redis stream into the rollups."""
+        if state._redis and self._task is None:
+            self._task = asyncio.create_task(self._consume())
+
+    async def close(self):
+        """Append buffered events and write the rollup snapshot (no‑Redis mode)."""
+        await self._append()
+        await self._store.flush()
+
+    # ───────── recording ─────────
+    def _record(self, event: dict):
+        if state._redis is not None:
+            self._outage.append(event)      # added to the stream once Redis is back
+            return
+        line = json.dumps(event, separators=(",", ":")) + "\n"
+        self._pending.append(line)
+        self._offset += len(line.encode())
+        self._rollup.apply(event)
+        self._rollup.trim(int(event["ts"] // 3600) - self.HOURS_KEPT)
+        self._store.mark_dirty()
+        if self._writer is None or self._writer.done():
+            self._writer = asyncio.create_task(self._append_later())
+
+    async def _append_later(self):
+        await asyncio.sleep(JsonStore.DELAY)
+        await self._append()
+
+    async def _append(self):
+        lines, self._pending = self._pending, []
+        if not lines:
+            return
+        try:
+            await asyncio.to_thread(self._write, "".join(lines))
+        except Exception:
+            traceback.print_exc()
+            self._pending[:0] = lines
+
+    def _write(self, text: str):
+        with open(self.log_path, "a", encoding="utf-8") as f:
+            f.write(text)
+
+    def _snapshot(self) -> dict:
+        return {"offset": self._offset, "rollup": self._rollup.to_json()}
+
+    async def _flush_outage(self):
+        if not self._outage or state._r is None:
+            return
+        events = list(self._outage)
+        pipe = state._r.pipeline(transaction=False)
+        for ev in events:
+            pipe.xadd(state._X_EVENTS, ev, maxlen=state.EVENTS_KEPT, approximate=True)
+        await pipe.execute()
+        for _ in events:
+            self._outage.popleft()
+
+    # ───────── Redis consumer ─────────
+    async def _consume(self):
+        while True:
+            await asyncio.sleep(self.ROLLUP_EVERY)
+            try:
+                if await state.try_lock("rollup", self.ROLLUP_EVERY):
+                    while await self.fold() == self.BATCH:
+                        pass
+            except asyncio.CancelledError:
+                raise
+            except UNAVAILABLE:
+                pass
+            except Exception:
+                traceback.print_exc()
+
+    async def fold(self) -> int:
+        """Add the next batch of stream events to the rollups; how many were folded."""
+        async with state._r.pipeline(transaction=True) as pipe:
+            await pipe.watch(self._K_CURSOR)
+            cursor = await pipe.get(self._K_CURSOR) or "0-0"
+            read   = await pipe.xread({state._X_EVENTS: cursor}, count=self.BATCH)
+            events = read[0][1] if read else []
+            if not events:
+                return 0
+            delta = Rollup()
+            for _, ev in events:
+                delta.apply(ev)
+            pipe.multi()
+            for field, n in delta.totals.items():
+                pipe.hincrbyfloat(self._H_TOTALS, field, n)
+            for hour, counters in delta.hours.items():
+                for field, n in counters.items():
+                    pipe.hincrbyfloat(f"{self._P_HOUR}{hour}", field, n)
+                pipe.expire(f"{self._P_HOUR}{hour}", (self.HOURS_KEPT + 1) * 3600)
+            for label, n in delta.durations.items():
+                pipe.hincrby(self._H_DUR, label, int(n))
+            for gid, n in delta.guilds.items():
+                pipe.zincrby(self._Z_GUILDS, n, str(gid))
+            pipe.set(self._K_CURSOR, events[-1][0])
+            try:
+                await pipe.execute()
+            except WatchError:
+                return 0            # another process folded this batch
+        return len(events)
+
+    # ───────── reads ─────────
+    async def summary(self) -> Summary:
+        """The rollups /stats shows – a fixed number of reads, however long the history."""
+        hour = int(time.time() // 3600)
+        day  = range(hour - 23, hour + 1)
+        if state._r:
+            try:
+                pipe = state._r.pipeline(transaction=False)
+                pipe.hgetall(self._H_TOTALS)
+                pipe.hgetall(self._H_DUR)
+                pipe.zrevrange(self._Z_GUILDS, 0, self.TOP_GUILDS - 1, withscores=True)
+                for h in day:
+                    pipe.hget(f"{self._P_HOUR}{h}", "calls")
+                totals, durations, top, *hourly = await pipe.execute()
+                self._last = self._summary({k: float(v) for k, v in totals.items()},
+                                     {k: float(v) for k, v in durations.items()},
+                                     [(int(g), int(n)) for g, n in top],
+                                     [float(n or 0) for n in hourly])
+                return self._last
+            except UNAVAILABLE:
+                pass
+        if state._redis is not None and self._last is not None:
+            return self._last
+        r = self._rollup
+        top = heapq.nlargest(self.TOP_GUILDS, r.guilds.items(), key=lambda kv: kv[1])
+        return self._summary(r.totals, r.durations, [(g, int(n)) for g, n in top],
+                             [r.hours.get(h, {}).get("calls", 0) for h in day])
+
+    @staticmethod
+    def _summary(totals: dict, durations: dict, top: list, hourly: list) -> Summary:
+        matches, ended = totals.get("matches", 0), totals.get("ended", 0)
+        return Summary(
+            calls=int(totals.get("calls", 0)),
+            last_day=int(sum(hourly)),
+            peak_hour=int(max(hourly, default=0)),
+            avg_wait=totals.get("wait_s", 0) / matches if matches else None,
+            avg_talk=totals.get("talk_s", 0) / ended if ended else None,
+            durations=[(label, int(durations[label])) for _, label in DURATION_BUCKETS if durations.get(label)],
+            top_guilds=top,
+        )
+
+
+history = History()
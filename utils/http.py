@@ -0,0 +1,35 @@
+# ──────────────────────────────────────────────
+# utils/http.py
+# ──────────────────────────────────────────────
+"""
+One pooled aiohttp session for every outbound CDN fetch (attachments,
+stickers). Opened and closed with the bot in main.py, so connections and
+TLS sessions are reused across messages.
+"""
+from __future__ import annotations
+import aiohttp
+
+_session: aiohttp.ClientSession | None = None
+
+
+async def open_session() -> aiohttp.ClientSession:
+    global _session
+    if _session is None or _session.closed:
+        _session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=100, limit_per_host=20, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=120, sock_connect=10, sock_read=30),
+        )
+    return _session
+
+
+def get_session() -> aiohttp.ClientSession:
+    if _session is None or _session.closed:
+        raise RuntimeError("HTTP session not open – call open_session() first")
+    return _session
+
+
+async def close_session() -> None:
+    global _session
+    if _session is not None:
+        await _session.close()
+        _session = None
@@ -0,0 +1,63 @@
+# ──────────────────────────────────────────────
+# utils/jsonstore.py
+# ──────────────────────────────────────────────
+"""
+Debounced JSON snapshots for the no‑Redis fallback.
+
+Mutations only mark the store dirty. A background task waits DELAY
+seconds (so a burst of /settings calls costs one write), takes a cheap
+snapshot on the event loop, then serialises and writes it from a worker
+thread to a temp file that is atomically renamed over the old one.
+"""
+from __future__ import annotations
+import os
+import json
+import asyncio
+import pathlib
+import traceback
+from typing import Any, Callable
+
+
+class JsonStore:
+    DELAY = 2.0      # s to coalesce writes
+
+    def __init__(self, path: pathlib.Path, snapshot: Callable[[], Any]):
+        self.path = path
+        self._snapshot = snapshot
+        self._dirty = False
+        self._task: asyncio.Task | None = None
+        self._lock = asyncio.Lock()
+
+    def load(self, default: Any) -> Any:
+        try:
+            return json.loads(self.path.read_text())
+        except FileNotFoundError:
+            return default
+
+    def mark_dirty(self):
+        self._dirty = True
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._writer())
+
+    async def _writer(self):
+        while self._dirty:
+            await asyncio.sleep(self.DELAY)
+            await self.flush()
+
+    async def flush(self):
+        """Write now if anything changed since the last write."""
+        async with self._lock:
+            if not self._dirty:
+                return
+            self._dirty = False
+            payload = self._snapshot()
+            try:
+                await asyncio.to_thread(self._write, payload)
+            except Exception:
+                traceback.print_exc()
+                self._dirty = True
+
+    def _write(self, payload: Any):
+        tmp = self.path.with_suffix(self.path.suffix + ".tmp")
+        tmp.write_text(json.dumps(payload, separators=(",", ":")))
+        os.replace(tmp, self.path)
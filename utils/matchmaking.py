@@ -0,0 +1,489 @@
+# ──────────────────────────────────────────────
+# utils/matchmaking.py
+# ──────────────────────────────────────────────
+"""
+Call queue shared by every bot process.
+
+Redis layout (one sorted set per queue, scored by how long the caller has
+been trying):
+  up:queue:reg / up:queue:anon   zset  ch_id -> first /call ts (see aging below)
+  up:q:deadline                  zset  ch_id -> ts after which nobody answered
+  up:q:aged:<ch_id>              str   first /call ts, kept AGING_GRACE s after expiry
+  up:q:owner                     hash  ch_id -> "user_id:guild_id"
+  up:q:user                      hash  user_id -> ch_id
+  up:q:msg                       hash  ch_id -> id of its "Calling…" placeholder message
+  up:q:guilds:reg / …:anon       hash  guild_id -> queued count
+  up:q:matched:reg / …:anon      zset  "ch_id:ts" -> ts of each match (last RATE_WINDOW s)
+
+Every match is also appended to the call event stream (State._X_EVENTS).
+The placeholder ids let a restarted process pick up the placeholders of
+callers who queued before it went down (`placeholders()`).
+
+Guards, partner selection and enqueueing run in one Lua script so two
+shards can never grab the same partner. Without Redis the same logic runs
+on an in‑process `ChannelQueue`; while Redis is unreachable callers queue
+there too and are moved into the shared queue once it answers again.
+
+Each entry expires QUEUE_TTL after it joined: the scan skips it and
+`expire()` takes it out so the placeholder can say nobody answered. That
+clears out callers who walked away without hanging up, who would
+otherwise be handed to the next caller as a dead call. The line is
+ordered by the first /call, not the latest one: whoever calls again from
+the same channel within AGING_GRACE keeps their place, so the TTL costs
+people who are still there nothing. There is no other priority to give:
+callers from different guilds are matched as soon as they meet, so the
+live entries in a queue all belong to one guild and the order only
+decides which of them goes first (bench/queue_sim.py).
+"""
+from __future__ import annotations
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Dict, NamedTuple, Optional
+
+from .redis_pool import UNAVAILABLE
+from .state      import state
+
+
+class Match(NamedTuple):
+    partner:  Optional[int] = None   # channel we were paired with
+    position: Optional[int] = None   # 1‑based place in line when queued
+    conflict: Optional[str] = None   # "busy" | "waiting" | "elsewhere"
+    waited:   Optional[float] = None # s the partner spent in the queue
+    guild:    Optional[int] = None   # the partner's guild
+
+
+_MATCH_LUA = """
+local cid, uid, gid, window = ARGV[1], ARGV[2], ARGV[3], ARGV[5]
+local now, ttl = tonumber(ARGV[4]), tonumber(ARGV[6])
+local kept, anon = ARGV[7], ARGV[8]
+
+local mine = redis.call('HGET', KEYS[3], uid)
+if mine then
+  if mine == cid then return {'waiting', cid} end
+  return {'elsewhere', mine}
+end
+if redis.call('HEXISTS', KEYS[2], cid) == 1 then return {'busy', cid} end
+
+-- every queued caller is from our guild → nothing to scan
+local same = tonumber(redis.call('HGET', KEYS[4], gid) or '0')
+local start, batch = 0, 100
+if redis.call('ZCARD', KEYS[1]) <= same then start = -1 end
+while start >= 0 do
+  local ids = redis.call('ZRANGE', KEYS[1], start, start + batch - 1)
+  if #ids == 0 then break end
+  for _, other in ipairs(ids) do
+    local owner = redis.call('HGET', KEYS[2], other)
+    local due   = redis.call('ZSCORE', KEYS[6], other)
+    -- expired callers are skipped here and swept by expire()
+    if owner and not (due and tonumber(due) < now) then
+      local sep  = string.find(owner, ':', 1, true)
+      local ouid = string.sub(owner, 1, sep - 1)
+      local ogid = string.sub(owner, sep + 1)
+      if ouid ~= uid and ogid ~= gid then
+        local since = redis.call('ZSCORE', KEYS[1], other)
+        redis.call('ZREM', KEYS[1], other)
+        redis.call('ZREM', KEYS[6], other)
+        redis.call('HDEL', KEYS[2], other)
+        redis.call('HDEL', KEYS[3], ouid)
+        redis.call('HDEL', KEYS[9], other)
+        if redis.call('HINCRBY', KEYS[4], ogid, -1) <= 0 then redis.call('HDEL', KEYS[4], ogid) end
+        redis.call('ZADD', KEYS[5], now, other .. ':' .. now)
+        redis.call('ZREMRANGEBYSCORE', KEYS[5], '-inf', now - window)
+        redis.call('XADD', KEYS[8], 'MAXLEN', '~', kept, '*', 'kind', 'match', 'ts', now,
+                   'a', cid, 'b', other, 'ga', gid, 'gb', ogid, 'anon', anon, 'wait', now - tonumber(since))
+        return {'matched', other, since, ogid}
+      end
+    end
+  end
+  start = start + batch
+  if #ids < batch then break end
+end
+
+-- calling again after nobody answered: back to the place we had
+local since = redis.call('GET', KEYS[7]) or now
+redis.call('DEL', KEYS[7])
+redis.call('ZADD', KEYS[1], since, cid)
+if ttl > 0 then redis.call('ZADD', KEYS[6], now + ttl, cid) end
+redis.call('HSET', KEYS[2], cid, uid .. ':' .. gid)
+redis.call('HSET', KEYS[3], uid, cid)
+redis.call('HINCRBY', KEYS[4], gid, 1)
+return {'queued', tostring(redis.call('ZRANK', KEYS[1], cid) + 1)}
+"""
+
+_CANCEL_LUA = """
+local cid = redis.call('HGET', KEYS[1], ARGV[1])
+if not cid then return false end
+local owner = redis.call('HGET', KEYS[2], cid)
+redis.call('HDEL', KEYS[1], ARGV[1])
+redis.call('HDEL', KEYS[2], cid)
+redis.call('ZREM', KEYS[7], cid)
+redis.call('HDEL', KEYS[8], cid)
+for i = 3, 4 do
+  if redis.call('ZREM', KEYS[i], cid) == 1 and owner then
+    local gid = string.sub(owner, string.find(owner, ':', 1, true) + 1)
+    if redis.call('HINCRBY', KEYS[i + 2], gid, -1) <= 0 then redis.call('HDEL', KEYS[i + 2], gid) end
+  end
+end
+return cid
+"""
+
+# the same cleanup keyed by channel (expired or dead channels); returns the owner's user id.
+# With ARGV[2] > 0 the channel's place in line is kept that many seconds for a new /call.
+_EVICT_LUA = """
+local owner = redis.call('HGET', KEYS[2], ARGV[1])
+if not owner then return false end
+local sep = string.find(owner, ':', 1, true)
+local uid, gid = string.sub(owner, 1, sep - 1), string.sub(owner, sep + 1)
+redis.call('HDEL', KEYS[2], ARGV[1])
+redis.call('ZREM', KEYS[7], ARGV[1])
+redis.call('HDEL', KEYS[9], ARGV[1])
+if redis.call('HGET', KEYS[1], uid) == ARGV[1] then redis.call('HDEL', KEYS[1], uid) end
+for i = 3, 4 do
+  local since = redis.call('ZSCORE', KEYS[i], ARGV[1])
+  if since then
+    redis.call('ZREM', KEYS[i], ARGV[1])
+    if redis.call('HINCRBY', KEYS[i + 2], gid, -1) <= 0 then redis.call('HDEL', KEYS[i + 2], gid) end
+    if tonumber(ARGV[2]) > 0 then redis.call('SET', KEYS[8], since, 'EX', ARGV[2]) end
+  end
+end
+return uid
+"""
+
+# remember a placeholder only while its channel is still queued
+_PLACEHOLDER_LUA = """
+if redis.call('HEXISTS', KEYS[1], ARGV[1]) == 0 then return 0 end
+return redis.call('HSET', KEYS[2], ARGV[1], ARGV[2])
+"""
+
+
+class Entry(NamedTuple):
+    uid:   int
+    gid:   int
+    since: float            # first /call (place in line)
+    due:   float            # expires after this (inf: never)
+
+
+class ChannelQueue:
+    """
+    Queued channels in order of `since`, indexed by channel and by guild.
+
+    Finding the oldest caller from another guild only walks past entries
+    of the caller's own guild (and expired ones not swept yet), so matching
+    stays O(1) in total queue length. Callers are appended; only someone
+    returning to an earlier place costs a rebuild of the order.
+    """
+
+    def __init__(self):
+        self._fifo: "OrderedDict[int, Entry]" = OrderedDict()   # ch_id -> entry, oldest first
+        self._by_guild: Dict[int, set[int]] = {}                 # guild_id -> queued ch_ids
+
+    def __len__(self) -> int:
+        return len(self._fifo)
+
+    def __contains__(self, cid: int) -> bool:
+        return cid in self._fifo
+
+    def owner(self, cid: int) -> Optional[Entry]:
+        return self._fifo.get(cid)
+
+    def items(self):
+        """(ch_id, Entry) pairs, oldest first."""
+        return self._fifo.items()
+
+    def push(self, cid: int, entry: Entry) -> int:
+        """Queue `cid`; its 1‑based position."""
+        self._by_guild.setdefault(entry.gid, set()).add(cid)
+        if not self._fifo or next(reversed(self._fifo.values())).since <= entry.since:
+            self._fifo[cid] = entry
+            return len(self._fifo)
+        ordered = sorted([*self._fifo.items(), (cid, entry)], key=lambda kv: kv[1].since)
+        self._fifo = OrderedDict(ordered)
+        return next(n for n, (c, _) in enumerate(ordered, 1) if c == cid)
+
+    def remove(self, cid: int) -> Optional[Entry]:
+        entry = self._fifo.pop(cid, None)
+        if entry is not None:
+            same = self._by_guild[entry.gid]
+            same.discard(cid)
+            if not same:
+                del self._by_guild[entry.gid]
+        return entry
+
+    def pop_match(self, uid: int, gid: int, now: float) -> Optional[tuple[int, Entry]]:
+        """Remove and return the oldest unexpired caller outside `gid`."""
+        if len(self._fifo) == len(self._by_guild.get(gid, ())):
+            return None
+        for cid, e in self._fifo.items():
+            if e.gid != gid and e.uid != uid and e.due >= now:
+                break
+        else:
+            return None
+        self.remove(cid)
+        return cid, e
+
+    def expired(self, now: float) -> list[int]:
+        return [cid for cid, e in self._fifo.items() if e.due < now]
+
+
+class Matchmaker:
+    _Z_QUEUE = {False: "up:queue:reg", True: "up:queue:anon"}
+    _Z_DUE   = "up:q:deadline"
+    _P_AGED  = "up:q:aged:"
+    _H_OWNER = "up:q:owner"
+    _H_USER  = "up:q:user"
+    _H_MSG   = "up:q:msg"
+    _H_GUILD = {False: "up:q:guilds:reg", True: "up:q:guilds:anon"}
+    _Z_RATE  = {False: "up:q:matched:reg", True: "up:q:matched:anon"}
+
+    QUEUE_TTL    = int(os.getenv("UP_QUEUE_TTL_MINUTES", "5")) * 60   # s before "no one answered"; 0 = never
+    AGING_GRACE  = 10 * 60      # s a timed‑out channel keeps its place for a new /call
+    RATE_WINDOW  = 15 * 60      # s of matches behind match_rate()
+    RATE_SAMPLES = 3            # fewer matches than this in the window → no estimate
+
+    def __init__(self):
+        # no‑Redis fallback
+        self._local: Dict[bool, ChannelQueue] = {False: ChannelQueue(), True: ChannelQueue()}
+        self._user:  Dict[int, int]           = {}   # user_id -> ch_id
+        self._aged:  Dict[int, tuple[float, float]] = {}  # ch_id -> (since, kept until)
+        self._matched: Dict[bool, deque[float]] = {False: deque(), True: deque()}   # match times
+        self._match_script  = None
+        self._cancel_script = None
+        self._evict_script  = None
+        self._placeholder_script = None
+        state.on_healthy(self._flush_local)
+
+    @property
+    def _r(self):
+        return state._r
+
+    def _scripts(self):
+        if self._match_script is None:
+            self._match_script  = self._r.register_script(_MATCH_LUA)
+            self._cancel_script = self._r.register_script(_CANCEL_LUA)
+            self._evict_script  = self._r.register_script(_EVICT_LUA)
+            self._placeholder_script = self._r.register_script(_PLACEHOLDER_LUA)
+        return self._match_script, self._cancel_script
+
+    def _due(self, now: float) -> float:
+        return now + self.QUEUE_TTL if self.QUEUE_TTL else float("inf")
+
+    # ───────── queue operations ─────────
+    async def enqueue_or_match(self, cid: int, uid: int, gid: int, anon: bool) -> Match:
+        """Pair `cid` with the longest‑waiting caller from another guild, or queue it."""
+        if self._r:
+            match, _ = self._scripts()
+            try:
+                status, value, *extra = await match(
+                    keys=[self._Z_QUEUE[anon], self._H_OWNER, self._H_USER, self._H_GUILD[anon],
+                          self._Z_RATE[anon], self._Z_DUE, f"{self._P_AGED}{cid}", state._X_EVENTS,
+                          self._H_MSG],
+                    args=[cid, uid, gid, time.time(), self.RATE_WINDOW, self.QUEUE_TTL,
+                          state.EVENTS_KEPT, int(anon)],
+                )
+            except UNAVAILABLE:
+                status = None       # queue locally until Redis is back
+            if status == "matched":
+                since, ogid = extra
+                return Match(partner=int(value), waited=time.time() - float(since), guild=int(ogid))
+            if status == "queued":
+                return Match(position=int(value))
+            if status:
+                return Match(conflict=status)
+
+        mine = self._user.get(uid)
+        if mine is not None:
+            return Match(conflict="waiting" if mine == cid else "elsewhere")
+        if any(cid in q for q in self._local.values()):
+            return Match(conflict="busy")
+
+        queue = self._local[anon]
+        now   = time.time()
+        found = queue.pop_match(uid, gid, now)
+        if found:
+            partner, e = found
+            del self._user[e.uid]
+            self._matched[anon].append(now)
+            state.record("match", a=cid, b=partner, ga=gid, gb=e.gid, anon=int(anon), wait=now - e.since)
+            return Match(partner=partner, waited=now - e.since, guild=e.gid)
+
+        since, kept = self._aged.pop(cid, (now, now))
+        self._user[uid] = cid
+        return Match(position=queue.push(cid, Entry(uid, gid, since if kept >= now else now, self._due(now))))
+
+    async def cancel(self, uid: int) -> Optional[int]:
+        """Drop `uid`'s queued channel from either queue and return it."""
+        if self._r:
+            _, cancel = self._scripts()
+            try:
+                cid = await cancel(
+                    keys=[self._H_USER, self._H_OWNER, self._Z_QUEUE[False], self._Z_QUEUE[True],
+                          self._H_GUILD[False], self._H_GUILD[True], self._Z_DUE, self._H_MSG],
+                    args=[uid],
+                )
+                return int(cid) if cid else None
+            except UNAVAILABLE:
+                pass
+
+        cid = self._user.pop(uid, None)
+        if cid is not None:
+            for q in self._local.values():
+                q.remove(cid)
+        return cid
+
+    async def evict(self, *cids: int, keep_place: bool = False) -> Dict[int, int]:
+        """
+        Drop channels from either queue (timed out, deleted, no access);
+        {ch_id: user_id} of those removed. `keep_place` lets each come back
+        to the same place in line within AGING_GRACE.
+        """
+        if not cids:
+            return {}
+        grace = self.AGING_GRACE if keep_place else 0
+        if self._r:
+            self._scripts()
+            try:
+                pipe = self._r.pipeline(transaction=False)
+                for cid in cids:
+                    await self._evict_script(
+                        keys=[self._H_USER, self._H_OWNER, self._Z_QUEUE[False], self._Z_QUEUE[True],
+                              self._H_GUILD[False], self._H_GUILD[True], self._Z_DUE,
+                              f"{self._P_AGED}{cid}", self._H_MSG],
+                        args=[cid, grace], client=pipe,
+                    )
+                owners = await pipe.execute()
+                return {cid: int(uid) for cid, uid in zip(cids, owners) if uid}
+            except UNAVAILABLE:
+                pass
+
+        removed, now = {}, time.time()
+        for cid in cids:
+            for q in self._local.values():
+                e = q.remove(cid)
+                if e is None:
+                    continue
+                removed[cid] = e.uid
+                if self._user.get(e.uid) == cid:
+                    del self._user[e.uid]
+                if grace:
+                    self._aged[cid] = (e.since, now + grace)
+        return removed
+
+    async def expire(self) -> Dict[int, int]:
+        """Remove callers nobody answered within QUEUE_TTL; {ch_id: user_id} of those removed."""
+        if not self.QUEUE_TTL:
+            return {}
+        now = time.time()
+        self._aged = {c: v for c, v in self._aged.items() if v[1] >= now}
+        due: list[int] = []
+        if self._r:
+            try:
+                due = [int(c) for c in await self._r.zrangebyscore(self._Z_DUE, "-inf", f"({now}")]
+            except UNAVAILABLE:
+                pass
+        for q in self._local.values():
+            due += q.expired(now)
+        return await self.evict(*due, keep_place=True)
+
+    # ───────── placeholders ─────────
+    async def set_placeholder(self, cid: int, mid: int):
+        """Record `cid`'s placeholder message so it outlives this process (Redis only)."""
+        if self._r:
+            self._scripts()
+            try:
+                await self._placeholder_script(keys=[self._H_OWNER, self._H_MSG], args=[cid, mid])
+            except UNAVAILABLE:
+                pass
+
+    async def placeholders(self) -> Dict[int, int]:
+        """{ch_id: placeholder message id} of every queued channel that has one."""
+        if not self._r:
+            return {}
+        try:
+            return {int(c): int(m) async for c, m in self._r.hscan_iter(self._H_MSG, count=500)}
+        except UNAVAILABLE:
+            return {}
+
+    # ───────── lookups ─────────
+    async def queued_channel(self, uid: int) -> Optional[int]:
+        if self._r:
+            try:
+                cid = await self._r.hget(self._H_USER, str(uid))
+                return int(cid) if cid else None
+            except UNAVAILABLE:
+                pass
+        return self._user.get(uid)
+
+    async def owner_of(self, cid: int) -> Optional[int]:
+        if self._r:
+            try:
+                owner = await self._r.hget(self._H_OWNER, str(cid))
+                return int(owner.split(":", 1)[0]) if owner else None
+            except UNAVAILABLE:
+                pass
+        for q in self._local.values():
+            entry = q.owner(cid)
+            if entry:
+                return entry.uid
+        return None
+
+    async def length(self, anon: bool) -> int:
+        if self._r:
+            try:
+                return await self._r.zcard(self._Z_QUEUE[anon])
+            except UNAVAILABLE:
+                pass
+        return len(self._local[anon])
+
+    async def positions(self, anon: bool) -> Dict[int, int]:
+        """1‑based place in line of every unexpired channel in the queue, in one round trip."""
+        now = time.time()
+        if self._r:
+            try:
+                pipe = self._r.pipeline(transaction=False)
+                pipe.zrange(self._Z_QUEUE[anon], 0, -1)
+                pipe.zrangebyscore(self._Z_DUE, "-inf", f"({now}")
+                ids, expired = await pipe.execute()
+                expired = set(expired)
+                return {int(cid): n for n, cid in enumerate((c for c in ids if c not in expired), 1)}
+            except UNAVAILABLE:
+                pass
+        live = (cid for cid, e in self._local[anon].items() if e.due >= now)
+        return {cid: n for n, cid in enumerate(live, 1)}
+
+    async def match_rate(self, anon: bool) -> Optional[float]:
+        """Matches per second over the last RATE_WINDOW s; None while there are too few to tell."""
+        since = time.time() - self.RATE_WINDOW
+        count = None
+        if self._r:
+            try:
+                count = await self._r.zcount(self._Z_RATE[anon], since, "+inf")
+            except UNAVAILABLE:
+                pass
+        if count is None:
+            recent = self._matched[anon]
+            while recent and recent[0] < since:
+                recent.popleft()
+            count = len(recent)
+        return count / self.RATE_WINDOW if count >= self.RATE_SAMPLES else None
+
+    async def _flush_local(self):
+        """Move callers that queued locally during a Redis outage into the shared queue."""
+        if not self._user or self._r is None:
+            return
+        moved = [(anon, cid, e) for anon, q in self._local.items() for cid, e in q.items()]
+        pipe  = self._r.pipeline(transaction=False)
+        for anon, cid, e in moved:
+            pipe.zadd(self._Z_QUEUE[anon], {str(cid): e.since})
+            if e.due != float("inf"):
+                pipe.zadd(self._Z_DUE, {str(cid): e.due})
+            pipe.hset(self._H_OWNER, str(cid), f"{e.uid}:{e.gid}")
+            pipe.hset(self._H_USER, str(e.uid), str(cid))
+            pipe.hincrby(self._H_GUILD[anon], str(e.gid), 1)
+        await pipe.execute()
+        for anon, cid, e in moved:
+            self._local[anon].remove(cid)
+            self._user.pop(e.uid, None)
+
+
+matchmaker = Matchmaker()
@@ -0,0 +1,190 @@
+# ──────────────────────────────────────────────
+# utils/metrics.py
+# ──────────────────────────────────────────────
+"""
+In‑process metrics with a Prometheus text endpoint.
+
+Counters and histograms are plain Python objects updated on the hot path.
+Histograms keep cumulative buckets for Prometheus plus a small ring of
+recent samples so /stats can show p50/p99 without a metrics server.
+Gauges are read from callbacks at scrape time.
+
+Set METRICS_PORT to serve GET /metrics (bound to METRICS_HOST, default
+127.0.0.1); leave it unset to keep the endpoint off.
+"""
+from __future__ import annotations
+import os
+import time
+import bisect
+import logging
+import contextlib
+from collections import deque
+from typing import Awaitable, Callable, Dict, Iterator, Optional
+
+from aiohttp import web
+
+_LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10, 30)
+
+
+def _labels(label: Optional[str], value: Optional[str]) -> str:
+    return f'{{{label}="{value}"}}' if label else ""
+
+
+class Counter:
+    def __init__(self, name: str, help: str, label: Optional[str] = None):
+        self.name, self.help, self.label = name, help, label
+        self.values: Dict[Optional[str], float] = {}
+
+    def inc(self, value: Optional[str] = None, by: float = 1):
+        self.values[value] = self.values.get(value, 0) + by
+
+    def total(self) -> float:
+        return sum(self.values.values())
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} counter"
+        for value, n in self.values.items():
+            yield f"{self.name}_total{_labels(self.label, value)} {n}"
+
+
+class Gauge:
+    def __init__(self, name: str, help: str, read: Callable[[], Awaitable[float]]):
+        self.name, self.help, self.read = name, help, read
+
+    async def render(self) -> list[str]:
+        try:
+            value = await self.read()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} gauge", f"{self.name} {value}"]
+
+
+class _Series:
+    def __init__(self, buckets: tuple[float, ...], keep: int):
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum    = 0.0
+        self.recent: deque[float] = deque(maxlen=keep)
+
+
+class Histogram:
+    def __init__(self, name: str, help: str, label: Optional[str] = None,
+                 buckets: tuple[float, ...] = _LATENCY_BUCKETS, keep: int = 2048):
+        self.name, self.help, self.label = name, help, label
+        self.buckets = buckets
+        self.keep    = keep
+        self.series: Dict[Optional[str], _Series] = {}
+
+    def observe(self, seconds: float, value: Optional[str] = None):
+        s = self.series.get(value)
+        if s is None:
+            s = self.series[value] = _Series(self.buckets, self.keep)
+        s.counts[bisect.bisect_left(self.buckets, seconds)] += 1
+        s.sum += seconds
+        s.recent.append(seconds)
+
+    @contextlib.contextmanager
+    def time(self, value: Optional[str] = None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, value)
+
+    def quantile(self, q: float, value: Optional[str] = None) -> Optional[float]:
+        """q‑quantile over the most recent `keep` samples, None if empty."""
+        s = self.series.get(value)
+        if not s or not s.recent:
+            return None
+        ordered = sorted(s.recent)
+        return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+    def render(self) -> Iterator[str]:
+        yield f"# HELP {self.name} {self.help}"
+        yield f"# TYPE {self.name} histogram"
+        for value, s in self.series.items():
+            base = f'{self.label}="{value}",' if self.label else ""
+            running = 0
+            for bound, n in zip(self.buckets + (float("inf"),), s.counts):
+                running += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                yield f'{self.name}_bucket{{{base}le="{le}"}} {running}'
+            yield f"{self.name}_sum{_labels(self.label, value)} {s.sum}"
+            yield f"{self.name}_count{_labels(self.label, value)} {running}"
+
+
+# ───────── the bot's metrics ─────────
+RELAY_STAGE   = Histogram("userphone_relay_stage_seconds",
+                          "Time spent in each stage of Relay.on_message", label="stage")
+QUEUE_WAIT    = Histogram("userphone_queue_wait_seconds",
+                          "Time a caller waited in the queue before being paired",
+                          buckets=(1, 5, 15, 30, 60, 120, 300, 600, 1800, 3600))
+REDIS_TRIPS   = Counter("userphone_redis_round_trips", "Commands or pipelines sent to Redis")
+RATE_LIMITED  = Counter("userphone_discord_429", "429 responses seen from Discord", label="route")
+CALL_REQUESTS = Counter("userphone_call_requests", "/call and /anoncall attempts that reached the matchmaker")
+MATCHES       = Counter("userphone_matches", "Callers paired by the matchmaker")
+FILTERED      = Counter("userphone_filtered", "Relayed messages that hit the content filter", label="action")
+OUTBOX        = Counter("userphone_outbox", "Relay outbox: posts, messages delivered / merged / failed, "
+                        "submits that waited for room", label="event")
+OUTBOX_WAIT   = Histogram("userphone_outbox_wait_seconds",
+                          "Time a relayed message waited in the outbox for its post")
+
+_gauges: list[Gauge] = []
+
+
+def gauge(name: str, help: str, read: Callable[[], Awaitable[float]]):
+    _gauges.append(Gauge(name, help, read))
+
+
+async def render() -> str:
+    lines: list[str] = []
+    for metric in (RELAY_STAGE, QUEUE_WAIT, REDIS_TRIPS, RATE_LIMITED, CALL_REQUESTS, MATCHES, FILTERED,
+                   OUTBOX, OUTBOX_WAIT):
+        lines.extend(metric.render())
+    for g in _gauges:
+        lines.extend(await g.render())
+    return "\n".join(lines) + "\n"
+
+
+# ───────── discord.py 429 logging → counter ─────────
+class _RateLimitLog(logging.Handler):
+    def emit(self, record: logging.LogRecord):
+        if "rate limited" in record.getMessage():
+            RATE_LIMITED.inc("webhook" if record.name.startswith("discord.webhook") else "http")
+
+
+def watch_rate_limits():
+    """discord.py retries 429s internally and only logs them; count those log lines."""
+    for name in ("discord.http", "discord.webhook.async_"):
+        logger = logging.getLogger(name)
+        logger.addHandler(_RateLimitLog(logging.WARNING))
+        if logger.getEffectiveLevel() > logging.WARNING:
+            logger.setLevel(logging.WARNING)
+
+
+# ───────── HTTP endpoint ─────────
+_runner: web.AppRunner | None = None
+
+
+async def start_server():
+    global _runner
+    port = os.getenv("METRICS_PORT")
+    if not port or _runner is not None:
+        return
+
+    async def handle(_: web.Request) -> web.Response:
+        return web.Response(text=await render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    _runner = web.AppRunner(app, access_log=None)
+    await _runner.setup()
+    await web.TCPSite(_runner, os.getenv("METRICS_HOST", "127.0.0.1"), int(port)).start()
+    print(f"📈 Metrics on :{port}/metrics")
+
+
+async def stop_server():
+    global _runner
+    if _runner is not None:
+        await _runner.cleanup()
+        _runner = None
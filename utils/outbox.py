@@ -0,0 +1,192 @@
+# ──────────────────────────────────────────────
+# utils/outbox.py
+# ──────────────────────────────────────────────
+"""
+Per‑destination send queue for relayed messages.
+
+Each destination channel gets one lane with a single worker, so messages
+leave in the order they arrived. The worker paces itself against the
+webhook bucket (BURST posts per WINDOW seconds); whatever waiting is left
+– discord.py holds a post back when the rate‑limit headers say the bucket
+is empty, and retries 429s itself – happens in the worker, not in the
+listener that relayed the message.
+When the lane falls behind, consecutive text‑only messages from the same
+alias are merged into one post; every message in it gets the post back
+with its own place in it, so edits and deletes of one part can rebuild
+the post from the others. Submitters wait once a lane holds MAX_PENDING
+messages (backpressure).
+"""
+from __future__ import annotations
+import time
+import asyncio
+from collections import deque
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable, Dict, NamedTuple
+
+import discord
+
+from .metrics import OUTBOX, OUTBOX_WAIT
+
+SendFn = Callable[[str, list, str, str, discord.TextChannel], Awaitable[discord.Message]]
+
+
+class Posted(NamedTuple):
+    message: discord.Message
+    part:    int                # this message's place in the post
+    parts:   tuple[str, ...]    # content of every message merged into the post
+
+
+@dataclass
+class _Outgoing:
+    content: str
+    files:   list
+    alias:   str
+    avatar:  str
+    future:  asyncio.Future
+    queued_at: float = field(default_factory=time.monotonic)
+
+
+class _Lane:
+    def __init__(self, dest: discord.TextChannel, burst: int):
+        self.dest  = dest
+        self.items: deque[_Outgoing] = deque()
+        self.wake  = asyncio.Event()
+        self.room  = asyncio.Event()
+        self.room.set()
+        self.tokens  = float(burst)
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+        self.task: asyncio.Task | None = None
+
+
+class Outbox:
+    BURST          = 5        # webhook posts …
+    WINDOW         = 2.0      # … per this many seconds
+    MAX_PENDING    = 100      # per destination before submitters wait
+    MAX_CONTENT    = 2000     # Discord message length limit
+    IDLE_TIMEOUT   = 60       # s before an empty lane's worker exits
+
+    def __init__(self, send: SendFn):
+        self._send  = send
+        self._lanes: Dict[int, _Lane] = {}
+        self.sent            = 0      # posts made
+        self.delivered       = 0      # relayed messages carried by those posts
+        self.coalesced       = 0      # messages merged into an earlier post
+        self.backpressured   = 0      # submits that had to wait for room
+        self.max_depth       = 0
+        self.total_wait      = 0.0    # s between submit and send, summed over delivered
+        self.max_wait        = 0.0
+
+    # ───────── public API ─────────
+    async def submit(self, dest: discord.TextChannel, content: str, files: list,
+                     alias: str, avatar: str) -> Posted:
+        """Queue a relayed message and wait for the post that carries it."""
+        lane = self._lanes.get(dest.id)
+        if lane is None:
+            lane = self._lanes[dest.id] = _Lane(dest, self.BURST)
+        if lane.task is None or lane.task.done():
+            lane.task = asyncio.create_task(self._run(lane))
+
+        while len(lane.items) >= self.MAX_PENDING:
+            self.backpressured += 1
+            OUTBOX.inc("backpressured")
+            lane.room.clear()
+            await lane.room.wait()
+
+        item = _Outgoing(content, files or [], alias, avatar,
+                         asyncio.get_running_loop().create_future())
+        lane.items.append(item)
+        self.max_depth = max(self.max_depth, len(lane.items))
+        lane.wake.set()
+        return await item.future
+
+    def depth(self) -> int:
+        return sum(len(l.items) for l in self._lanes.values())
+
+    def stats(self) -> dict:
+        """This outbox's counters (the process‑wide ones are in utils.metrics)."""
+        return {
+            "lanes":         len(self._lanes),
+            "depth":         self.depth(),
+            "max_depth":     self.max_depth,
+            "sent":          self.sent,
+            "delivered":     self.delivered,
+            "coalesced":     self.coalesced,
+            "backpressured": self.backpressured,
+            "avg_wait":      self.total_wait / self.delivered if self.delivered else 0.0,
+            "max_wait":      self.max_wait,
+        }
+
+    # ───────── worker ─────────
+    async def _take_token(self, lane: _Lane):
+        while True:
+            now = time.monotonic()
+            if now < lane.blocked_until:
+                await asyncio.sleep(lane.blocked_until - now)
+                continue
+            lane.tokens = min(self.BURST, lane.tokens + (now - lane.updated) * self.BURST / self.WINDOW)
+            lane.updated = now
+            if lane.tokens >= 1:
+                lane.tokens -= 1
+                return
+            await asyncio.sleep((1 - lane.tokens) * self.WINDOW / self.BURST)
+
+    def _batch(self, lane: _Lane) -> list[_Outgoing]:
+        """Pop the next item plus any queued text‑only followers from the same alias."""
+        batch = [lane.items.popleft()]
+        head  = batch[0]
+        size  = len(head.content)
+        while (not head.files and lane.items
+               and not lane.items[0].files
+               and (lane.items[0].alias, lane.items[0].avatar) == (head.alias, head.avatar)
+               and size + 1 + len(lane.items[0].content) <= self.MAX_CONTENT):
+            size += 1 + len(lane.items[0].content)
+            batch.append(lane.items.popleft())
+        if len(lane.items) < self.MAX_PENDING:
+            lane.room.set()
+        return batch
+
+    async def _run(self, lane: _Lane):
+        while True:
+            if not lane.items:
+                lane.wake.clear()
+                try:
+                    await asyncio.wait_for(lane.wake.wait(), self.IDLE_TIMEOUT)
+                except asyncio.TimeoutError:
+                    if not lane.items:
+                        self._lanes.pop(lane.dest.id, None)
+                        return
+                continue
+
+            await self._take_token(lane)
+            batch = self._batch(lane)
+            head  = batch[0]
+            content = "\n".join(i.content for i in batch)
+            try:
+                msg = await self._send(content, head.files, head.alias, head.avatar, lane.dest)
+            except Exception as exc:
+                OUTBOX.inc("failed", by=len(batch))
+                self._fail(batch, exc)
+                continue
+
+            now = time.monotonic()
+            self.sent      += 1
+            self.delivered += len(batch)
+            self.coalesced += len(batch) - 1
+            OUTBOX.inc("posts")
+            OUTBOX.inc("delivered", by=len(batch))
+            OUTBOX.inc("coalesced", by=len(batch) - 1)
+            parts = tuple(i.content for i in batch)
+            for n, item in enumerate(batch):
+                wait = now - item.queued_at
+                self.total_wait += wait
+                self.max_wait    = max(self.max_wait, wait)
+                OUTBOX_WAIT.observe(wait)
+                if not item.future.done():
+                    item.future.set_result(Posted(msg, n, parts))
+
+    @staticmethod
+    def _fail(batch: list[_Outgoing], exc: BaseException):
+        for item in batch:
+            if not item.future.done():
+                item.future.set_exception(exc)
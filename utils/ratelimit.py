@@ -0,0 +1,111 @@
+# ──────────────────────────────────────────────
+# utils/ratelimit.py
+# ──────────────────────────────────────────────
+"""
+Token‑bucket rate limits shared by every bot process.
+
+With Redis each bucket is a small hash updated by one Lua script (so the
+check and the spend are atomic across processes) and expires once it
+would have refilled anyway. Without Redis (or when a Redis call fails)
+the same arithmetic runs on a dict that drops full buckets as it goes.
+A take can also ride on a caller's own pipeline (`queue()` + `verdict()`),
+so a check on the hot path costs no round trip of its own.
+"""
+from __future__ import annotations
+import math
+import time
+from typing import Dict, NamedTuple
+
+from .redis_pool import UNAVAILABLE
+from .state      import state
+
+
+class Verdict(NamedTuple):
+    allowed:     bool
+    retry_after: float      # s until a token is available (0 when allowed)
+
+
+_TAKE_LUA = """
+local capacity, rate, now = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local b = redis.call('HMGET', KEYS[1], 'tokens', 'ts')
+local tokens = tonumber(b[1]) or capacity
+local ts     = tonumber(b[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+local allowed, retry = 0, (1 - tokens) / rate
+if tokens >= 1 then
+  tokens, allowed, retry = tokens - 1, 1, 0
+end
+redis.call('HSET', KEYS[1], 'tokens', tokens, 'ts', now)
+redis.call('PEXPIRE', KEYS[1], math.ceil((capacity - tokens) / rate * 1000) + 1000)
+return {allowed, tostring(retry)}
+"""
+
+
+class TokenBucket:
+    """`capacity` tokens, refilled continuously at `capacity / period` per second."""
+
+    _P_BUCKET = "up:rl:"
+    _script   = None
+
+    def __init__(self, name: str, capacity: int, period: float):
+        self.name     = name
+        self.capacity = capacity
+        self.rate     = capacity / period
+        self._local: Dict[int | str, tuple[float, float]] = {}   # key -> (tokens, ts)
+        self._sweep_at = 0.0
+
+    @staticmethod
+    def _take_script():
+        if TokenBucket._script is None:
+            TokenBucket._script = state._r.register_script(_TAKE_LUA)
+        return TokenBucket._script
+
+    async def take(self, key: int | str) -> Verdict:
+        """Spend one token from `key`'s bucket if there is one."""
+        if state._r:
+            try:
+                return self.verdict(await self._take_script()(
+                    keys=[f"{self._P_BUCKET}{self.name}:{key}"],
+                    args=[self.capacity, self.rate, time.time()],
+                ))
+            except UNAVAILABLE:
+                pass
+        return self.take_local(key)
+
+    async def queue(self, pipe, key: int | str):
+        """Add a take from `key`'s bucket to a Redis pipeline; read its reply with `verdict()`."""
+        await self._take_script()(
+            keys=[f"{self._P_BUCKET}{self.name}:{key}"],
+            args=[self.capacity, self.rate, time.time()], client=pipe,
+        )
+
+    @staticmethod
+    def verdict(reply) -> Verdict:
+        allowed, retry = reply
+        return Verdict(bool(allowed), float(retry))
+
+    def take_local(self, key: int | str) -> Verdict:
+        """`take()` on this process's buckets only (no Redis, or it just failed)."""
+        now = time.time()
+        self._sweep(now)
+        tokens, ts = self._local.get(key, (self.capacity, now))
+        tokens = min(self.capacity, tokens + (now - ts) * self.rate)
+        if tokens < 1:
+            self._local[key] = (tokens, now)
+            return Verdict(False, (1 - tokens) / self.rate)
+        self._local[key] = (tokens - 1, now)
+        return Verdict(True, 0.0)
+
+    def _sweep(self, now: float):
+        """Drop buckets that have refilled completely – they're the default."""
+        if now < self._sweep_at:
+            return
+        full = (self.capacity + 1) / self.rate
+        self._local = {k: v for k, v in self._local.items() if now - v[1] < full}
+        self._sweep_at = now + min(full, 60)
+
+    @staticmethod
+    def describe(seconds: float) -> str:
+        mins = math.ceil(seconds / 60)
+        return f"{mins} min" if seconds >= 60 else f"{math.ceil(seconds)} s"
@@ -1,31 +1,138 @@
 # utils/redis_pool.py
 
 """
-Async‑friendly Redis client factory with DNS‑check and graceful fallback.
+Managed async Redis client with a circuit breaker.
 
 * Prefers REDIS_URL   (internal TLS URL on Railway)
 * Falls back to REDIS_PUBLIC_URL for local testing
-* Disables Redis if the host is unresolvable or the connection setup fails
-* Returns None if Redis is disabled
+* One bounded pool, short socket timeouts and a single immediate retry,
+  so a call against a sick server fails within ~2 × REDIS_TIMEOUT instead
+  of hanging in redis‑py's default backoff
+* Connection errors and timeouts are counted by `breaker`; after
+  BREAKER_FAILURES in a row it opens, `state._r` reads as None and every
+  caller takes its in‑memory path. `probe()` (run periodically by State)
+  closes it again once Redis answers.
+* Pub/sub listeners read through `listen()`, which waits LISTEN_POLL s per
+  read: a blocking listen() falls back to the short socket timeout on
+  redis‑py < 8.1, so an idle subscriber would count as a failing server
+* Nothing touches the network at import time – an unresolvable host just
+  opens the breaker on first use
+* Returns None if Redis is not configured
 """
 from __future__ import annotations
 import os
-import ssl
-import socket
-import urllib.parse
+import asyncio
+from typing import AsyncIterator, Callable
 
 import redis.asyncio as aioredis
+from redis.asyncio.connection import BlockingConnectionPool, Connection, SSLConnection
+from redis.asyncio.retry import Retry
+from redis.backoff import NoBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError, TimeoutError as RedisTimeoutError
+
+from .metrics import REDIS_TRIPS
 
 _RAW_URL: str | None = os.getenv("REDIS_URL") or os.getenv("REDIS_PUBLIC_URL")
 _client: aioredis.Redis | None = None
 
+TIMEOUT         = float(os.getenv("REDIS_TIMEOUT", "1.0"))         # s per connect / command
+MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", "64"))
+HEALTH_CHECK    = 15            # s idle before a pooled connection is PINGed on checkout
+LISTEN_POLL     = HEALTH_CHECK  # s per pub/sub read; an idle subscription is PINGed in between
+
+UNAVAILABLE = (RedisConnectionError, RedisTimeoutError, OSError, asyncio.TimeoutError)
+
+
+class CircuitBreaker:
+    """Open after FAILURES consecutive connection failures; closed again by a probe."""
+
+    FAILURES = int(os.getenv("BREAKER_FAILURES", "3"))
+
+    def __init__(self):
+        self.open  = False
+        self.trips = 0                  # times opened since start‑up
+        self._failures = 0
+        self._listeners: list[Callable[[bool], None]] = []
+
+    def on_change(self, fn: Callable[[bool], None]):
+        """`fn(open)` runs whenever the breaker opens or closes."""
+        self._listeners.append(fn)
+
+    def failure(self):
+        self._failures += 1
+        if not self.open and self._failures >= self.FAILURES:
+            self.trips += 1
+            self._set(True)
+
+    def success(self):
+        self._failures = 0
+
+    def reset(self):
+        self._failures = 0
+        if self.open:
+            self._set(False)
+
+    def _set(self, open_: bool):
+        self.open = open_
+        for fn in self._listeners:
+            fn(open_)
+
+
+breaker = CircuitBreaker()
+
+
+class _ManagedConnection(Connection):
+    async def connect(self):
+        try:
+            await super().connect()
+        except UNAVAILABLE:
+            breaker.failure()
+            raise
+
+    async def send_packed_command(self, command, check_health=True):
+        REDIS_TRIPS.inc()       # a pipeline is sent as one packed command
+        try:
+            await super().send_packed_command(command, check_health)
+        except UNAVAILABLE:
+            breaker.failure()
+            raise
+
+    async def read_response(self, *args, **kwargs):
+        try:
+            response = await super().read_response(*args, **kwargs)
+        except UNAVAILABLE:
+            breaker.failure()
+            raise
+        breaker.success()
+        return response
+
+
+class _ManagedSSLConnection(_ManagedConnection, SSLConnection):
+    pass
+
+
+async def probe(client: aioredis.Redis) -> bool:
+    """PING with a hard deadline; closes the breaker when Redis answers."""
+    try:
+        await asyncio.wait_for(client.ping(), TIMEOUT)
+    except Exception:
+        return False
+    breaker.reset()
+    return True
+
+
+async def listen(pubsub: aioredis.client.PubSub) -> AsyncIterator[dict]:
+    """Messages from a subscribed `pubsub`; a quiet channel is not a timeout."""
+    while True:
+        m = await pubsub.get_message(ignore_subscribe_messages=True, timeout=LISTEN_POLL)
+        if m is not None:
+            yield m
+
 
 def get_redis() -> aioredis.Redis | None:
     """
-    Return a singleton async Redis client, or None when:
-      • no valid REDIS_URL is set
-      • the hostname cannot be resolved
-      • the connection setup fails
+    Return a singleton async Redis client, or None when no valid
+    REDIS_URL is set. Never blocks: connections are made on first use.
     """
     global _client
 
@@ -37,33 +144,25 @@ def get_redis() -> aioredis.Redis | None:
     if _client is not None:
         return _client
 
-    # 3️⃣ Parse URL and verify DNS
-    parsed = urllib.parse.urlparse(_RAW_URL)
-    host = parsed.hostname or ""
-    port = parsed.port or (6380 if parsed.scheme == "rediss" else 6379)
+    # 3️⃣ Build the pool (TLS verification is on by default for rediss://)
     try:
-        socket.getaddrinfo(host, port)
-    except socket.gaierror as e:
-        print(f"[Redis disabled] DNS lookup failed for {host}:{port} → {e}")
-        return None
-
-    # 4️⃣ Attempt to create the Redis client
-    try:
-        if parsed.scheme == "rediss":
-            ssl_ctx = ssl.create_default_context()
-            _client = aioredis.from_url(
-                _RAW_URL,
-                decode_responses=True,
-                ssl=ssl_ctx,           # pass an SSLContext (compatible with all redis‑py versions)
-            )
-        else:
-            _client = aioredis.from_url(
-                _RAW_URL,
-                decode_responses=True,
-            )
-        return _client
-
+        pool = BlockingConnectionPool.from_url(
+            _RAW_URL,
+            decode_responses=True,
+            max_connections=MAX_CONNECTIONS,
+            timeout=TIMEOUT,                    # wait for a free connection
+            socket_timeout=TIMEOUT,
+            socket_connect_timeout=TIMEOUT,
+            socket_keepalive=True,
+            health_check_interval=HEALTH_CHECK,
+            retry=Retry(NoBackoff(), 1),
+        )
     except Exception as exc:
         print(f"[Redis disabled] Failed to initialize client → {exc}")
-        _client = None
         return None
+    if pool.connection_class is SSLConnection:
+        pool.connection_class = _ManagedSSLConnection
+    elif pool.connection_class is Connection:
+        pool.connection_class = _ManagedConnection
+    _client = aioredis.Redis(connection_pool=pool)
+    return _client
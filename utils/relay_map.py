@@ -0,0 +1,120 @@
+# ──────────────────────────────────────────────
+# utils/relay_map.py
+# ──────────────────────────────────────────────
+"""
+Original message ↔ relayed copy mapping, per call.
+
+Redis layout (both hashes expire TTL seconds after the last write and are
+dropped when the call ends):
+  up:rmap:<ch>   hash  original msg id in <ch> -> copy id in the partner channel
+  up:rrev:<ch>   hash  copy msg id in <ch>     -> original id in the partner channel
+
+Without Redis each channel gets a capped LRU, removed on hangup. The same
+LRUs take over for any call whose Redis round trip fails.
+"""
+from __future__ import annotations
+from typing import Dict, Iterable, Optional
+
+from .cache      import TTLCache
+from .redis_pool import UNAVAILABLE
+from .state      import state
+
+
+class RelayMap:
+    TTL       = 24 * 60 * 60       # s
+    LOCAL_CAP = 5_000              # remembered messages per channel, no‑Redis mode
+
+    _P_FWD = "up:rmap:"
+    _P_REV = "up:rrev:"
+
+    def __init__(self):
+        self._fwd: Dict[int, TTLCache[int]] = {}
+        self._rev: Dict[int, TTLCache[int]] = {}
+
+    @property
+    def _r(self):
+        return state._r
+
+    def _local(self, table: Dict[int, TTLCache[int]], ch: int) -> TTLCache[int]:
+        if ch not in table:
+            table[ch] = TTLCache(self.LOCAL_CAP, self.TTL)
+        return table[ch]
+
+    async def add(self, src_ch: int, src_mid: int, dst_ch: int, dst_mid: int):
+        if self._r:
+            fwd, rev = f"{self._P_FWD}{src_ch}", f"{self._P_REV}{dst_ch}"
+            pipe = self._r.pipeline(transaction=False)
+            pipe.hset(fwd, str(src_mid), str(dst_mid))
+            pipe.hset(rev, str(dst_mid), str(src_mid))
+            pipe.expire(fwd, self.TTL)
+            pipe.expire(rev, self.TTL)
+            try:
+                await pipe.execute()
+                return
+            except UNAVAILABLE:
+                pass
+        self._local(self._fwd, src_ch).put(src_mid, dst_mid)
+        self._local(self._rev, dst_ch).put(dst_mid, src_mid)
+
+    async def copy_of(self, src_ch: int, src_mid: int) -> Optional[int]:
+        """Id of the relayed copy of `src_mid` in the partner channel."""
+        if self._r:
+            try:
+                mid = await self._r.hget(f"{self._P_FWD}{src_ch}", str(src_mid))
+                return int(mid) if mid else None
+            except UNAVAILABLE:
+                pass
+        table = self._fwd.get(src_ch)
+        return table.get(src_mid) if table else None
+
+    async def pop(self, ch: int, partner: int, mids: Iterable[int]) -> list[tuple[int, int]]:
+        """
+        Forget deleted messages in `ch` and return (original, copy) for any
+        originals among them, so the caller can delete the copies in `partner`
+        as well (several originals share a copy when they were merged into one post).
+        """
+        mids = [int(m) for m in mids]
+        if self._r:
+            fwd, rev = f"{self._P_FWD}{ch}", f"{self._P_REV}{ch}"
+            try:
+                pairs, origs = await self._read_both(fwd, rev, mids)
+                pipe = self._r.pipeline(transaction=False)
+                pipe.hdel(fwd, *mids)
+                pipe.hdel(rev, *mids)
+                if pairs:
+                    pipe.hdel(f"{self._P_REV}{partner}", *{c for _, c in pairs})
+                if origs:
+                    pipe.hdel(f"{self._P_FWD}{partner}", *origs)
+                await pipe.execute()
+                return pairs
+            except UNAVAILABLE:
+                pass
+
+        pairs = [(m, c) for m in mids if (c := self._local(self._fwd, ch).pop(m)) is not None]
+        origs = [o for m in mids if (o := self._local(self._rev, ch).pop(m)) is not None]
+        for _, c in pairs:
+            self._local(self._rev, partner).pop(c)
+        for o in origs:
+            self._local(self._fwd, partner).pop(o)
+        return pairs
+
+    async def _read_both(self, fwd: str, rev: str,
+                         mids: list[int]) -> tuple[list[tuple[int, int]], list[int]]:
+        pipe = self._r.pipeline(transaction=False)
+        pipe.hmget(fwd, *mids)
+        pipe.hmget(rev, *mids)
+        copies, origs = await pipe.execute()
+        return [(m, int(c)) for m, c in zip(mids, copies) if c], [int(o) for o in origs if o]
+
+    async def forget_call(self, *channels: int):
+        if self._r:
+            try:
+                await self._r.delete(*(f"{p}{ch}" for ch in channels for p in (self._P_FWD, self._P_REV)))
+            except UNAVAILABLE:
+                pass            # the hashes expire after TTL anyway
+        for ch in channels:
+            self._fwd.pop(ch, None)
+            self._rev.pop(ch, None)
+
+
+relay_map = RelayMap()
@@ -2,81 +2,413 @@
 # utils/state.py
 # ──────────────────────────────────────────────
 from __future__ import annotations
-import time, json, pathlib
-from collections import deque
-from typing import Dict, Optional
+import time, pathlib, asyncio, traceback
+from itertools import islice
+from typing import TYPE_CHECKING, Awaitable, Callable, Dict, NamedTuple, Optional
 import discord
 
-from .redis_pool import get_redis
+from .redis_pool import get_redis, breaker, probe, listen, UNAVAILABLE
+from .cache      import TTLCache
+from .jsonstore  import JsonStore
 
-waiting_queue: deque[int] = deque()
-anon_queue:    deque[int] = deque()
+if TYPE_CHECKING:
+    from .ratelimit import TokenBucket
+
+class CallContext(NamedTuple):
+    partner: int
+    anon:    bool
+    alias:   Optional[str]     # None when no user was given
+    avatar:  Optional[str]
+    allowed: bool = True       # a token was left in the `cooldown` bucket, if one was given
+
+# hangup is read‑then‑delete; as a script both sides can hang up at once
+# and exactly one of them sees the partner (and records the "end" event)
+_END_CALL_LUA = """
+local partner = redis.call('HGET', KEYS[1], ARGV[1])
+if not partner then
+  -- not in a call: just sweep any half‑written leftovers for this channel
+  redis.call('HDEL', KEYS[2], ARGV[1])
+  redis.call('ZREM', KEYS[4], ARGV[1])
+  redis.call('HDEL', KEYS[5], ARGV[1])
+  return false
+end
+if tonumber(ARGV[4]) > 0 then
+  local started = tonumber(redis.call('HGET', KEYS[2], ARGV[1]) or ARGV[3])
+  redis.call('XADD', KEYS[6], 'MAXLEN', '~', ARGV[4], '*', 'kind', 'end', 'ts', ARGV[3],
+             'a', ARGV[1], 'b', partner, 'secs', math.max(0, tonumber(ARGV[3]) - started))
+end
+redis.call('HDEL', KEYS[1], ARGV[1], partner)
+redis.call('HDEL', KEYS[2], ARGV[1], partner)
+redis.call('SREM', KEYS[3], ARGV[1], partner)
+redis.call('ZREM', KEYS[4], ARGV[1], partner)
+redis.call('HDEL', KEYS[5], ARGV[1], partner)
+redis.call('PUBLISH', ARGV[2], 'c:' .. ARGV[1])
+redis.call('PUBLISH', ARGV[2], 'c:' .. partner)
+return partner
+"""
 
 class State:
     COOLDOWN     = 1
     DEFAULT_AV   = "https://i.imgur.com/0h6wYht.png"
 
-    waiting_queue = waiting_queue
-    anon_queue    = anon_queue
-
     _H_ACTIVE  = "up:active"      # ch_id -> partner_id
     _H_STARTED = "up:started"     # ch_id -> unix ts
     _S_ANON    = "up:anon"        # set of channel_ids
     _P_PROFILE = "up:profile:"    # prefix for user hash
+    _C_INVAL   = "up:invalidate"  # pub/sub: "c:<ch_id>" | "p:<user_id>" | on_invalidate kinds
+    _Z_CALLS   = "up:calls"       # zset ch_id -> start ts (both sides), oldest first
+    _H_SEEN    = "up:activity"    # ch_id -> unix ts of last relayed message
+    _K_LOCK    = "up:lock:"       # prefix for cluster‑wide job locks
+    _X_EVENTS  = "up:events"      # stream of match / start / end events (see utils.history)
+
+    EVENTS_KEPT = 100_000         # approximate stream length cap
+
+    TOUCH_EVERY = 60              # s between activity writes per channel
+
+    # health probe / degraded mode (see redis_pool.breaker)
+    HEALTH_EVERY = 5              # s between PINGs
+    MIRROR_EVERY = 60             # s between full refreshes of the in‑memory call map
+    MIRROR_BATCH = 500            # fields per HSCAN / SSCAN step of a refresh
+
+    # local read‑through cache (Redis mode only)
+    CACHE_SIZE = 10_000
+    CACHE_TTL  = 30               # s; upper bound on staleness if an invalidation is missed
 
     def __init__(self):
-        self._r = get_redis()
+        self._redis = get_redis()
+
+        # ch_id -> (partner_id or 0, anon);  user_id -> (alias, avatar_url)
+        self._calls:    TTLCache[tuple[int, bool]]                 = TTLCache(self.CACHE_SIZE, self.CACHE_TTL)
+        self._profiles: TTLCache[tuple[str | None, str | None]] = TTLCache(self.CACHE_SIZE, self.CACHE_TTL)
+        self._listener: asyncio.Task | None = None
+        self._watcher:  asyncio.Task | None = None
+        self._end_call = self._redis.register_script(_END_CALL_LUA) if self._redis else None
+        self._healthy: list[Callable[[], Awaitable[None]]] = []
+        self._recorders: list[Callable[[dict], None]] = []
+        self._evictors:  Dict[str, Callable[[str | None], None]] = {}
+        # written locally while the breaker was open, pushed back on recovery
+        self._outage_calls:    set[int] = set()
+        self._outage_profiles: set[str] = set()
 
-        # JSON‑fallback stores
+        # JSON‑fallback stores; with Redis, a mirror that serves reads during an outage
+        self.user_settings: Dict[str, dict] = {}
         self.active_calls: Dict[int, int]   = {}
         self.call_started: Dict[int, float] = {}
         self.anon_channels: set[int]        = set()
-        self.webhooks: Dict[int, discord.Webhook] = {}
+        self.last_activity: Dict[int, float] = {}
+        self._touched: TTLCache[bool] = TTLCache(self.CACHE_SIZE, self.TOUCH_EVERY)
+        self.webhooks: TTLCache[discord.Webhook] = TTLCache(self.CACHE_SIZE)
+
+        here = pathlib.Path(__file__)
+        self._settings_store = JsonStore(here.with_name("user_settings.json"), self._settings_snapshot)
+        self._calls_store    = JsonStore(here.with_name("call_state.json"),    self._calls_snapshot)
+        if self._redis is None:
+            self.user_settings = self._settings_store.load({})
+            calls = self._calls_store.load({})
+            self.active_calls  = {int(k): int(v)   for k, v in calls.get("active",  {}).items()}
+            self.call_started  = {int(k): float(v) for k, v in calls.get("started", {}).items()}
+            self.anon_channels = {int(c) for c in calls.get("anon", [])}
+
+    # ───────── JSON fallback persistence ─────────
+    def _settings_snapshot(self) -> dict:
+        return {uid: dict(p) for uid, p in self.user_settings.items()}
+
+    def _calls_snapshot(self) -> dict:
+        return {"active":  dict(self.active_calls),
+                "started": dict(self.call_started),
+                "anon":    list(self.anon_channels)}
+
+    async def close(self):
+        """Flush pending JSON writes (no‑Redis mode) before shutdown."""
+        await self._settings_store.flush()
+        await self._calls_store.flush()
+
+    def _calls_changed(self, *cids: int):
+        if self._redis is None:
+            self._calls_store.mark_dirty()
+        else:
+            self._outage_calls.update(cids)
+
+    def _profile_changed(self, uid: int | str):
+        if self._redis is None:
+            self._settings_store.mark_dirty()
+        else:
+            self._outage_profiles.add(str(uid))
+
+    # ───────── Redis health ─────────
+    @property
+    def _r(self):
+        """The Redis client, or None without Redis *or* while the breaker is open."""
+        return None if breaker.open else self._redis
+
+    @property
+    def degraded(self) -> bool:
+        return self._redis is not None and breaker.open
+
+    def on_healthy(self, fn: Callable[[], Awaitable[None]]):
+        """
+        Run `fn()` after every successful health probe, once State has pushed
+        its own outage writes – the place to flush other local fallbacks.
+        Should return at once when there is nothing to do.
+        """
+        self._healthy.append(fn)
+
+    def on_invalidate(self, kind: str, evict: Callable[[str | None], None]):
+        """
+        Route "<kind>:<key>" invalidations to `evict(key)`, for caches kept
+        outside State; `evict(None)` drops everything (invalidations were lost).
+        """
+        self._evictors[kind] = evict
+
+    def _clear_caches(self):
+        self._calls.clear()
+        self._profiles.clear()
+        for evict in self._evictors.values():
+            evict(None)
 
-        self._json_path = pathlib.Path(__file__).with_name("user_settings.json")
-        if self._r is None:
+    # ───────── call events ─────────
+    def on_record(self, fn: Callable[[dict], None]):
+        """
+        `fn(event)` receives every call event that could not go straight
+        into the Redis stream (no Redis, or the write failed).
+        """
+        self._recorders.append(fn)
+
+    def record(self, kind: str, **fields):
+        event = {"kind": kind, "ts": time.time(), **fields}
+        for fn in self._recorders:
+            fn(event)
+
+    def _breaker_changed(self, open_: bool):
+        if open_:
+            print("[Redis] unreachable → serving from memory")
+        else:
+            print("[Redis] reachable again → reconciling")
+
+    async def _watch(self):
+        """PING every HEALTH_EVERY s; refresh the mirror, reconcile after an outage."""
+        refreshed = 0.0
+        while True:
+            await asyncio.sleep(self.HEALTH_EVERY)
             try:
-                self.user_settings: Dict[str, dict] = json.loads(self._json_path.read_text())
-            except FileNotFoundError:
-                self.user_settings = {}
+                # writes can also land locally after a single failed call
+                pending  = breaker.open or self._outage_calls or self._outage_profiles
+                if not await probe(self._redis):
+                    continue
+                if pending:
+                    await self._reconcile()
+                for fn in self._healthy:
+                    await fn()
+                if pending or time.monotonic() - refreshed >= self.MIRROR_EVERY:
+                    await self._refresh_mirror()
+                    refreshed = time.monotonic()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                traceback.print_exc()
+
+    async def _refresh_mirror(self):
+        # in batches (no HGETALL): no single reply, or Redis stall, as big as every live call
+        r       = self._redis
+        active  = {int(k): int(v)   async for k, v in r.hscan_iter(self._H_ACTIVE, count=self.MIRROR_BATCH)}
+        started = {int(k): float(v) async for k, v in r.hscan_iter(self._H_STARTED, count=self.MIRROR_BATCH)}
+        anon    = {int(c) async for c in r.sscan_iter(self._S_ANON, count=self.MIRROR_BATCH)}
+        if breaker.open or self._outage_calls:      # local writes not pushed yet: keep them
+            return
+        self.active_calls, self.call_started, self.anon_channels = active, started, anon
+
+    def _mirror_call(self, cid: int, entry: tuple[int, bool]):
+        partner, anon = entry
+        if partner:
+            self.active_calls[cid] = partner
+            self.call_started.setdefault(cid, time.time())
+            (self.anon_channels.add if anon else self.anon_channels.discard)(cid)
+        elif self.active_calls.pop(cid, None) is not None:
+            self.call_started.pop(cid, None)
+            self.anon_channels.discard(cid)
+
+    def _mirror_profile(self, uid: int, entry: tuple[str | None, str | None]):
+        alias, avatar = entry
+        key  = str(uid)
+        data = {k: v for k, v in (("alias", alias), ("avatar_url", avatar)) if v}
+        self.user_settings.pop(key, None)           # re‑inserted as the most recent
+        if data:                                    # no entry already means "no profile"
+            self.user_settings[key] = data
+        # as bounded as the cache it mirrors; outage writes stay until _reconcile pushes them
+        excess = len(self.user_settings) - self.CACHE_SIZE
+        if excess > 0:
+            oldest = (k for k in self.user_settings if k not in self._outage_profiles)
+            for k in list(islice(oldest, excess)):
+                del self.user_settings[k]
 
-    # ───────── profile key helper ─────────
+    async def _reconcile(self):
+        """Push calls and profiles written during the outage, then drop stale caches."""
+        calls, self._outage_calls       = self._outage_calls, set()
+        profiles, self._outage_profiles = self._outage_profiles, set()
+        ended, tokens = [], []
+        pipe = self._redis.pipeline(transaction=False)
+        for cid in calls:
+            partner = self.active_calls.get(cid)
+            tokens.append(f"c:{cid}")
+            if not partner:
+                ended.append(cid)
+                continue
+            ts = int(self.call_started.get(cid, time.time()))
+            pipe.hset(self._H_ACTIVE, str(cid), str(partner))
+            pipe.hset(self._H_STARTED, str(cid), ts)
+            pipe.zadd(self._Z_CALLS, {str(cid): ts})
+            if cid in self.anon_channels:
+                pipe.sadd(self._S_ANON, str(cid))
+        for uid in profiles:
+            data = self.user_settings.get(uid)
+            if data:
+                pipe.hset(self._profile(uid), mapping=data)
+            tokens.append(f"p:{uid}")
+        try:
+            await pipe.execute()
+            for cid in ended:
+                # the "end" event was recorded locally when the call ended
+                await self._end_call(keys=self._end_keys(), args=[str(cid), self._C_INVAL, time.time(), 0])
+        except BaseException:
+            self._outage_calls    |= calls         # retried after the next good probe
+            self._outage_profiles |= profiles
+            raise
+        # invalidations published while we were cut off are lost
+        self._clear_caches()
+        for t in tokens:
+            await self._redis.publish(self._C_INVAL, t)
+        if calls or profiles:
+            print(f"[Redis] reconciled {len(calls)} channel(s), {len(profiles)} profile(s)")
+
+    # ───────── key helpers ─────────
     def _profile(self, uid: int | str) -> str:
         return f"{self._P_PROFILE}{uid}"
 
+    def _end_keys(self) -> list[str]:
+        return [self._H_ACTIVE, self._H_STARTED, self._S_ANON, self._Z_CALLS, self._H_SEEN, self._X_EVENTS]
+
+    # ───────── cache coherence ─────────
+    async def start(self):
+        """Subscribe to invalidations from other bot processes and start the health probe."""
+        if self._redis and self._listener is None:
+            breaker.on_change(self._breaker_changed)
+            self._listener = asyncio.create_task(self._listen())
+            self._watcher  = asyncio.create_task(self._watch())
+
+    async def _listen(self):
+        while True:
+            try:
+                # closed on the way out, so its connection goes back to the bounded pool
+                async with self._redis.pubsub() as pubsub:
+                    await pubsub.subscribe(self._C_INVAL)
+                    # anything published while we were disconnected is lost
+                    self._clear_caches()
+                    async for m in listen(pubsub):
+                        if m["type"] == "message":
+                            self._evict(m["data"])
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                if not breaker.open:
+                    traceback.print_exc()
+                await asyncio.sleep(1)
+
+    def _evict(self, token: str):
+        kind, _, key = token.partition(":")
+        if kind == "c":
+            self._calls.pop(int(key))
+        elif kind == "p":
+            self._profiles.pop(int(key))
+        elif kind in self._evictors:
+            self._evictors[kind](key)
+
+    async def _invalidate(self, *tokens: str):
+        for t in tokens:
+            self._evict(t)
+        for t in tokens:
+            await self._r.publish(self._C_INVAL, t)
+
+    async def _call_entry(self, cid: int) -> tuple[int, bool]:
+        entry = self._calls.get(cid)
+        if entry is None:
+            gen  = self._calls.gen
+            pipe = self._r.pipeline(transaction=False)
+            pipe.hget(self._H_ACTIVE, str(cid))
+            pipe.sismember(self._S_ANON, str(cid))
+            partner, anon = await pipe.execute()
+            entry = (int(partner) if partner else 0, bool(anon))
+            self._calls.put(cid, entry, gen)
+            self._mirror_call(cid, entry)
+        return entry
+
+    async def _profile_entry(self, uid: int) -> tuple[str | None, str | None]:
+        entry = self._profiles.get(uid)
+        if entry is None:
+            gen   = self._profiles.gen
+            entry = tuple(await self._r.hmget(self._profile(uid), "alias", "avatar_url"))
+            self._profiles.put(uid, entry, gen)
+            self._mirror_profile(uid, entry)
+        return entry
+
     # ───────── call control ─────────
     async def start_call(self, c1: int, c2: int, anon: bool):
         if self._r:
-            await self._r.hset(
-                self._H_ACTIVE,
-                mapping={str(c1): str(c2), str(c2): str(c1)}
-            )
             now = int(time.time())
-            await self._r.hset(
-                self._H_STARTED,
-                mapping={str(c1): now, str(c2): now}
-            )
-            if anon:
-                await self._r.sadd(self._S_ANON, str(c1), str(c2))
-            return
+            try:
+                async with self._r.pipeline(transaction=True) as pipe:
+                    pipe.hset(self._H_ACTIVE,  mapping={str(c1): str(c2), str(c2): str(c1)})
+                    pipe.hset(self._H_STARTED, mapping={str(c1): now, str(c2): now})
+                    pipe.zadd(self._Z_CALLS,   mapping={str(c1): now, str(c2): now})
+                    if anon:
+                        pipe.sadd(self._S_ANON, str(c1), str(c2))
+                    pipe.xadd(self._X_EVENTS, {"kind": "start", "ts": now, "a": c1, "b": c2, "anon": int(anon)},
+                              maxlen=self.EVENTS_KEPT, approximate=True)
+                    pipe.publish(self._C_INVAL, f"c:{c1}")
+                    pipe.publish(self._C_INVAL, f"c:{c2}")
+                    await pipe.execute()
+            except UNAVAILABLE:
+                pass                # record it locally; pushed back by _reconcile
+            else:
+                self._evict(f"c:{c1}")
+                self._evict(f"c:{c2}")
+                self._local_start(c1, c2, anon, now)
+                return
+
+        self._local_start(c1, c2, anon, time.time())
+        self._calls_changed(c1, c2)
+        self.record("start", a=c1, b=c2, anon=int(anon))
 
+    def _local_start(self, c1: int, c2: int, anon: bool, now: float):
         self.active_calls[c1] = c2
         self.active_calls[c2] = c1
-        now = time.time()
         self.call_started[c1] = self.call_started[c2] = now
         if anon:
             self.anon_channels.update({c1, c2})
 
     async def end_call(self, cid: int) -> Optional[int]:
         if self._r:
-            partner = await self._r.hget(self._H_ACTIVE, str(cid))
-            if partner:
-                await self._r.hdel(self._H_ACTIVE, str(cid), partner)
-                await self._r.hdel(self._H_STARTED, str(cid), partner)
-                await self._r.srem(self._S_ANON, str(cid), partner)
-                return int(partner)
-            return None
+            try:
+                partner = await self._end_call(
+                    keys=self._end_keys(), args=[str(cid), self._C_INVAL, int(time.time()), self.EVENTS_KEPT],
+                )
+            except UNAVAILABLE:
+                pass
+            else:
+                self._local_end(cid)
+                if partner:
+                    self._evict(f"c:{cid}")
+                    self._evict(f"c:{partner}")
+                    return int(partner)
+                return None
 
+        started = self.call_started.get(cid)
+        partner = self._local_end(cid)
+        if partner:
+            self._calls_changed(cid, partner)
+            self.record("end", a=cid, b=partner, secs=max(0, time.time() - (started or time.time())))
+        return partner
+
+    def _local_end(self, cid: int) -> Optional[int]:
         partner = self.active_calls.pop(cid, None)
         if partner:
             self.active_calls.pop(partner, None)
@@ -84,61 +416,227 @@ class State:
             self.call_started.pop(partner, None)
             self.anon_channels.discard(cid)
             self.anon_channels.discard(partner)
+            self.last_activity.pop(cid, None)
+            self.last_activity.pop(partner, None)
         return partner
 
+    async def touch(self, cid: int):
+        """Record relay activity on `cid` (written at most once per TOUCH_EVERY)."""
+        if cid in self._touched:
+            return
+        self._touched.put(cid, True)
+        if self._r:
+            try:
+                await self._r.hset(self._H_SEEN, str(cid), int(time.time()))
+                return
+            except UNAVAILABLE:
+                pass
+        self.last_activity[cid] = time.time()
+
+    async def scan_calls(self, batch: int = 200):
+        """
+        Yield lists of (ch_id, partner_id or None, started, last_active) for
+        every indexed call channel, oldest call first, `batch` per step.
+        Raises UNAVAILABLE if Redis fails part way – a partial scan is no
+        basis for ending calls.
+        """
+        if self._r:
+            start = 0
+            while True:
+                rows = await self._r.zrange(self._Z_CALLS, start, start + batch - 1, withscores=True)
+                if not rows:
+                    return
+                ids  = [c for c, _ in rows]
+                pipe = self._r.pipeline(transaction=False)
+                pipe.hmget(self._H_ACTIVE, *ids)
+                pipe.hmget(self._H_SEEN,   *ids)
+                partners, seen = await pipe.execute()
+                yield [(int(c), int(p) if p else None, ts, float(a) if a else ts)
+                       for (c, ts), p, a in zip(rows, partners, seen)]
+                start += batch
+            return
+
+        rows = sorted(self.call_started.items(), key=lambda kv: kv[1])
+        for i in range(0, len(rows), batch):
+            yield [(c, self.active_calls.get(c), ts, self.last_activity.get(c, ts))
+                   for c, ts in rows[i:i + batch]]
+
+    async def index_calls(self) -> int:
+        """Add calls started before the start‑time index existed; returns how many."""
+        if not self._r:
+            return 0
+        added = 0
+        try:
+            async for cid, ts in self._r.hscan_iter(self._H_STARTED, count=500):
+                added += await self._r.zadd(self._Z_CALLS, {cid: int(ts)}, nx=True)
+        except UNAVAILABLE:
+            pass                # the rest is indexed on the next start
+        return added
+
+    async def try_lock(self, name: str, ttl: int) -> bool:
+        """Claim a cluster‑wide job slot for `ttl` seconds (always True without Redis)."""
+        if self._redis is None:
+            return True
+        if breaker.open:        # the mirror may be stale – leave cluster jobs until Redis is back
+            return False
+        try:
+            return bool(await self._redis.set(f"{self._K_LOCK}{name}", "1", nx=True, ex=ttl))
+        except UNAVAILABLE:
+            return False
+
+    # reads fall back to the in‑memory mirror when Redis fails mid‑request
     async def is_in_call(self, cid: int) -> bool:
         if self._r:
-            return await self._r.hexists(self._H_ACTIVE, str(cid))
+            try:
+                return bool((await self._call_entry(cid))[0])
+            except UNAVAILABLE:
+                pass
         return cid in self.active_calls
 
     async def get_call_duration(self, cid: int) -> Optional[int]:
         if self._r:
-            ts = await self._r.hget(self._H_STARTED, str(cid))
-            return int((time.time() - int(ts)) // 60) if ts else None
+            try:
+                ts = await self._r.hget(self._H_STARTED, str(cid))
+                return int((time.time() - int(ts)) // 60) if ts else None
+            except UNAVAILABLE:
+                pass
         start = self.call_started.get(cid)
         return int((time.time() - start) // 60) if start else None
 
     async def is_anonymous(self, cid: int) -> bool:
         if self._r:
-            return await self._r.sismember(self._S_ANON, str(cid))
+            try:
+                return (await self._call_entry(cid))[1]
+            except UNAVAILABLE:
+                pass
         return cid in self.anon_channels
 
     async def get_active_calls_count(self) -> int:
         if self._r:
-            return (await self._r.hlen(self._H_ACTIVE)) // 2
+            try:
+                return (await self._r.hlen(self._H_ACTIVE)) // 2
+            except UNAVAILABLE:
+                pass
         return len(self.active_calls) // 2
 
     async def get_all_active_calls(self) -> Dict[int, int]:
         if self._r:
-            calls = await self._r.hgetall(self._H_ACTIVE)
-            return {int(k): int(v) for k, v in calls.items()}
+            try:
+                calls = await self._r.hgetall(self._H_ACTIVE)
+                return {int(k): int(v) for k, v in calls.items()}
+            except UNAVAILABLE:
+                pass
         return self.active_calls.copy()
 
+    async def get_call_context(self, cid: int, user: discord.abc.User | None = None,
+                               cooldown: TokenBucket | None = None) -> Optional[CallContext]:
+        """
+        Partner, anon flag and the user's alias/avatar in a single round trip.
+        With `cooldown`, a token is also taken from the user's bucket – in the
+        same round trip when the lookup needs one – and `allowed` tells.
+        """
+        if self._r:
+            call    = self._calls.get(cid)
+            profile = self._profiles.get(user.id) if user is not None else (None, None)
+            if call is not None and (not call[0] or call[1] or profile is not None):
+                # idle channel, anon call or fully cached → no network I/O
+                if not call[0]:
+                    return None
+                return await self._spend(self._context(call[0], call[1], user, *(profile or (None, None))),
+                                         user, cooldown)
+
+            # fetch whatever is missing in one round trip
+            calls_gen, profiles_gen = self._calls.gen, self._profiles.gen
+            pipe = self._r.pipeline(transaction=False)
+            if call is None:
+                pipe.hget(self._H_ACTIVE, str(cid))
+                pipe.sismember(self._S_ANON, str(cid))
+            if profile is None:
+                pipe.hmget(self._profile(user.id), "alias", "avatar_url")
+            if cooldown is not None:
+                await cooldown.queue(pipe, user.id)
+            try:
+                res = await pipe.execute()
+            except UNAVAILABLE:
+                ctx = self._local_context(cid, user)
+                if ctx is not None and cooldown is not None:
+                    ctx = ctx._replace(allowed=cooldown.take_local(user.id).allowed)
+                return ctx
+            allowed = cooldown.verdict(res.pop()).allowed if cooldown is not None else True
+            if call is None:
+                partner, anon, *res = res
+                call = (int(partner) if partner else 0, bool(anon))
+                self._calls.put(cid, call, calls_gen)
+                self._mirror_call(cid, call)
+            if profile is None:
+                profile = tuple(res[0])
+                self._profiles.put(user.id, profile, profiles_gen)
+                self._mirror_profile(user.id, profile)
+            if not call[0]:
+                return None
+            return self._context(call[0], call[1], user, *profile)._replace(allowed=allowed)
+
+        return await self._spend(self._local_context(cid, user), user, cooldown)
+
+    @staticmethod
+    async def _spend(ctx: Optional[CallContext], user: discord.abc.User | None,
+                     cooldown: TokenBucket | None) -> Optional[CallContext]:
+        if ctx is None or cooldown is None:
+            return ctx
+        return ctx._replace(allowed=(await cooldown.take(user.id)).allowed)
+
+    def _local_context(self, cid: int, user: discord.abc.User | None) -> Optional[CallContext]:
+        partner = self.active_calls.get(cid)
+        if not partner:
+            return None
+        profile = self.user_settings.get(str(user.id), {}) if user is not None else {}
+        return self._context(partner, cid in self.anon_channels, user,
+                             profile.get("alias"), profile.get("avatar_url"))
+
+    def _context(self, partner: int, anon: bool, user: discord.abc.User | None,
+                 alias: str | None, avatar: str | None) -> CallContext:
+        if user is None:
+            return CallContext(partner, anon, None, None)
+        if anon:
+            return CallContext(partner, True, f"Stranger {str(user.id)[-4:]}", self.DEFAULT_AV)
+        return CallContext(partner, False, alias or user.display_name,
+                           avatar or user.display_avatar.url)
+
     # ───────── profile helpers ─────────
     async def alias_for(self, user: discord.User, anon: bool) -> str:
         if anon:
             return f"Stranger {str(user.id)[-4:]}"
         if self._r:
-            a = await self._r.hget(self._profile(user.id), "alias")
-            return a or user.display_name
+            try:
+                a = (await self._profile_entry(user.id))[0]
+                return a or user.display_name
+            except UNAVAILABLE:
+                pass
         return self.user_settings.get(str(user.id), {}).get("alias", user.display_name)
 
     async def avatar_for(self, user: discord.User, anon: bool) -> str:
         if anon:
             return self.DEFAULT_AV
         if self._r:
-            url = await self._r.hget(self._profile(user.id), "avatar_url")
-            return url or user.display_avatar.url
+            try:
+                url = (await self._profile_entry(user.id))[1]
+                return url or user.display_avatar.url
+            except UNAVAILABLE:
+                pass
         return self.user_settings.get(str(user.id), {}).get("avatar_url", user.display_avatar.url)
 
     async def set_profile(self, uid: int, alias: str | None, avatar_url: str | None):
         if self._r:
             key = self._profile(uid)
-            if alias is not None:
-                await self._r.hset(key, "alias", alias.strip()[:32])
-            if avatar_url is not None:
-                await self._r.hset(key, "avatar_url", avatar_url.strip())
-            return
+            try:
+                if alias is not None:
+                    await self._r.hset(key, "alias", alias.strip()[:32])
+                if avatar_url is not None:
+                    await self._r.hset(key, "avatar_url", avatar_url.strip())
+                await self._invalidate(f"p:{uid}")
+                return
+            except UNAVAILABLE:
+                pass            # only the fields set here are pushed back on reconcile
 
         data = self.user_settings.get(str(uid), {})
         if alias is not None:
@@ -146,6 +644,6 @@ class State:
         if avatar_url is not None:
             data["avatar_url"] = avatar_url.strip()
         self.user_settings[str(uid)] = data
-        self._json_path.write_text(json.dumps(self.user_settings, indent=2))
+        self._profile_changed(uid)
 
 state = State()
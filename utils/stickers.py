@@ -0,0 +1,151 @@
+# ──────────────────────────────────────────────
+# utils/stickers.py
+# ──────────────────────────────────────────────
+"""
+Two‑tier LRU cache of sticker images keyed by sticker id.
+
+A sticker id always refers to the same image, so entries never go stale.
+Hot stickers are served from memory; colder ones from a disk directory.
+Both tiers evict least‑recently‑used entries to stay within a byte budget.
+"""
+from __future__ import annotations
+import os
+import asyncio
+import pathlib
+import tempfile
+from collections import OrderedDict
+from typing import Dict
+
+import aiofiles
+import aiohttp
+import discord
+
+MEM_BYTES  = int(float(os.getenv("UP_STICKER_CACHE_MEM_MB",  "32"))  * 1024 * 1024)
+DISK_BYTES = int(float(os.getenv("UP_STICKER_CACHE_DISK_MB", "256")) * 1024 * 1024)
+DISK_DIR   = pathlib.Path(os.getenv("UP_STICKER_CACHE_DIR",
+                                    os.path.join(tempfile.gettempdir(), "userphone-stickers")))
+
+
+def extension(st: discord.StickerItem) -> str:
+    # GIF stickers keep their animation; APNG/PNG/Lottie go out as .png
+    return "gif" if st.format is discord.StickerFormatType.gif else "png"
+
+
+class _Tier:
+    """Byte‑budgeted LRU bookkeeping: key -> size."""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.used   = 0
+        self.sizes: "OrderedDict[int, int]" = OrderedDict()
+
+    def touch(self, key: int) -> bool:
+        if key in self.sizes:
+            self.sizes.move_to_end(key)
+            return True
+        return False
+
+    def add(self, key: int, size: int) -> list[int]:
+        """Record `key` and return the keys evicted to make room."""
+        self.used += size - self.sizes.pop(key, 0)
+        self.sizes[key] = size
+        evicted = []
+        while self.used > self.budget and len(self.sizes) > 1:
+            old, old_size = self.sizes.popitem(last=False)
+            self.used -= old_size
+            evicted.append(old)
+        return evicted
+
+    def discard(self, key: int):
+        self.used -= self.sizes.pop(key, 0)
+
+
+class StickerCache:
+    def __init__(self, mem_bytes: int = MEM_BYTES, disk_bytes: int = DISK_BYTES,
+                 disk_dir: pathlib.Path = DISK_DIR):
+        self._mem_tier  = _Tier(mem_bytes)
+        self._mem:  Dict[int, bytes] = {}
+        self._disk_tier = _Tier(disk_bytes)
+        self._dir = disk_dir
+        self._disk_ready = False
+        self._inflight: Dict[int, asyncio.Future] = {}
+
+    def _path(self, sid: int) -> pathlib.Path:
+        return self._dir / f"{sid}.bin"
+
+    def _load_disk_index(self):
+        """Rebuild the disk LRU from what a previous run left behind (oldest first)."""
+        self._disk_ready = True
+        try:
+            self._dir.mkdir(parents=True, exist_ok=True)
+            entries = sorted((p.stat().st_mtime, p) for p in self._dir.glob("*.bin"))
+        except OSError:
+            self._disk_tier.budget = 0
+            return
+        for _, p in entries:
+            for old in self._disk_tier.add(int(p.stem), p.stat().st_size):
+                self._path(old).unlink(missing_ok=True)
+
+    def _remember(self, sid: int, data: bytes):
+        for old in self._mem_tier.add(sid, len(data)):
+            self._mem.pop(old, None)
+        self._mem[sid] = data
+
+    async def get(self, st: discord.StickerItem, session: aiohttp.ClientSession) -> bytes:
+        """Sticker bytes from memory, disk, or (once per id) the CDN."""
+        if self._mem_tier.touch(st.id):
+            return self._mem[st.id]
+        if st.id in self._inflight:
+            return await asyncio.shield(self._inflight[st.id])
+
+        fut = asyncio.get_running_loop().create_future()
+        self._inflight[st.id] = fut
+        try:
+            data = await self._load(st, session)
+            fut.set_result(data)
+            return data
+        except asyncio.CancelledError:
+            fut.cancel()
+            raise
+        except Exception as exc:
+            fut.set_exception(exc)
+            fut.exception()         # mark retrieved if nobody else was waiting
+            raise
+        finally:
+            del self._inflight[st.id]
+
+    async def _load(self, st: discord.StickerItem, session: aiohttp.ClientSession) -> bytes:
+        if not self._disk_ready:
+            self._load_disk_index()
+
+        if self._disk_tier.touch(st.id):
+            try:
+                async with aiofiles.open(self._path(st.id), "rb") as f:
+                    data = await f.read()
+                self._remember(st.id, data)
+                return data
+            except OSError:
+                self._disk_tier.discard(st.id)     # gone or unreadable – re‑fetched below
+
+        async with session.get(st.url) as resp:
+            resp.raise_for_status()
+            data = await resp.read()
+        self._remember(st.id, data)
+        await self._store(st.id, data)
+        return data
+
+    async def _store(self, sid: int, data: bytes):
+        if len(data) > self._disk_tier.budget:
+            return
+        tmp = self._path(sid).with_suffix(".tmp")
+        try:
+            async with aiofiles.open(tmp, "wb") as f:
+                await f.write(data)
+            os.replace(tmp, self._path(sid))
+        except OSError:
+            return
+        for old in self._disk_tier.add(sid, len(data)):
+            self._path(old).unlink(missing_ok=True)
+
+
+sticker_cache = StickerCache()
@@ -1,30 +1,115 @@
 # ──────────────────────────────────────────────
 # utils/webhooks.py
 # ──────────────────────────────────────────────
+import asyncio
 import discord
-from typing import Optional
-from .state import state
+from typing import Dict, Iterable, Optional
+from .state  import state
+from .redis_pool import UNAVAILABLE
+from .outbox import Outbox
+from .http   import get_session
+
+_H_WEBHOOKS = "up:webhooks"     # ch_id -> "webhook_id:token"
+
+_pending: Dict[int, asyncio.Task] = {}
 
 async def get_webhook(ch: discord.TextChannel) -> Optional[discord.Webhook]:
-    if ch.id in state.webhooks:
-        return state.webhooks[ch.id]
+    """
+    The channel's `userphone` webhook: from memory, then Redis, then Discord.
+    Concurrent callers for the same channel share one lookup/creation.
+    """
+    wh = state.webhooks.get(ch.id)
+    if wh is not None:
+        return wh
+    task = _pending.get(ch.id)
+    if task is None:
+        task = _pending[ch.id] = asyncio.create_task(_resolve(ch))
+        task.add_done_callback(lambda _: _pending.pop(ch.id, None))
+    return await asyncio.shield(task)
+
+async def _resolve(ch: discord.TextChannel) -> Optional[discord.Webhook]:
+    stored = None
+    if state._r:
+        try:
+            stored = await state._r.hget(_H_WEBHOOKS, str(ch.id))
+        except UNAVAILABLE:
+            pass            # ask Discord: an existing `userphone` hook is reused
+        if stored:
+            wid, token = stored.split(":", 1)
+            wh = discord.Webhook.partial(int(wid), token, session=get_session())
+            state.webhooks.put(ch.id, wh)
+            return wh
     try:
-        wh = next((w for w in await ch.webhooks() if w.name == "userphone"), None)
+        wh = next((w for w in await ch.webhooks() if w.name == "userphone" and w.token), None)
         if wh is None:
             wh = await ch.create_webhook(name="userphone")
-        state.webhooks[ch.id] = wh
-        return wh
     except discord.Forbidden:
         return None
+    state.webhooks.put(ch.id, wh)
+    if state._r:
+        try:
+            await state._r.hset(_H_WEBHOOKS, str(ch.id), f"{wh.id}:{wh.token}")
+        except UNAVAILABLE:
+            pass
+    return wh
+
+async def warm_webhooks(*channels: discord.TextChannel):
+    """Resolve webhooks ahead of the first relayed message."""
+    await asyncio.gather(*(get_webhook(ch) for ch in channels), return_exceptions=True)
 
 async def remove_webhook(cid: int):
-    state.webhooks.pop(cid, None)
+    """Forget a webhook that no longer works (deleted in Discord)."""
+    state.webhooks.pop(cid)
+    if state._r:
+        try:
+            await state._r.hdel(_H_WEBHOOKS, str(cid))
+        except UNAVAILABLE:
+            pass            # the next lookup finds it broken again and retries
 
 async def forward_message(content, files, alias, avatar, dest: discord.TextChannel):
+    """Relay through `dest`'s send queue; the post may also carry other messages."""
+    return await outbox.submit(dest, content, files, alias, avatar)
+
+async def _post(content, files, alias, avatar, dest: discord.TextChannel):
     wh = await get_webhook(dest)
     if wh:
-        return await wh.send(content=content or None,
-                             username=alias,
-                             avatar_url=avatar,
-                             files=files or [])
-    return await dest.send(f"**{alias}**: {content}", files=files or [])
+        try:
+            return await wh.send(content=content or None,
+                                 username=alias,
+                                 avatar_url=avatar,
+                                 files=files or [],
+                                 wait=True)
+        except discord.NotFound:
+            # webhook was deleted in Discord – drop it and fall back this once
+            await remove_webhook(dest.id)
+            for f in files or []:
+                f.reset()
+    # the alias prefix can push a full‑length message over the limit
+    return await dest.send(f"**{alias}**: {content}"[:Outbox.MAX_CONTENT], files=files or [])
+
+outbox = Outbox(_post)
+
+async def edit_message(dest: discord.TextChannel, mid: int, content: str, alias: str | None = None):
+    """Edit a relayed copy in place by id – no fetch needed."""
+    wh = await get_webhook(dest)
+    if wh:
+        try:
+            return await wh.edit_message(mid, content=content)
+        except discord.HTTPException:
+            pass                # not a webhook post (sent via the fallback)
+    content = f"**{alias}**: {content}" if alias else content
+    await dest.get_partial_message(mid).edit(content=content[:Outbox.MAX_CONTENT])
+
+async def delete_messages(dest: discord.TextChannel, mids: Iterable[int]):
+    """Delete relayed copies in `dest`; webhook posts need no extra permission."""
+    wh = await get_webhook(dest)
+
+    async def _delete(mid: int):
+        if wh:
+            try:
+                return await wh.delete_message(mid)
+            except discord.HTTPException:
+                pass            # not a webhook post (sent via the fallback)
+        await dest.get_partial_message(mid).delete()
+
+    await asyncio.gather(*(_delete(m) for m in mids), return_exceptions=True)